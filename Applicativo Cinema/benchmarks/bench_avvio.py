@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cinema_ticketing.app import _seed_db, build_app_context  # noqa: E402
+from cinema_ticketing.domain import (  # noqa: E402
+    Biglietto,
+    EsitoPagamento,
+    OrdineAcquisto,
+    Pagamento,
+    StatoOrdine,
+)
+from cinema_ticketing.persistence import save_db  # noqa: E402
+from main import TABELLE_COMANDI  # noqa: E402
+
+
+def genera_stato(path: str, ordini: int) -> None:
+    db = _seed_db()
+    t0 = datetime(2025, 1, 1)
+    for i in range(ordini):
+        o = OrdineAcquisto(
+            id=f"ord_{i:012x}",
+            cliente_id="c1",
+            spettacolo_id="sp1",
+            posti_ids=["p1"],
+            totale_eur=9.90,
+            stato=StatoOrdine.PAGATO,
+            creato_il=t0 + timedelta(seconds=i),
+        )
+        db.ordini[o.id] = o
+        p = Pagamento(
+            id=f"pay_{i:012x}",
+            ordine_id=o.id,
+            provider="MockPay",
+            importo_eur=9.90,
+            esito=EsitoPagamento.AUTORIZZATO,
+            transaction_ref=f"MockPay-CHK-{o.id}",
+            ricevuto_il=o.creato_il,
+        )
+        db.pagamenti[p.id] = p
+        b = Biglietto(id=f"tkt_{i:012x}", ordine_id=o.id, qr_code="x" * 22, emesso_il=o.creato_il)
+        db.biglietti[b.id] = b
+    save_db(db, path)
+
+
+def misura(path: str, tabelle: Optional[Iterable[str]], ripetizioni: int) -> float:
+    migliore = float("inf")
+    for _ in range(ripetizioni):
+        t0 = time.perf_counter()
+        build_app_context(state_file=path, tabelle=tabelle)
+        migliore = min(migliore, time.perf_counter() - t0)
+    return migliore
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Tempo di avvio di build_app_context: caricamento completo vs lazy")
+    ap.add_argument("--ordini", type=int, nargs="+", default=[0, 10_000, 100_000, 300_000])
+    ap.add_argument("--ripetizioni", type=int, default=3)
+    args = ap.parse_args()
+
+    print(f"{'ordini':>9} {'file MB':>8} {'comando':>12} {'completo ms':>12} {'lazy ms':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.ordini:
+            path = os.path.join(tmp, f"stato_{n}.json")
+            genera_stato(path, n)
+            mb = os.path.getsize(path) / 1e6
+            for cmd in ("list-shows", "show-seats", "buy"):
+                completo = misura(path, None, args.ripetizioni)
+                lazy = misura(path, TABELLE_COMANDI[cmd], args.ripetizioni)
+                print(f"{n:>9} {mb:>8.1f} {cmd:>12} {completo * 1e3:>12.1f} {lazy * 1e3:>9.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
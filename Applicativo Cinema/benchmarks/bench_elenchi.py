@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cinema_ticketing.domain import OrdineAcquisto, StatoOrdine  # noqa: E402
+from cinema_ticketing.sqlite_repository import SqliteDB  # noqa: E402
+
+
+def popola(db: SqliteDB, n: int, seme: int) -> None:
+    rnd = random.Random(seme)
+    inizio = datetime(2025, 1, 1)
+    for i in range(n):
+        db.save_ordine(
+            OrdineAcquisto(
+                id=f"ord_{i:07d}",
+                cliente_id=f"c{rnd.randrange(5_000)}",
+                spettacolo_id=f"sp{rnd.randrange(500)}",
+                posti_ids=["p1", "p2"],
+                totale_eur=19.8,
+                stato=rnd.choice(list(StatoOrdine)),
+                creato_il=inizio + timedelta(seconds=rnd.randrange(31_536_000)),
+            )
+        )
+    db.commit()
+
+
+def misura(nome: str, funzione) -> None:
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    righe = funzione()
+    durata = time.perf_counter() - t0
+    _, picco = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{nome:34s} {righe:8,} righe  {durata:6.2f} s  picco {picco / 2**20:7.1f} MiB")
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="orders-list: elenco completo ordinato contro streaming a blocchi")
+    ap.add_argument("--ordini", type=int, default=200_000)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = SqliteDB(os.path.join(tmp, "stato.sqlite3"))
+        popola(db, args.ordini, seme=1)
+        print(f"{args.ordini:,} ordini in SQLite\n")
+        misura("list_ordini + sorted", lambda: len(sorted(db.list_ordini(), key=lambda o: o.creato_il)))
+        misura("iter_ordini (streaming)", lambda: sum(1 for _ in db.iter_ordini()))
+        misura(
+            "iter_ordini PAGATO, un mese",
+            lambda: sum(1 for _ in db.iter_ordini(stato=StatoOrdine.PAGATO, dal=datetime(2025, 3, 1), al=datetime(2025, 4, 1))),
+        )
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
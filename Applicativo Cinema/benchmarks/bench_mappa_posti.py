@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cinema_ticketing.domain import DisponibilitaPosti, StatoPosto  # noqa: E402
+from cinema_ticketing.seatmap import MappaPosti  # noqa: E402
+
+
+def _layout_dict(spettacoli: int, righe: int, colonne: int) -> Dict[Tuple[str, str], DisponibilitaPosti]:
+    disp: Dict[Tuple[str, str], DisponibilitaPosti] = {}
+    for s in range(spettacoli):
+        sp_id = f"sp{s}"
+        for i in range(righe * colonne):
+            posto_id = f"p{i + 1}"
+            disp[(sp_id, posto_id)] = DisponibilitaPosti(sp_id, posto_id, StatoPosto.LIBERO)
+    return disp
+
+
+def _layout_mappa(spettacoli: int, righe: int, colonne: int) -> Dict[str, MappaPosti]:
+    return {f"sp{s}": MappaPosti(f"sp{s}", righe, colonne, StatoPosto.LIBERO) for s in range(spettacoli)}
+
+
+def _memoria(build: Callable[[], object]) -> Tuple[object, int]:
+    gc.collect()
+    tracemalloc.start()
+    obj = build()
+    corrente, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, corrente
+
+
+def _cronometra(fn: Callable[[], object], ripetizioni: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(ripetizioni):
+        fn()
+    return (time.perf_counter() - t0) / ripetizioni
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Confronto memoria/throughput: dict di DisponibilitaPosti vs MappaPosti")
+    ap.add_argument("--spettacoli", type=int, default=300)
+    ap.add_argument("--righe", type=int, default=15)
+    ap.add_argument("--colonne", type=int, default=22)
+    ap.add_argument("--ripetizioni", type=int, default=200)
+    args = ap.parse_args()
+
+    posti = args.righe * args.colonne
+    righe_totali = args.spettacoli * posti
+    print(f"{args.spettacoli} spettacoli x {posti} posti = {righe_totali} righe disponibilità\n")
+
+    disp, mem_dict = _memoria(lambda: _layout_dict(args.spettacoli, args.righe, args.colonne))
+    mappe, mem_mappa = _memoria(lambda: _layout_mappa(args.spettacoli, args.righe, args.colonne))
+    print(f"memoria dict:   {mem_dict / 1e6:9.2f} MB ({mem_dict / righe_totali:6.1f} B/posto)")
+    print(f"memoria mappa:  {mem_mappa / 1e6:9.2f} MB ({mem_mappa / righe_totali:6.1f} B/posto)\n")
+
+    # lo scenario "prima" filtra l'intera tabella come faceva list_disponibilita_spettacolo
+    sp_id = f"sp{args.spettacoli // 2}"
+    mappa = mappe[sp_id]
+    for i in range(0, posti, 3):
+        mappa.imposta(i, StatoPosto.VENDUTO)
+        disp[(sp_id, f"p{i + 1}")].stato = StatoPosto.VENDUTO
+
+    def liberi_dict() -> int:
+        return sum(1 for (s, _), d in disp.items() if s == sp_id and d.stato == StatoPosto.LIBERO)
+
+    def occupazione_dict() -> List[int]:
+        occ = [0] * args.righe
+        for (s, posto_id), d in disp.items():
+            if s == sp_id and d.stato != StatoPosto.LIBERO:
+                occ[(int(posto_id[1:]) - 1) // args.colonne] += 1
+        return occ
+
+    risultati = [
+        ("conta liberi", liberi_dict, lambda: mappa.conta(StatoPosto.LIBERO)),
+        ("occupazione per riga", occupazione_dict, mappa.occupazione_per_riga),
+        (
+            "elenco liberi",
+            lambda: [d for (s, _), d in disp.items() if s == sp_id and d.stato == StatoPosto.LIBERO],
+            lambda: list(mappa.indici(StatoPosto.LIBERO)),
+        ),
+    ]
+    rip_dict = max(1, args.ripetizioni // 20)
+    for nome, f_dict, f_mappa in risultati:
+        t_dict = _cronometra(f_dict, rip_dict)
+        t_mappa = _cronometra(f_mappa, args.ripetizioni)
+        print(f"{nome:22s} dict {t_dict * 1e6:11.1f} µs   mappa {t_mappa * 1e6:9.2f} µs   x{t_dict / t_mappa:,.0f}")
+
+    t = _cronometra(lambda: [mappa.blocco_contiguo(r, 4) for r in range(1, args.righe + 1)], args.ripetizioni)
+    print(f"{'blocco 4 contigui':22s} mappa {t * 1e6:9.2f} µs (tutte le righe)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
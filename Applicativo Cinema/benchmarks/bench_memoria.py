@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import tracemalloc
+from typing import Any, Callable, Iterable, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_snapshot import genera_db  # noqa: E402
+from cinema_ticketing.domain import StatoPosto  # noqa: E402
+from cinema_ticketing.persistence import load_db, save_db  # noqa: E402
+from cinema_ticketing.repositories import InMemoryDB  # noqa: E402
+
+CATALOGO = ("clienti", "films", "sale", "posti", "spettacoli")
+
+
+def trattenuta(crea: Callable[[], Any]) -> Tuple[Any, int]:
+    # byte ancora allocati dopo la costruzione: quanto resta residente, non il picco
+    gc.collect()
+    tracemalloc.start()
+    obj = crea()
+    gc.collect()
+    corrente, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, corrente
+
+
+def carica(path: str, tabelle: Optional[Iterable[str]]) -> Callable[[], Any]:
+    return lambda: load_db(path, tabelle=tabelle)
+
+
+def come_oggetti(db: InMemoryDB) -> Callable[[], Any]:
+    # riferimento: la stessa disponibilità come un oggetto DisponibilitaPosti per riga
+    return lambda: list(db.iter_disponibilita())
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Memoria residente per milione di righe posti e per ordine")
+    ap.add_argument("--righe-posti", type=int, default=1_000_000)
+    ap.add_argument("--ordini", type=int, default=200_000)
+    ap.add_argument(
+        "--quota-hold", type=float, default=0.05, help="quota di spettacoli con hold in corso (gli altri già conclusi)"
+    )
+    args = ap.parse_args()
+
+    db = genera_db(args.righe_posti, args.ordini)
+    mappe = list(db.iter_mappe())
+    for mappa in mappe[int(len(mappe) * args.quota_hold) :]:
+        for i in list(mappa.indici(StatoPosto.BLOCCATO)):
+            mappa.imposta(i, StatoPosto.VENDUTO)
+    righe = sum(1 for _ in db.iter_disponibilita())
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "stato.json")
+        save_db(db, path)
+        del db
+
+        _, catalogo = trattenuta(carica(path, CATALOGO))
+        caricato, con_posti = trattenuta(carica(path, CATALOGO + ("disponibilita",)))
+        _, oggetti = trattenuta(come_oggetti(caricato))
+        del caricato
+        _, con_ordini = trattenuta(carica(path, CATALOGO + ("ordini",)))
+
+    # byte per riga = MB per milione di righe
+    print(f"{righe} righe disponibilità ({args.quota_hold:.0%} degli spettacoli con hold), {args.ordini} ordini")
+    print(f"disponibilità residente:            {(con_posti - catalogo) / righe:8.1f} MB per milione di righe")
+    print(f"come oggetti DisponibilitaPosti:    {oggetti / righe:8.1f} MB per milione di righe")
+    print(f"ordini residenti:                   {(con_ordini - catalogo) / args.ordini:8.0f} byte per ordine")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cinema_ticketing.domain import (  # noqa: E402
+    DisponibilitaPosti,
+    Film,
+    Posto,
+    SalaCinema,
+    Spettacolo,
+    StatoPosto,
+)
+from cinema_ticketing.repositories import InMemoryDB, SeedData  # noqa: E402
+from cinema_ticketing.services import ServizioPosti  # noqa: E402
+
+
+def genera_sala(righe: int, colonne: int, occupazione: float, seme: int) -> InMemoryDB:
+    rnd = random.Random(seme)
+    sala = SalaCinema(id="s1", nome="1", righe=righe, colonne=colonne)
+    posti = [
+        Posto(id=f"p{(r - 1) * colonne + c}", riga=r, colonna=c, sala_id=sala.id)
+        for r in range(1, righe + 1)
+        for c in range(1, colonne + 1)
+    ]
+    sp = Spettacolo(id="sp1", film_id="f1", sala_id=sala.id, inizio=datetime(2025, 1, 1, 21), prezzo_eur=9.9)
+    db = InMemoryDB()
+    db.load_seed(
+        SeedData(
+            clienti=[],
+            films=[Film(id="f1", titolo="Interstellar", durata_min=169)],
+            sale=[sala],
+            posti=posti,
+            spettacoli=[sp],
+            disponibilita=[
+                DisponibilitaPosti(sp.id, p.id, StatoPosto.VENDUTO if rnd.random() < occupazione else StatoPosto.LIBERO)
+                for p in posti
+            ],
+        )
+    )
+    return db
+
+
+def blocco_forza_bruta(db: InMemoryDB, n: int) -> bool:
+    mappa = db.mappa_posti("sp1")
+    return any(mappa.blocco_contiguo(r, n) is not None for r in range(1, mappa.righe + 1))
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="migliori_posti su una sala frammentata con aggiornamenti incrementali")
+    ap.add_argument("--righe", type=int, default=20)
+    ap.add_argument("--colonne", type=int, default=25)
+    ap.add_argument("--occupazione", type=float, default=0.6)
+    ap.add_argument("--query", type=int, default=20_000)
+    args = ap.parse_args()
+
+    db = genera_sala(args.righe, args.colonne, args.occupazione, seme=1)
+    servizio = ServizioPosti(db)
+    rnd = random.Random(2)
+    posti = list(db.posti)
+    print(f"sala {args.righe}x{args.colonne} ({len(posti)} posti), occupazione iniziale {args.occupazione:.0%}\n")
+
+    for n in (1, 2, 4, 6):
+        tempi = []
+        for _ in range(args.query):
+            # ogni query è preceduta da un cambio di stato casuale: l'indice si aggiorna solo sulla riga toccata
+            posto = rnd.choice(posti)
+            stato = StatoPosto.LIBERO if rnd.random() < 0.4 else StatoPosto.VENDUTO
+            db.set_stato_posto("sp1", posto, stato)
+            t0 = time.perf_counter()
+            etichette = servizio.migliori_posti("sp1", n)
+            tempi.append(time.perf_counter() - t0)
+            if (etichette is None) == blocco_forza_bruta(db, n):
+                raise AssertionError(f"Risultato incoerente con la ricerca esaustiva (n={n})")
+        tempi.sort()
+        media = sum(tempi) / len(tempi)
+        p99 = tempi[int(len(tempi) * 0.99)]
+        print(f"n={n}: media {media * 1e6:7.1f} µs   p99 {p99 * 1e6:7.1f} µs")
+        if p99 >= 1e-3:
+            raise AssertionError(f"migliori_posti oltre 1 ms al p99 (n={n})")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
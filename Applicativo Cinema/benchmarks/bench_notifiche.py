@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cinema_ticketing.adapters import LentoAdattatoreNotifiche  # noqa: E402
+from cinema_ticketing.app import build_app_context  # noqa: E402
+from cinema_ticketing.domain import EsitoPagamento  # noqa: E402
+from cinema_ticketing.notifications import DispatcherNotifiche, Outbox, outbox_path  # noqa: E402
+
+
+def acquisti(ctx, n: int) -> list:
+    etichette = [f"{r}{c}" for r in "ABCD" for c in range(1, 6)]
+    pagamenti = []
+    for et in etichette[:n]:
+        _, pagamento = ctx.gestore.avvia_acquisto("c1", "sp1", et)
+        pagamenti.append(pagamento.id)
+    return pagamenti
+
+
+def latenza_webhook(ctx, pagamenti: list) -> float:
+    t0 = time.perf_counter()
+    for pid in pagamenti:
+        ctx.gestore.webhook_esito_pagamento(pid, EsitoPagamento.AUTORIZZATO)
+    return (time.perf_counter() - t0) / len(pagamenti)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Latenza del webhook con notifiche sincrone vs outbox asincrona")
+    ap.add_argument("--latenza-provider-ms", type=float, default=50.0)
+    ap.add_argument("--tasso-errore", type=float, default=0.2)
+    ap.add_argument("--webhook", type=int, default=20)
+    args = ap.parse_args()
+    latenza = args.latenza_provider_ms / 1e3
+
+    with tempfile.TemporaryDirectory() as tmp:
+        provider = LentoAdattatoreNotifiche(latenza_s=latenza, seme=1)
+        ctx = build_app_context(state_file=os.path.join(tmp, "sync.json"), provider_notifiche=provider)
+        sincrona = latenza_webhook(ctx, acquisti(ctx, args.webhook))
+
+        provider = LentoAdattatoreNotifiche(latenza_s=latenza, tasso_errore=args.tasso_errore, seme=1)
+        state_file = os.path.join(tmp, "async.json")
+        ctx = build_app_context(state_file=state_file, notifiche_async=True, provider_notifiche=provider)
+        ctx.dispatcher.backoff_s = latenza
+        asincrona = latenza_webhook(ctx, acquisti(ctx, args.webhook))
+        ctx.dispatcher.attendi()
+        consegnati = sum(1 for tipo, _ in provider.inviati if tipo == "biglietto")
+        print(f"webhook con notifica sincrona: {sincrona * 1e3:7.2f} ms")
+        print(f"webhook con outbox asincrona:  {asincrona * 1e3:7.2f} ms")
+        print(
+            f"consegnati {consegnati}/{args.webhook} biglietti in {provider.chiamate} chiamate al provider "
+            f"(errori simulati {args.tasso_errore:.0%}, falliti definitivi {len(ctx.dispatcher.falliti)})"
+        )
+        assert consegnati + len(ctx.dispatcher.falliti) == args.webhook
+        ctx.chiudi()
+
+        # riavvio: i messaggi ancora in outbox vengono consegnati dal dispatcher successivo
+        provider = LentoAdattatoreNotifiche(latenza_s=latenza, seme=2)
+        dispatcher = DispatcherNotifiche(provider=provider, outbox=Outbox(outbox_path(state_file)), worker=1)
+        for i in range(5):
+            dispatcher.invia_notifica_disponibilita(f"cliente{i}@example.com", "sp1")
+        dispatcher.outbox.close()
+        dispatcher = DispatcherNotifiche(provider=provider, outbox=Outbox(outbox_path(state_file)))
+        dispatcher.avvia()
+        dispatcher.ferma()
+        print(f"dopo il riavvio: {len(provider.inviati)}/5 notifiche rimaste in outbox consegnate")
+        assert len(provider.inviati) == 5
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
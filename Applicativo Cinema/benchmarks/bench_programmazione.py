@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, time as orario, timedelta
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_memoria import trattenuta  # noqa: E402
+from cinema_ticketing.domain import Cliente, Film, Posto, SalaCinema, StatoPosto  # noqa: E402
+from cinema_ticketing.persistence import load_db, save_db  # noqa: E402
+from cinema_ticketing.repositories import InMemoryDB, SeedData  # noqa: E402
+from cinema_ticketing.scheduling import RegolaProgrammazione, ServizioProgrammazione  # noqa: E402
+from cinema_ticketing.seatmap import MappaPosti  # noqa: E402
+
+
+def genera_catalogo(sale: int, righe: int, colonne: int) -> InMemoryDB:
+    db = InMemoryDB()
+    elenco_sale = [SalaCinema(id=f"s{i}", nome=str(i), righe=righe, colonne=colonne) for i in range(1, sale + 1)]
+    db.load_seed(
+        SeedData(
+            clienti=[Cliente(id="c1", nome="Mario Rossi", email="mario.rossi@example.com")],
+            films=[Film(id=f"f{i}", titolo=f"Film {i}", durata_min=90 + 7 * i) for i in range(1, 11)],
+            sale=elenco_sale,
+            posti=[
+                Posto(id=f"{s.id}p{(r - 1) * colonne + c}", riga=r, colonna=c, sala_id=s.id)
+                for s in elenco_sale
+                for r in range(1, righe + 1)
+                for c in range(1, colonne + 1)
+            ],
+            spettacoli=[],
+            disponibilita=[],
+        )
+    )
+    return db
+
+
+def regole(sale: int) -> List[RegolaProgrammazione]:
+    # quattro proiezioni al giorno per sala, più una matinée nel fine settimana che va in conflitto
+    # con la prima proiezione nelle sale con i film più lunghi
+    orari = tuple(orario(h, m) for h, m in ((14, 30), (17, 15), (20, 0), (22, 45)))
+    elenco = [
+        RegolaProgrammazione(film_id=f"f{i % 10 + 1}", sala_id=f"s{i}", orari=orari, prezzo_eur=9.5)
+        for i in range(1, sale + 1)
+    ]
+    elenco += [
+        RegolaProgrammazione(film_id="f10", sala_id=f"s{i}", orari=(orario(12, 0),), prezzo_eur=6.5, giorni=(5, 6))
+        for i in range(1, sale + 1)
+    ]
+    return elenco
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Generazione di una stagione: tempo, memoria dell'inventario pigro")
+    ap.add_argument("--sale", type=int, default=12)
+    ap.add_argument("--righe", type=int, default=15)
+    ap.add_argument("--colonne", type=int, default=22)
+    ap.add_argument("--giorni", type=int, default=92)
+    args = ap.parse_args()
+
+    dal = date(2026, 1, 1)
+    al = dal + timedelta(days=args.giorni)
+    db = genera_catalogo(args.sale, args.righe, args.colonne)
+    db.materializza("disponibilita")
+    t0 = time.perf_counter()
+    esito = ServizioProgrammazione(db, pausa_min=15).genera(regole(args.sale), dal, al)
+    durata = time.perf_counter() - t0
+    n = len(esito.spettacoli)
+    posti = n * args.righe * args.colonne
+
+    # memoria delle sole mappe posti: pigre (modello di sala condiviso) contro una mappa privata
+    # per spettacolo, come se ognuno fosse già stato toccato
+    modello = db.modello_sala("s1")
+    _, pigre = trattenuta(
+        lambda: [MappaPosti.da_modello(sp.id, args.righe, args.colonne, modello) for sp in esito.spettacoli]
+    )
+    _, private = trattenuta(
+        lambda: [MappaPosti(sp.id, args.righe, args.colonne, StatoPosto.LIBERO) for sp in esito.spettacoli]
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "stato.json")
+        save_db(db, path)
+        ricaricato = load_db(path)
+        condivise = sum(1 for m in ricaricato.iter_mappe() if m.condivisa())
+
+    print(f"{n} spettacoli in {args.giorni} giorni su {args.sale} sale, {len(esito.conflitti)} scartati per sovrapposizione")
+    print(f"generazione:                     {durata * 1e3:8.1f} ms")
+    print(f"mappe pigre:                     {pigre / 1e3:8.1f} KB ({pigre / posti:.2f} byte per posto)")
+    print(f"mappe private, riferimento:      {private / 1e3:8.1f} KB ({private / posti:.2f} byte per posto)")
+    print(f"mappe ancora condivise dopo salvataggio e ricarica: {condivise}/{n}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from dataclasses import replace
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cinema_ticketing.analytics import AnalisiVendite  # noqa: E402
+from cinema_ticketing.domain import (  # noqa: E402
+    DisponibilitaPosti,
+    Film,
+    OrdineAcquisto,
+    Posto,
+    SalaCinema,
+    Spettacolo,
+    StatoOrdine,
+    StatoPosto,
+)
+from cinema_ticketing.repositories import InMemoryDB, SeedData  # noqa: E402
+
+
+def genera(spettacoli: int, ordini: int, seme: int) -> InMemoryDB:
+    rnd = random.Random(seme)
+    sale = [SalaCinema(id=f"s{i}", nome=str(i), righe=10, colonne=20) for i in range(1, 6)]
+    posti = [
+        Posto(id=f"{s.id}_p{r}_{c}", riga=r, colonna=c, sala_id=s.id)
+        for s in sale
+        for r in range(1, s.righe + 1)
+        for c in range(1, s.colonne + 1)
+    ]
+    films = [Film(id=f"f{i}", titolo=f"Film {i}", durata_min=120) for i in range(1, 11)]
+    inizio = datetime(2025, 1, 1, 18)
+    elenco = [
+        Spettacolo(
+            id=f"sp{i}",
+            film_id=rnd.choice(films).id,
+            sala_id=sale[i % len(sale)].id,
+            inizio=inizio + timedelta(hours=3 * i),
+            prezzo_eur=9.9,
+        )
+        for i in range(spettacoli)
+    ]
+    db = InMemoryDB()
+    db.load_seed(
+        SeedData(
+            clienti=[],
+            films=films,
+            sale=sale,
+            posti=posti,
+            spettacoli=elenco,
+            disponibilita=[
+                DisponibilitaPosti(sp.id, p.id, StatoPosto.VENDUTO if rnd.random() < 0.4 else StatoPosto.LIBERO)
+                for sp in elenco
+                for p in posti
+                if p.sala_id == sp.sala_id
+            ],
+        )
+    )
+    stati = [StatoOrdine.PAGATO, StatoOrdine.PAGATO, StatoOrdine.ANNULLATO]
+    for i in range(ordini):
+        db.ordini[f"ord_{i:08d}"] = OrdineAcquisto(
+            id=f"ord_{i:08d}",
+            cliente_id=f"c{i % 1000}",
+            spettacolo_id=elenco[i % spettacoli].id,
+            posti_ids=[],
+            totale_eur=9.9,
+            stato=rnd.choice(stati),
+            creato_il=inizio + timedelta(seconds=30 * i),
+        )
+    return db
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Report vendite: backfill in un passaggio e aggregati incrementali")
+    ap.add_argument("--ordini", type=int, default=1_000_000)
+    ap.add_argument("--spettacoli", type=int, default=200)
+    ap.add_argument("--aggiornamenti", type=int, default=100_000)
+    args = ap.parse_args()
+
+    db = genera(args.spettacoli, args.ordini, seme=1)
+    analisi = AnalisiVendite(db)
+    t0 = time.perf_counter()
+    analisi.avvia()
+    backfill = time.perf_counter() - t0
+    print(f"backfill su {args.ordini} ordini e {args.spettacoli} spettacoli: {backfill:.2f} s")
+
+    t0 = time.perf_counter()
+    riepilogo = analisi.riepilogo()
+    print(f"report dagli aggregati: {(time.perf_counter() - t0) * 1e3:.2f} ms")
+
+    # cambi di stato ricevuti dal bus eventi ordini, uno per salvataggio
+    rnd = random.Random(2)
+    ids = rnd.sample(list(db.ordini), min(args.aggiornamenti, args.ordini))
+    t0 = time.perf_counter()
+    for oid in ids:
+        o = db.ordini[oid]
+        db.save_ordine(replace(o, stato=StatoOrdine.ANNULLATO if o.stato == StatoOrdine.PAGATO else StatoOrdine.PAGATO))
+    incrementale = time.perf_counter() - t0
+    print(f"{len(ids)} cambi di stato con aggiornamento incrementale: {incrementale / len(ids) * 1e6:.2f} µs l'uno")
+
+    ricalcolata = AnalisiVendite(db)
+    ricalcolata.ricalcola()
+    riepilogo, atteso = analisi.riepilogo(), ricalcolata.riepilogo()
+    if riepilogo != atteso:
+        raise AssertionError("Aggregati incrementali diversi dal ricalcolo completo")
+    print(f"conversione {riepilogo['tasso_conversione']:.1%}, coerente con il ricalcolo completo")
+
+    # quello che fa il comando report: aggregati salvati con lo stato, riletti senza gli ordini.
+    # Il migliore di alcuni giri: qui gli ordini sono in memoria e una raccolta del gc sul loro
+    # heap peserebbe più della lettura, cosa che al comando (ordini non caricati) non succede
+    testo = json.dumps(analisi.esporta())
+    tempi = []
+    for _ in range(5):
+        t0 = time.perf_counter()
+        riletta = AnalisiVendite(db)
+        riletta.importa(json.loads(testo))
+        riletta.riepilogo()
+        tempi.append(time.perf_counter() - t0)
+    print(f"report da aggregati salvati ({len(testo) / 1e3:.1f} KB): {min(tempi) * 1e3:.2f} ms")
+    if riletta.riepilogo() != atteso:
+        raise AssertionError("Aggregati salvati e riletti diversi dal ricalcolo completo")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from typing import Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_avvio import genera_stato  # noqa: E402
+from cinema_ticketing.app import build_app_context  # noqa: E402
+from cinema_ticketing.domain import StatoPosto  # noqa: E402
+from main import TABELLE_COMANDI  # noqa: E402
+
+
+def byte_scritti(cartella: str, dopo_ns: int) -> int:
+    return sum(
+        os.path.getsize(os.path.join(radice, nome))
+        for radice, _, nomi in os.walk(cartella)
+        for nome in nomi
+        if os.stat(os.path.join(radice, nome)).st_mtime_ns > dopo_ns
+    )
+
+
+def misura(path: str, storage: str, acquisti: int) -> Tuple[float, float]:
+    # un comando "buy" completo per acquisto: apertura lazy, hold + ordine + pagamento, salvataggio
+    cartella = os.path.dirname(path)
+    build_app_context(state_file=path, storage=storage).save()
+    salvataggio = scritti = 0.0
+    for i in range(acquisti):
+        ctx = build_app_context(state_file=path, storage=storage, tabelle=TABELLE_COMANDI["buy"])
+        libero = next(d for d in ctx.db.list_disponibilita_spettacolo("sp1") if d.stato == StatoPosto.LIBERO)
+        posto = ctx.db.get_posto(libero.posto_id)
+        ctx.gestore.avvia_acquisto("c1", "sp1", [f"{chr(ord('A') + posto.riga - 1)}{posto.colonna}"])
+        inizio_ns = time.time_ns()
+        t0 = time.perf_counter()
+        ctx.save()
+        salvataggio += time.perf_counter() - t0
+        scritti += byte_scritti(cartella, inizio_ns - 1)
+    return salvataggio / acquisti, scritti / acquisti
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Salvataggio dopo un acquisto: file unico vs partizioni modificate")
+    ap.add_argument("--ordini", type=int, nargs="+", default=[10_000, 100_000])
+    ap.add_argument("--acquisti", type=int, default=10)
+    args = ap.parse_args()
+
+    print(f"{'ordini':>9} {'storage':>11} {'save ms':>9} {'KB scritti':>11}")
+    for n in args.ordini:
+        for storage in ("json", "partizioni"):
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "stato.json")
+                genera_stato(path, n)
+                tempo, scritti = misura(path, storage, args.acquisti)
+                print(f"{n:>9} {storage:>11} {tempo * 1e3:>9.2f} {scritti / 1e3:>11.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
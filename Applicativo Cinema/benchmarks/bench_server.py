@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cinema_ticketing.app import build_app_context  # noqa: E402
+from cinema_ticketing.server import ServizioHttp  # noqa: E402
+
+
+async def richiesta(reader, writer, metodo: str, percorso: str, dati=None):
+    corpo = json.dumps(dati).encode() if dati is not None else b""
+    writer.write(
+        f"{metodo} {percorso} HTTP/1.1\r\nHost: bench\r\nContent-Length: {len(corpo)}\r\n\r\n".encode() + corpo
+    )
+    testa = await reader.readuntil(b"\r\n\r\n")
+    righe = testa.decode("latin-1").split("\r\n")
+    status = int(righe[0].split(" ")[1])
+    lunghezza = next(int(r.split(":", 1)[1]) for r in righe if r.lower().startswith("content-length:"))
+    return status, json.loads(await reader.readexactly(lunghezza))
+
+
+async def client_mappa(host: str, port: int, n: int) -> None:
+    reader, writer = await asyncio.open_connection(host, port)
+    for _ in range(n):
+        status, _ = await richiesta(reader, writer, "GET", "/spettacoli/sp1/posti")
+        assert status == 200
+    writer.close()
+
+
+async def scenario(args, state_file: str) -> None:
+    ctx = build_app_context(state_file=state_file, storage=args.storage)
+    servizio = ServizioHttp(ctx, intervallo_salvataggio_s=0.2)
+    server = await servizio.avvia("127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        # flusso completo: acquisto, webhook, mappa aggiornata
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        status, acquisto = await richiesta(
+            reader, writer, "POST", "/acquisti", {"cliente_id": "c1", "spettacolo_id": "sp1", "quantita": 2}
+        )
+        assert status == 201, acquisto
+        status, esito = await richiesta(
+            reader, writer, "POST", "/webhook", {"pagamento_id": acquisto["pagamento"]["id"], "esito": "AUTORIZZATO"}
+        )
+        assert status == 200 and esito["biglietto"], esito
+        status, mappa = await richiesta(reader, writer, "GET", "/spettacoli/sp1/posti")
+        assert mappa["liberi"] == 18, mappa
+        status, _ = await richiesta(reader, writer, "GET", "/spettacoli/nessuno/posti")
+        assert status == 404
+        writer.close()
+
+        totale = args.client * args.richieste
+        t0 = time.perf_counter()
+        await asyncio.gather(*(client_mappa("127.0.0.1", port, args.richieste) for _ in range(args.client)))
+        durata = time.perf_counter() - t0
+        print(f"{totale} letture mappa posti da {args.client} client keep-alive in {durata:.2f} s: {totale / durata:,.0f} req/s")
+    finally:
+        await servizio.ferma(server)
+        ctx.chiudi()
+
+    # lo stato salvato a lotti è quello visto dal servizio
+    ctx = build_app_context(state_file=state_file, storage=args.storage)
+    assert ctx.servizio_posti.verifica_disponibilita("sp1")
+    assert len(ctx.servizio_posti.posti_liberi("sp1")) == 18
+    print("stato persistito correttamente dopo l'arresto del servizio")
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Throughput delle letture della mappa posti dal servizio HTTP")
+    ap.add_argument("--client", type=int, default=50)
+    ap.add_argument("--richieste", type=int, default=400, help="Richieste per client")
+    ap.add_argument("--storage", choices=("json", "journal", "sqlite"), default="journal")
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(scenario(args, os.path.join(tmp, "stato.json")))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cinema_ticketing.domain import (  # noqa: E402
+    Cliente,
+    DisponibilitaPosti,
+    Film,
+    Posto,
+    SalaCinema,
+    Spettacolo,
+    StatoPosto,
+)
+from cinema_ticketing.persistence import save_db  # noqa: E402
+from cinema_ticketing.repositories import InMemoryDB, SeedData  # noqa: E402
+from cinema_ticketing.sharding import PianoShard, RouterAcquisti  # noqa: E402
+
+
+def genera_stato(path: str, spettacoli: int, righe: int, colonne: int) -> None:
+    sala = SalaCinema(id="s1", nome="1", righe=righe, colonne=colonne)
+    posti = [
+        Posto(id=f"p{r}_{c}", riga=r, colonna=c, sala_id=sala.id)
+        for r in range(1, righe + 1)
+        for c in range(1, colonne + 1)
+    ]
+    elenco = [
+        Spettacolo(id=f"sp{i}", film_id="f1", sala_id=sala.id, inizio=datetime(2025, 1, 1) + timedelta(hours=i), prezzo_eur=9.9)
+        for i in range(spettacoli)
+    ]
+    db = InMemoryDB()
+    db.load_seed(
+        SeedData(
+            clienti=[Cliente(id="c1", nome="Cliente", email="cliente@example.com")],
+            films=[Film(id="f1", titolo="Prima", durata_min=120)],
+            sale=[sala],
+            posti=posti,
+            spettacoli=elenco,
+            disponibilita=[DisponibilitaPosti(sp.id, p.id, StatoPosto.LIBERO) for sp in elenco for p in posti],
+        )
+    )
+    save_db(db, path)
+
+
+def richieste(spettacoli: int, righe: int, colonne: int, n: int) -> List[Tuple[str, str]]:
+    # acquisti di un posto a testa, a rotazione sugli spettacoli: nessun conflitto tra richieste
+    etichette = [f"{chr(ord('A') + r)}{c}" for r in range(righe) for c in range(1, colonne + 1)]
+    return [(f"sp{i % spettacoli}", etichette[i // spettacoli]) for i in range(n)]
+
+
+def misura(path: str, piano: PianoShard, elenco: List[Tuple[str, str]]) -> float:
+    router = RouterAcquisti(path, piano)
+    router.avvia()
+    try:
+        # riscaldamento: i worker caricano lo stato al primo messaggio
+        for i in range(piano.totale):
+            router.richiedi(i, "processa_notifiche").result()
+        t0 = time.perf_counter()
+        futuri = [router.avvia_acquisto_async("c1", sp, et) for sp, et in elenco]
+        for f in futuri:
+            f.result()
+        return time.perf_counter() - t0
+    finally:
+        router.ferma()
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Acquisti su spettacoli diversi: throughput al crescere degli shard")
+    ap.add_argument("--shard", type=int, nargs="+", default=[1, 2, 4])
+    ap.add_argument("--spettacoli", type=int, default=16)
+    ap.add_argument("--acquisti", type=int, default=4000)
+    args = ap.parse_args()
+
+    righe, colonne = 20, 25
+    elenco = richieste(args.spettacoli, righe, colonne, args.acquisti)
+    print(f"core disponibili: {os.cpu_count()}")
+    print(f"{'shard':>6} {'acquisti/s':>11} {'speedup':>8}")
+    base = None
+    for n in args.shard:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "stato.json")
+            genera_stato(path, args.spettacoli, righe, colonne)
+            durata = misura(path, PianoShard(n), elenco)
+        throughput = len(elenco) / durata
+        base = base or throughput
+        print(f"{n:>6} {throughput:>11.0f} {throughput / base:>7.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
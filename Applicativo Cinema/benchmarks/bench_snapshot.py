@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cinema_ticketing.domain import (  # noqa: E402
+    Cliente,
+    DisponibilitaPosti,
+    Film,
+    OrdineAcquisto,
+    Posto,
+    SalaCinema,
+    Spettacolo,
+    StatoOrdine,
+    StatoPosto,
+)
+from cinema_ticketing.persistence import load_db, save_db  # noqa: E402
+from cinema_ticketing.repositories import InMemoryDB, SeedData  # noqa: E402
+
+
+def genera_db(righe_posti: int, ordini: int, righe: int = 15, colonne: int = 22) -> InMemoryDB:
+    sala = SalaCinema(id="s1", nome="1", righe=righe, colonne=colonne)
+    posti = [
+        Posto(id=f"p{(r - 1) * colonne + c}", riga=r, colonna=c, sala_id=sala.id)
+        for r in range(1, righe + 1)
+        for c in range(1, colonne + 1)
+    ]
+    n_spettacoli = max(1, righe_posti // len(posti))
+    t0 = datetime(2025, 1, 1, 18, 0)
+    spettacoli = [
+        Spettacolo(id=f"sp{i}", film_id="f1", sala_id=sala.id, inizio=t0 + timedelta(hours=3 * i), prezzo_eur=9.9)
+        for i in range(n_spettacoli)
+    ]
+    stati = (StatoPosto.LIBERO, StatoPosto.LIBERO, StatoPosto.VENDUTO, StatoPosto.BLOCCATO)
+    disponibilita = [
+        DisponibilitaPosti(
+            spettacolo_id=sp.id,
+            posto_id=p.id,
+            stato=stati[j % len(stati)],
+            hold_scadenza=t0 if stati[j % len(stati)] == StatoPosto.BLOCCATO else None,
+        )
+        for sp in spettacoli
+        for j, p in enumerate(posti)
+    ]
+    db = InMemoryDB()
+    db.load_seed(
+        SeedData(
+            clienti=[Cliente(id="c1", nome="Mario Rossi", email="mario.rossi@example.com")],
+            films=[Film(id="f1", titolo="Interstellar", durata_min=169)],
+            sale=[sala],
+            posti=posti,
+            spettacoli=spettacoli,
+            disponibilita=disponibilita,
+        )
+    )
+    for i in range(ordini):
+        o = OrdineAcquisto(
+            id=f"ord_{i:012x}",
+            cliente_id="c1",
+            spettacolo_id=spettacoli[i % n_spettacoli].id,
+            posti_ids=[posti[i % len(posti)].id],
+            totale_eur=9.9,
+            stato=StatoOrdine.PAGATO,
+            creato_il=t0 + timedelta(seconds=i),
+        )
+        db.ordini[o.id] = o
+    return db
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Snapshot JSON vs binario: dimensione e tempi di salvataggio/caricamento")
+    ap.add_argument("--righe-posti", type=int, default=1_000_000)
+    ap.add_argument("--ordini", type=int, default=50_000)
+    args = ap.parse_args()
+
+    db = genera_db(args.righe_posti, args.ordini)
+    print(f"{sum(1 for _ in db.iter_disponibilita())} righe disponibilità, {len(db.ordini)} ordini\n")
+
+    risultati = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for formato in ("json", "binario"):
+            path = os.path.join(tmp, f"stato.{formato}")
+            t0 = time.perf_counter()
+            save_db(db, path, formato=formato)
+            t_save = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            load_db(path)
+            t_load = time.perf_counter() - t0
+            risultati[formato] = (os.path.getsize(path), t_save, t_load)
+            mb = risultati[formato][0] / 1e6
+            print(f"{formato:8s} {mb:8.1f} MB   save {t_save * 1e3:8.1f} ms   load {t_load * 1e3:8.1f} ms")
+
+    (size_j, _, load_j), (size_b, _, load_b) = risultati["json"], risultati["binario"]
+    print(f"\nbinario: {size_j / size_b:.1f}x più piccolo, caricamento {load_j / load_b:.1f}x più veloce")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cinema_ticketing.domain import EsitoPagamento, OrdineAcquisto, Pagamento, StatoOrdine  # noqa: E402
+from cinema_ticketing.repositories import InMemoryDB  # noqa: E402
+
+
+def genera(n: int, clienti: int, seme: int) -> InMemoryDB:
+    rnd = random.Random(seme)
+    db = InMemoryDB()
+    inizio = datetime(2025, 1, 1)
+    for i in range(n):
+        o = OrdineAcquisto(
+            id=f"ord_{i}",
+            cliente_id=f"c{rnd.randrange(clienti)}",
+            spettacolo_id=f"sp{rnd.randrange(200)}",
+            posti_ids=["p1"],
+            totale_eur=9.9,
+            stato=StatoOrdine.PAGATO,
+            creato_il=inizio + timedelta(seconds=rnd.randrange(10_000_000)),
+        )
+        db.save_ordine(o)
+        db.save_pagamento(
+            Pagamento(id=f"pay_{i}", ordine_id=o.id, provider="MockPay", importo_eur=9.9, esito=EsitoPagamento.AUTORIZZATO)
+        )
+    return db
+
+
+def misura(funzione, ripetizioni: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(ripetizioni):
+        funzione()
+    return (time.perf_counter() - t0) / ripetizioni
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Storico ordini: indici secondari contro scansione completa")
+    ap.add_argument("--ordini", type=int, default=200_000)
+    ap.add_argument("--clienti", type=int, default=5_000)
+    args = ap.parse_args()
+
+    db = genera(args.ordini, args.clienti, seme=1)
+    print(f"{args.ordini:,} ordini, {args.clienti:,} clienti\n")
+
+    casi = [
+        (
+            "ordini di un cliente",
+            lambda: db.list_ordini_by_cliente("c42"),
+            lambda: sorted((o for o in db.list_ordini() if o.cliente_id == "c42"), key=lambda o: (o.creato_il, o.id)),
+        ),
+        (
+            "pagamenti di un ordine",
+            lambda: db.list_pagamenti_by_ordine("ord_4242"),
+            lambda: [p for p in db.pagamenti.values() if p.ordine_id == "ord_4242"],
+        ),
+        (
+            "ultimi 20 ordini",
+            lambda: db.list_ordini_ordinati(20, recenti_prima=True),
+            lambda: sorted(db.list_ordini(), key=lambda o: (o.creato_il, o.id), reverse=True)[:20],
+        ),
+    ]
+    for nome, indice, scansione in casi:
+        assert indice() == scansione(), nome
+        t_indice = misura(indice, 50)
+        t_scansione = misura(scansione, 5)
+        print(f"{nome:24s} indice {t_indice * 1e3:8.3f} ms   scansione {t_scansione * 1e3:8.2f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
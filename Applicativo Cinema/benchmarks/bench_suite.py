@@ -0,0 +1,366 @@
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cinema_ticketing.adapters import LentoAdattatoreNotifiche  # noqa: E402
+from cinema_ticketing.app import AppContext, build_app_context  # noqa: E402
+from cinema_ticketing.domain import (  # noqa: E402
+    Biglietto,
+    Cliente,
+    EsitoPagamento,
+    Film,
+    IscrizioneListaAttesa,
+    OrdineAcquisto,
+    Pagamento,
+    Posto,
+    SalaCinema,
+    Spettacolo,
+    StatoOrdine,
+    StatoPosto,
+)
+from cinema_ticketing.persistence import load_db, save_db  # noqa: E402
+from cinema_ticketing.repositories import InMemoryDB, SeedData  # noqa: E402
+from cinema_ticketing.seatmap import MappaPosti  # noqa: E402
+
+VERSIONE_RISULTATI = 1
+
+# iscrizioni in attesa e posti liberati prima di ogni chiamata misurata di processa_notifiche
+ISCRIZIONI_PER_CAMPIONE = 5
+
+
+def genera_cinema(args: argparse.Namespace, rnd: random.Random) -> InMemoryDB:
+    sale = [SalaCinema(id=f"s{i}", nome=str(i), righe=args.righe, colonne=args.colonne) for i in range(1, args.sale + 1)]
+    posti = [
+        Posto(id=f"{s.id}_r{r}c{c}", riga=r, colonna=c, sala_id=s.id)
+        for s in sale
+        for r in range(1, s.righe + 1)
+        for c in range(1, s.colonne + 1)
+    ]
+    films = [Film(id=f"f{i}", titolo=f"Film {i}", durata_min=rnd.randint(90, 180)) for i in range(1, 51)]
+    clienti = [Cliente(id=f"c{i}", nome=f"Cliente {i}", email=f"cliente{i}@example.com") for i in range(args.clienti)]
+    inizio = datetime(2025, 1, 1, 15)
+    spettacoli = [
+        Spettacolo(
+            id=f"sp{i}",
+            film_id=rnd.choice(films).id,
+            sala_id=sale[i % len(sale)].id,
+            inizio=inizio + timedelta(hours=3 * (i // len(sale))),
+            prezzo_eur=rnd.choice((7.5, 9.9, 12.0)),
+        )
+        for i in range(args.spettacoli)
+    ]
+    db = InMemoryDB()
+    db.load_seed(SeedData(clienti=clienti, films=films, sale=sale, posti=posti, spettacoli=spettacoli, disponibilita=[]))
+
+    # inventario direttamente come mappe compatte: una parte degli spettacoli è esaurita
+    for sp in spettacoli:
+        mappa = MappaPosti(sp.id, args.righe, args.colonne, iniziale=StatoPosto.LIBERO)
+        esaurito = rnd.random() < args.esauriti
+        for i in range(args.righe * args.colonne):
+            if esaurito or rnd.random() < args.occupazione:
+                mappa.imposta(i, StatoPosto.VENDUTO)
+        db.add_mappa(mappa)
+
+    # storico ordini/pagamenti/biglietti e lista d'attesa
+    for n in range(args.ordini):
+        sp = spettacoli[rnd.randrange(len(spettacoli))]
+        pagato = rnd.random() < 0.8
+        creato_il = inizio + timedelta(seconds=20 * n)
+        o = OrdineAcquisto(
+            id=f"ord_{n:012x}",
+            cliente_id=clienti[rnd.randrange(len(clienti))].id,
+            spettacolo_id=sp.id,
+            posti_ids=[f"{sp.sala_id}_r{rnd.randint(1, args.righe)}c{rnd.randint(1, args.colonne)}"],
+            totale_eur=sp.prezzo_eur,
+            stato=StatoOrdine.PAGATO if pagato else StatoOrdine.ANNULLATO,
+            creato_il=creato_il,
+        )
+        db.save_ordine(o)
+        db.save_pagamento(
+            Pagamento(
+                id=f"pay_{n:012x}",
+                ordine_id=o.id,
+                provider="MockPay",
+                importo_eur=o.totale_eur,
+                esito=EsitoPagamento.AUTORIZZATO if pagato else EsitoPagamento.RIFIUTATO,
+                transaction_ref=f"MockPay-CHK-{o.id}",
+                ricevuto_il=creato_il,
+            )
+        )
+        if pagato:
+            db.save_biglietto(Biglietto(id=f"tkt_{n:012x}", ordine_id=o.id, qr_code="x" * 22, emesso_il=creato_il))
+    esauriti = [sp.id for sp in spettacoli if db.mappa_posti(sp.id).conta(StatoPosto.LIBERO) == 0] or [spettacoli[0].id]
+    for n in range(args.iscrizioni):
+        # le iscrizioni ancora in attesa riguardano solo spettacoli esauriti, le altre sono storico
+        in_attesa = rnd.random() < 0.3
+        db.add_waitlist(
+            IscrizioneListaAttesa(
+                id=f"wl_{n:012x}",
+                cliente_id=clienti[rnd.randrange(len(clienti))].id,
+                spettacolo_id=rnd.choice(esauriti) if in_attesa else spettacoli[rnd.randrange(len(spettacoli))].id,
+                creata_il=inizio + timedelta(seconds=60 * n),
+                notificato=not in_attesa,
+            )
+        )
+    return db
+
+
+def percentile(valori: Sequence[float], p: float) -> float:
+    return valori[min(len(valori) - 1, int(len(valori) * p))]
+
+
+def misura(
+    funzione: Callable[[Any], Any], argomenti: Callable[[int], Iterable[Any]], campioni: int, campioni_memoria: int
+) -> Tuple[Dict[str, float], List[Any]]:
+    # prima le latenze senza tracemalloc (che rallenta le allocazioni), poi il picco di memoria
+    # su un lotto separato di argomenti nuovi. Un generatore prepara ogni argomento subito prima
+    # della sua chiamata, fuori dal tempo misurato
+    risultati = []
+    tempi = []
+    for arg in argomenti(campioni):
+        t0 = time.perf_counter()
+        risultati.append(funzione(arg))
+        tempi.append(time.perf_counter() - t0)
+    tempi.sort()
+    totale = sum(tempi)
+
+    picco = 0
+    if campioni_memoria:
+        tracemalloc.start()
+        for arg in argomenti(campioni_memoria):
+            risultati.append(funzione(arg))
+        picco = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return (
+        {
+            "campioni": len(tempi),
+            "media_ms": totale / len(tempi) * 1e3,
+            "p50_ms": percentile(tempi, 0.50) * 1e3,
+            "p90_ms": percentile(tempi, 0.90) * 1e3,
+            "p99_ms": percentile(tempi, 0.99) * 1e3,
+            "max_ms": tempi[-1] * 1e3,
+            "throughput_op_s": len(tempi) / totale if totale else 0.0,
+            "picco_memoria_kb": picco / 1024,
+        },
+        risultati,
+    )
+
+
+def esegui_suite(ctx: AppContext, path: str, args: argparse.Namespace, rnd: random.Random) -> Dict[str, Dict[str, float]]:
+    db = ctx.db
+    spettacoli = [sp for sp in db.list_spettacoli()]
+    sale = list(db.sale)
+    righe, colonne = args.righe, args.colonne
+    risultati: Dict[str, Dict[str, float]] = {}
+
+    def etichetta_casuale() -> str:
+        return f"{chr(ord('A') + rnd.randrange(righe))}{rnd.randint(1, colonne)}"
+
+    risultati["posti_liberi"], _ = misura(
+        ctx.servizio_posti.posti_liberi,
+        lambda n: [rnd.choice(spettacoli).id for _ in range(n)],
+        args.campioni,
+        args.campioni_memoria,
+    )
+    risultati["find_posto_by_etichetta"], _ = misura(
+        lambda a: db.find_posto_by_etichetta(*a),
+        lambda n: [(rnd.choice(sale), etichetta_casuale()) for _ in range(n)],
+        args.campioni,
+        args.campioni_memoria,
+    )
+
+    # posti liberi ancora da prenotare, pescati fuori dalla misura
+    presi = set()
+    con_posti = [sp for sp in spettacoli if db.mappa_posti(sp.id).conta(StatoPosto.LIBERO) > 0]
+
+    def richieste_acquisto(n: int) -> List[Tuple[str, str, List[str]]]:
+        richieste = []
+        while len(richieste) < n:
+            sp = rnd.choice(con_posti)
+            mappa = db.mappa_posti(sp.id)
+            i = rnd.randrange(righe * colonne)
+            if mappa.stato(i) != StatoPosto.LIBERO or (sp.id, i) in presi:
+                continue
+            presi.add((sp.id, i))
+            riga, colonna = mappa.riga_colonna(i)
+            richieste.append((f"c{rnd.randrange(args.clienti)}", sp.id, [f"{chr(ord('A') + riga - 1)}{colonna}"]))
+        return richieste
+
+    risultati["avvia_acquisto"], acquisti = misura(
+        lambda a: ctx.gestore.avvia_acquisto(*a)[1].id, richieste_acquisto, args.campioni, args.campioni_memoria
+    )
+    pagamenti = iter(acquisti)
+    risultati["webhook_esito_pagamento"], _ = misura(
+        lambda a: ctx.gestore.webhook_esito_pagamento(*a),
+        lambda n: [
+            (next(pagamenti), EsitoPagamento.AUTORIZZATO if rnd.random() < 0.8 else EsitoPagamento.RIFIUTATO)
+            for _ in range(n)
+        ],
+        args.campioni,
+        args.campioni_memoria,
+    )
+    # ogni campione trova nuove iscrizioni in attesa e altrettanti posti liberi: senza, dopo la
+    # prima chiamata processa_notifiche non avrebbe più nessuno da avvisare
+    con_venduti = [sp.id for sp in spettacoli if db.mappa_posti(sp.id).conta(StatoPosto.VENDUTO) > 0]
+    progressivo = itertools.count()
+
+    def iscrizioni_da_notificare(n: int) -> Iterator[None]:
+        for _ in range(n):
+            for spettacolo_id in rnd.sample(con_venduti, min(ISCRIZIONI_PER_CAMPIONE, len(con_venduti))):
+                db.add_waitlist(
+                    IscrizioneListaAttesa(
+                        id=f"wl_bench_{next(progressivo):08d}",
+                        cliente_id=f"c{rnd.randrange(args.clienti)}",
+                        spettacolo_id=spettacolo_id,
+                        creata_il=datetime.utcnow(),
+                        notificato=False,
+                    )
+                )
+                # direttamente sulla mappa: con un evento il sottoscrittore della lista d'attesa
+                # avviserebbe subito l'iscritto
+                mappa = db.mappa_posti(spettacolo_id)
+                mappa.imposta(next(mappa.indici(StatoPosto.VENDUTO)), StatoPosto.LIBERO)
+            yield None
+
+    risultati["processa_notifiche"], inviate = misura(
+        lambda _: ctx.servizio_lista_attesa.processa_notifiche(),
+        iscrizioni_da_notificare,
+        max(1, args.campioni // 10),
+        min(args.campioni_memoria, 5),
+    )
+    if min(inviate) < min(ISCRIZIONI_PER_CAMPIONE, len(con_venduti)):
+        raise AssertionError(f"processa_notifiche ha avvisato {min(inviate)} iscritti in un campione")
+    risultati["save_db"], _ = misura(
+        lambda _: save_db(db, path), lambda n: [None] * n, args.ripetizioni_io, min(args.ripetizioni_io, 1)
+    )
+    risultati["load_db"], _ = misura(
+        lambda _: load_db(path), lambda n: [None] * n, args.ripetizioni_io, min(args.ripetizioni_io, 1)
+    )
+    return risultati
+
+
+def commit_corrente() -> Optional[str]:
+    try:
+        uscita = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return uscita.stdout.strip() or None
+
+
+def confronta(
+    attuali: Dict[str, Dict[str, float]], precedenti: Dict[str, Dict[str, float]], soglia: float, minimo_ms: float
+) -> List[str]:
+    # regressione solo se il p50 cresce oltre la soglia relativa e di almeno minimo_ms: sulle
+    # operazioni da pochi µs un microsecondo di rumore vale già decine di punti percentuali
+    regressioni = []
+    print(f"\n{'operazione':<26} {'p50 prima':>10} {'p50 ora':>10} {'delta':>8}")
+    for nome, r in attuali.items():
+        prima = precedenti.get(nome)
+        if not prima or not prima.get("p50_ms"):
+            continue
+        delta = r["p50_ms"] / prima["p50_ms"] - 1
+        peggiorata = delta > soglia and r["p50_ms"] - prima["p50_ms"] > minimo_ms
+        segno = "  REGRESSIONE" if peggiorata else ""
+        print(f"{nome:<26} {prima['p50_ms']:>10.3f} {r['p50_ms']:>10.3f} {delta:>+8.1%}{segno}")
+        if peggiorata:
+            regressioni.append(nome)
+    return regressioni
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(
+        description="Suite riproducibile su un cinema sintetico: latenze, throughput e picco di memoria in JSON"
+    )
+    ap.add_argument("--sale", type=int, default=20)
+    ap.add_argument("--righe", type=int, default=20)
+    ap.add_argument("--colonne", type=int, default=30)
+    ap.add_argument("--spettacoli", type=int, default=2_000)
+    ap.add_argument("--clienti", type=int, default=10_000)
+    ap.add_argument("--ordini", type=int, default=100_000)
+    ap.add_argument("--iscrizioni", type=int, default=20_000)
+    ap.add_argument("--occupazione", type=float, default=0.5, help="Quota di posti già venduti")
+    ap.add_argument("--esauriti", type=float, default=0.05, help="Quota di spettacoli esauriti")
+    ap.add_argument("--campioni", type=int, default=2_000, help="Chiamate misurate per operazione")
+    ap.add_argument("--campioni-memoria", type=int, default=50, help="Chiamate ripetute sotto tracemalloc")
+    ap.add_argument("--ripetizioni-io", type=int, default=3, help="Ripetizioni di save_db e load_db")
+    ap.add_argument("--seme", type=int, default=1)
+    ap.add_argument("--output", default="bench_risultati.json", help="File JSON dei risultati")
+    ap.add_argument("--confronta", help="Risultati di un'esecuzione precedente da confrontare")
+    ap.add_argument("--soglia", type=float, default=0.25, help="Aumento del p50 oltre cui segnalare regressione")
+    ap.add_argument(
+        "--soglia-assoluta-ms", type=float, default=0.01, help="Aumento minimo del p50, in ms, per segnalare regressione"
+    )
+    args = ap.parse_args()
+    if args.righe > 26:
+        ap.error("--righe: al massimo 26 (etichette A-Z)")
+
+    rnd = random.Random(args.seme)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "stato.json")
+        t0 = time.perf_counter()
+        save_db(genera_cinema(args, rnd), path)
+        generazione = time.perf_counter() - t0
+        print(
+            f"cinema sintetico: {args.sale} sale {args.righe}x{args.colonne}, {args.spettacoli} spettacoli, "
+            f"{args.ordini} ordini, {args.iscrizioni} iscrizioni ({os.path.getsize(path) / 1e6:.1f} MB, {generazione:.1f} s)"
+        )
+        ctx = build_app_context(state_file=path, provider_notifiche=LentoAdattatoreNotifiche(latenza_s=0.0))
+        try:
+            risultati = esegui_suite(ctx, path, args, rnd)
+        finally:
+            ctx.chiudi()
+
+    print(f"\n{'operazione':<26} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'op/s':>10} {'picco KB':>10}")
+    for nome, r in risultati.items():
+        print(
+            f"{nome:<26} {r['p50_ms']:>9.3f} {r['p90_ms']:>9.3f} {r['p99_ms']:>9.3f} "
+            f"{r['throughput_op_s']:>10.0f} {r['picco_memoria_kb']:>10.0f}"
+        )
+
+    documento = {
+        "versione": VERSIONE_RISULTATI,
+        "commit": commit_corrente(),
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "piattaforma": platform.platform(),
+        "parametri": {k: v for k, v in vars(args).items() if k not in ("output", "confronta", "soglia", "soglia_assoluta_ms")},
+        "risultati": risultati,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(documento, f, ensure_ascii=False, indent=2)
+    print(f"\nrisultati salvati in {args.output}")
+
+    if args.confronta:
+        with open(args.confronta, encoding="utf-8") as f:
+            precedente = json.load(f)
+        if precedente.get("parametri") != documento["parametri"]:
+            print("attenzione: parametri diversi dall'esecuzione di confronto")
+        regressioni = confronta(risultati, precedente.get("risultati", {}), args.soglia, args.soglia_assoluta_ms)
+        if regressioni:
+            print(f"regressioni oltre il {args.soglia:.0%}: {', '.join(regressioni)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cinema_ticketing.adapters import LentoAdattatoreNotifiche  # noqa: E402
+from cinema_ticketing.app import build_app_context  # noqa: E402
+from cinema_ticketing.domain import Biglietto, EsitoPagamento  # noqa: E402
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Webhook duplicati: latenza e assenza di effetti collaterali")
+    ap.add_argument("--storico", type=int, default=200_000, help="Biglietti già emessi in archivio")
+    ap.add_argument("--duplicati", type=int, default=20, help="Ritentativi del provider per ogni webhook")
+    args = ap.parse_args()
+
+    notifiche = LentoAdattatoreNotifiche(latenza_s=0.0)
+    with tempfile.TemporaryDirectory() as tmp:
+        ctx = build_app_context(state_file=os.path.join(tmp, "stato.json"), provider_notifiche=notifiche)
+    g = ctx.gestore
+    for i in range(args.storico):
+        emesso = datetime(2024, 1, 1)
+        ctx.db.save_biglietto(Biglietto(id=f"tkt_storico{i}", ordine_id=f"ord_storico{i}", qr_code="", emesso_il=emesso))
+    pagamenti = [g.avvia_acquisto("c1", "sp1", et)[1].id for et in ("A1", "A2", "A3", "A4", "A5")]
+
+    t0 = time.perf_counter()
+    originali = [g.webhook_esito_pagamento(pid, EsitoPagamento.AUTORIZZATO) for pid in pagamenti]
+    prima = (time.perf_counter() - t0) / len(pagamenti)
+
+    t0 = time.perf_counter()
+    for _ in range(args.duplicati):
+        for pid, originale in zip(pagamenti, originali):
+            assert g.webhook_esito_pagamento(pid, EsitoPagamento.AUTORIZZATO) is originale
+    duplicato = (time.perf_counter() - t0) / (len(pagamenti) * args.duplicati)
+
+    print(f"{args.storico:,} biglietti in archivio")
+    print(f"prima consegna: {prima * 1e6:8.1f} µs")
+    print(f"duplicato:      {duplicato * 1e6:8.1f} µs")
+    print(f"biglietti notificati: {len(notifiche.inviati)} (attesi {len(pagamenti)})")
+    assert len(notifiche.inviati) == len(pagamenti)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_snapshot import genera_db  # noqa: E402
+from cinema_ticketing.domain import StatoPosto  # noqa: E402
+from cinema_ticketing.repositories import InMemoryDB  # noqa: E402
+from cinema_ticketing.services import ServizioPosti  # noqa: E402
+from cinema_ticketing.sqlite_repository import SqliteDB  # noqa: E402
+
+
+def libera_tutto(db) -> None:
+    for d in list(db.iter_disponibilita()):
+        db.set_stato_posto(d.spettacolo_id, d.posto_id, StatoPosto.LIBERO)
+
+
+def contesa(db, spettacoli: List[str], posti: List[str], thread: int, giri: int) -> Tuple[Dict, float]:
+    # tutti i thread provano a bloccare gli stessi posti, nello stesso ordine
+    vincitori: Dict[Tuple[str, str], List[int]] = {}
+    lock_vincitori = threading.Lock()
+    barriera = threading.Barrier(thread)
+    scad = datetime.utcnow() + timedelta(minutes=10)
+
+    def lavora(n: int) -> None:
+        barriera.wait()
+        for _ in range(giri):
+            for sp in spettacoli:
+                for posto in posti:
+                    if db.try_hold(sp, posto, scad):
+                        with lock_vincitori:
+                            vincitori.setdefault((sp, posto), []).append(n)
+
+    workers = [threading.Thread(target=lavora, args=(n,)) for n in range(thread)]
+    t0 = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return vincitori, time.perf_counter() - t0
+
+
+def verifica(db, spettacoli: List[str], posti: List[str], vincitori: Dict) -> None:
+    doppi = {k: v for k, v in vincitori.items() if len(v) != 1}
+    if doppi:
+        raise AssertionError(f"Posti bloccati più volte: {len(doppi)} (es. {next(iter(doppi.items()))})")
+    mancanti = [(sp, p) for sp in spettacoli for p in posti if (sp, p) not in vincitori]
+    if mancanti:
+        raise AssertionError(f"Posti mai bloccati: {len(mancanti)}")
+    for sp in spettacoli:
+        bloccati = db.conta_posti(sp, StatoPosto.BLOCCATO)
+        if bloccati != len(posti):
+            raise AssertionError(f"{sp}: {bloccati} posti BLOCCATO, attesi {len(posti)}")
+        if isinstance(db, InMemoryDB):
+            mappa = db.mappa_posti(sp)
+            for stato in StatoPosto:
+                if mappa.conta(stato) != sum(1 for _ in mappa.indici(stato)):
+                    raise AssertionError(f"{sp}: contatore {stato} non allineato ai byte di stato")
+
+
+def throughput(db: InMemoryDB, spettacoli: List[str], posti: List[str], thread: int) -> float:
+    # ogni thread acquista su uno spettacolo diverso: i lock a strisce non dovrebbero contendersi
+    servizio = ServizioPosti(db)
+    servizio.scadenze.carica()
+    barriera = threading.Barrier(thread)
+
+    def lavora(n: int) -> None:
+        barriera.wait()
+        for sp in spettacoli[n::thread]:
+            for posto in posti:
+                servizio.blocca_posto(sp, posto)
+                servizio.vendi_posto(sp, posto)
+
+    workers = [threading.Thread(target=lavora, args=(n,)) for n in range(thread)]
+    t0 = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return len(spettacoli) * len(posti) / (time.perf_counter() - t0)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Stress test di try_hold: molti thread in contesa sugli stessi posti")
+    ap.add_argument("--thread", type=int, default=16)
+    ap.add_argument("--spettacoli", type=int, default=8)
+    ap.add_argument("--giri", type=int, default=3)
+    args = ap.parse_args()
+
+    db = genera_db(args.spettacoli * 330, 0)
+    spettacoli = [sp.id for sp in db.list_spettacoli()]
+    posti = list(db.posti)
+    libera_tutto(db)
+    sys.setswitchinterval(1e-6)  # forza cambi di contesto frequenti tra confronto e scrittura
+
+    vincitori, dt = contesa(db, spettacoli, posti, args.thread, args.giri)
+    verifica(db, spettacoli, posti, vincitori)
+    tentativi = args.thread * args.giri * len(spettacoli) * len(posti)
+    print(f"InMemoryDB: {tentativi} tentativi, {len(vincitori)} hold, nessun doppio blocco ({dt * 1e3:.0f} ms)")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sdb = SqliteDB(os.path.join(tmp, "stress.sqlite3"))
+        sdb.importa(db)
+        libera_tutto(sdb)
+        vincitori, dt = contesa(sdb, spettacoli[:2], posti, args.thread, 1)
+        verifica(sdb, spettacoli[:2], posti, vincitori)
+        print(f"SqliteDB:   {len(vincitori)} hold, nessun doppio blocco ({dt * 1e3:.0f} ms)")
+        sdb.close()
+
+    sys.setswitchinterval(0.005)
+    print()
+    for n in (1, 2, 4, 8):
+        libera_tutto(db)
+        print(f"{n:>2} thread: {throughput(db, spettacoli, posti, n):>10.0f} blocca+vendi/s")
+
+    esiti = Counter(d.stato for d in db.iter_disponibilita())
+    assert esiti == Counter({StatoPosto.VENDUTO: len(spettacoli) * len(posti)}), esiti
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,8 +1,19 @@
 __all__ = [
     "domain",
     "repositories",
+    "seatmap",
+    "events",
+    "sqlite_repository",
+    "journal",
     "adapters",
     "persistence",
+    "partitions",
     "services",
+    "notifications",
+    "metrics",
     "app",
+    "server",
+    "sharding",
+    "analytics",
+    "scheduling",
 ]
\ No newline at end of file
@@ -1,8 +1,11 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+import random
+import threading
+import time
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Protocol
+from typing import Any, List, Optional, Protocol, Tuple
 
 from .domain import Biglietto
 
@@ -44,4 +47,41 @@ class ConsoleAdattatoreNotifiche(GatewayNotifiche):
         print(f"A: {email}")
         print(f"Si è liberato un posto per lo spettacolo: {spettacolo_id}")
         print("Accedi e prova ad acquistare.")
-        print("=================================\n")
\ No newline at end of file
+        print("=================================\n")
+
+
+# Provider finto per prove e benchmark: ogni chiamata costa latenza_s e fallisce con probabilità
+# tasso_errore. invia_lotto consegna più messaggi con un solo round-trip.
+@dataclass
+class LentoAdattatoreNotifiche(GatewayNotifiche):
+    latenza_s: float = 0.2
+    tasso_errore: float = 0.0
+    seme: Optional[int] = None
+    inviati: List[Tuple[str, str]] = field(default_factory=list)
+    chiamate: int = 0
+
+    def __post_init__(self) -> None:
+        self._rnd = random.Random(self.seme)
+        self._lock = threading.Lock()
+
+    def _chiamata(self) -> None:
+        time.sleep(self.latenza_s)
+        with self._lock:
+            self.chiamate += 1
+            if self._rnd.random() < self.tasso_errore:
+                raise ConnectionError("Provider notifiche non raggiungibile (simulato).")
+
+    def invia_biglietto(self, email: str, biglietto: Biglietto) -> None:
+        self._chiamata()
+        with self._lock:
+            self.inviati.append(("biglietto", email))
+
+    def invia_notifica_disponibilita(self, email: str, spettacolo_id: str) -> None:
+        self._chiamata()
+        with self._lock:
+            self.inviati.append(("disponibilita", email))
+
+    def invia_lotto(self, messaggi: List[Tuple[str, str, Any]]) -> None:
+        self._chiamata()
+        with self._lock:
+            self.inviati.extend((tipo, email) for tipo, email, _ in messaggi)
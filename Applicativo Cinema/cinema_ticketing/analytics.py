@@ -0,0 +1,315 @@
+from __future__ import annotations
+
+import os
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .domain import OrdineAcquisto, StatoOrdine, StatoPosto
+from .events import EventoOrdine, EventoPosto
+from .persistence import from_row, to_row
+from .repositories import NotFoundError, RepositoryCinema
+
+# esito di un ordine ai fini delle metriche
+IN_CORSO = 0
+PAGATO = 1
+ANNULLATO = 2
+SCADUTO = 3  # ancora IN_PAGAMENTO ma con l'hold dei posti scaduto
+
+_ESITI_TERMINALI = {StatoOrdine.PAGATO: PAGATO, StatoOrdine.ANNULLATO: ANNULLATO}
+
+
+def analisi_path(state_file: str) -> str:
+    return os.path.splitext(state_file)[0] + ".analisi.json"
+
+
+def _centesimi(importo_eur: float) -> int:
+    return round(importo_eur * 100)
+
+
+def _tasso(parte: int, totale: int) -> Optional[float]:
+    return parte / totale if totale else None
+
+
+# Aggregati di vendita e occupazione mantenuti in modo incrementale: ogni salvataggio di un ordine
+# e ogni cambio di stato di un posto (bus eventi) aggiorna solo i contatori toccati, quindi il
+# report costa O(spettacoli) e non dipende dal numero di ordini. Degli ordini si tengono solo
+# quelli ancora aperti: per gli altri l'esito precedente si ricava dallo stato nell'evento.
+# esporta()/importa() salvano gli aggregati accanto allo stato, così un nuovo processo riparte da
+# lì invece di scorrere tutti gli ordini; ricalcola() ricostruisce tutto in un solo passaggio.
+# I ricavi sono sommati in centesimi interi: nessun errore di arrotondamento tra le due vie.
+@dataclass
+class AnalisiVendite:
+    db: RepositoryCinema
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+    # ordini IN_PAGAMENTO con l'hold attivo, e id di quelli con l'hold scaduto
+    _in_corso: Dict[str, OrdineAcquisto] = field(default_factory=dict, init=False, repr=False)
+    _scaduti: Set[str] = field(default_factory=set, init=False, repr=False)
+    _conteggi: List[int] = field(default_factory=lambda: [0, 0, 0, 0], init=False, repr=False)
+    _ricavi_spettacolo: Dict[str, int] = field(default_factory=dict, init=False, repr=False)
+    _pagati_spettacolo: Dict[str, int] = field(default_factory=dict, init=False, repr=False)
+    _ricavi_giorno: Dict[date, int] = field(default_factory=dict, init=False, repr=False)
+    _venduti: Dict[str, int] = field(default_factory=dict, init=False, repr=False)
+    _capienza: Dict[str, int] = field(default_factory=dict, init=False, repr=False)
+    # posti bloccati dagli ordini in corso: un rilascio dell'hold rende l'ordine SCADUTO
+    _posti_in_corso: Dict[Tuple[str, str], str] = field(default_factory=dict, init=False, repr=False)
+    _collegata: bool = field(default=False, init=False, repr=False)
+
+    def avvia(self, ricalcola: bool = True) -> None:
+        if ricalcola:
+            self.ricalcola()
+        if not self._collegata:
+            self.db.eventi_ordini.sottoscrivi(self._su_evento_ordine)
+            self.db.eventi_posti.sottoscrivi(self._su_evento_posto)
+            self._collegata = True
+
+    def ferma(self) -> None:
+        if self._collegata:
+            self.db.eventi_ordini.annulla(self._su_evento_ordine)
+            self.db.eventi_posti.annulla(self._su_evento_posto)
+            self._collegata = False
+
+    # --- backfill ---
+
+    def ricalcola(self) -> None:
+        db = self.db
+        venduti: Dict[str, int] = {}
+        capienza: Dict[str, int] = {}
+        for sp in db.list_spettacoli():
+            occupazione = self._leggi_occupazione(sp.id)
+            if occupazione is not None:
+                venduti[sp.id], capienza[sp.id] = occupazione
+
+        in_corso: Dict[str, OrdineAcquisto] = {}
+        scaduti: Set[str] = set()
+        conteggi = [0, 0, 0, 0]
+        ricavi_spettacolo: Dict[str, int] = defaultdict(int)
+        pagati_spettacolo: Dict[str, int] = defaultdict(int)
+        ricavi_giorno: Dict[date, int] = defaultdict(int)
+        posti_in_corso: Dict[Tuple[str, str], str] = {}
+        terminali = _ESITI_TERMINALI
+        for o in db.iter_ordini():
+            esito = terminali.get(o.stato)
+            if esito is None:
+                esito = IN_CORSO if self._hold_attivo(o) else SCADUTO
+                if esito == IN_CORSO:
+                    in_corso[o.id] = o
+                    for posto_id in o.posti_ids:
+                        posti_in_corso[(o.spettacolo_id, posto_id)] = o.id
+                else:
+                    scaduti.add(o.id)
+            elif esito == PAGATO:
+                centesimi = _centesimi(o.totale_eur)
+                ricavi_spettacolo[o.spettacolo_id] += centesimi
+                pagati_spettacolo[o.spettacolo_id] += 1
+                ricavi_giorno[o.creato_il.date()] += centesimi
+            conteggi[esito] += 1
+
+        with self._lock:
+            self._in_corso = in_corso
+            self._scaduti = scaduti
+            self._conteggi = conteggi
+            self._ricavi_spettacolo = dict(ricavi_spettacolo)
+            self._pagati_spettacolo = dict(pagati_spettacolo)
+            self._ricavi_giorno = dict(ricavi_giorno)
+            self._venduti = venduti
+            self._capienza = capienza
+            self._posti_in_corso = posti_in_corso
+
+    def esporta(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "conteggi": list(self._conteggi),
+                "ricavi_spettacolo": dict(self._ricavi_spettacolo),
+                "pagati_spettacolo": dict(self._pagati_spettacolo),
+                "ricavi_giorno": {g.isoformat(): c for g, c in self._ricavi_giorno.items()},
+                "venduti": dict(self._venduti),
+                "capienza": dict(self._capienza),
+                "in_corso": [to_row("ordini", o) for o in self._in_corso.values()],
+                "scaduti": sorted(self._scaduti),
+            }
+
+    def importa(self, dati: Dict[str, Any]) -> None:
+        in_corso = {o.id: o for o in (from_row("ordini", r) for r in dati["in_corso"])}
+        posti_in_corso = {(o.spettacolo_id, posto_id): o.id for o in in_corso.values() for posto_id in o.posti_ids}
+        with self._lock:
+            self._conteggi = list(dati["conteggi"])
+            self._ricavi_spettacolo = dict(dati["ricavi_spettacolo"])
+            self._pagati_spettacolo = dict(dati["pagati_spettacolo"])
+            self._ricavi_giorno = {date.fromisoformat(g): c for g, c in dati["ricavi_giorno"].items()}
+            self._venduti = dict(dati["venduti"])
+            self._capienza = dict(dati["capienza"])
+            self._in_corso = in_corso
+            self._scaduti = set(dati["scaduti"])
+            self._posti_in_corso = posti_in_corso
+
+    def _leggi_occupazione(self, spettacolo_id: str) -> Optional[Tuple[int, int]]:
+        try:
+            mappa = self.db.mappa_posti(spettacolo_id)
+        except NotFoundError:
+            return None
+        venduti = mappa.conta(StatoPosto.VENDUTO)
+        return venduti, venduti + mappa.conta(StatoPosto.LIBERO) + mappa.conta(StatoPosto.BLOCCATO)
+
+    def _hold_attivo(self, ordine: OrdineAcquisto) -> bool:
+        try:
+            return all(
+                self.db.get_disponibilita(ordine.spettacolo_id, posto_id).stato == StatoPosto.BLOCCATO
+                for posto_id in ordine.posti_ids
+            )
+        except NotFoundError:
+            return False
+
+    # --- aggiornamento incrementale ---
+
+    def _su_evento_ordine(self, evento: EventoOrdine) -> None:
+        ordine = evento.ordine
+        with self._lock:
+            if ordine.id in self._in_corso:
+                precedente: Optional[int] = IN_CORSO
+            elif ordine.id in self._scaduti:
+                precedente = SCADUTO
+            else:
+                precedente = _ESITI_TERMINALI.get(evento.precedente) if evento.precedente else None
+            esito = _ESITI_TERMINALI.get(ordine.stato)
+            if esito is None:
+                esito = SCADUTO if precedente == SCADUTO else IN_CORSO
+            self._cambia_esito(ordine, precedente, esito)
+
+    def _su_evento_posto(self, evento: EventoPosto) -> None:
+        spettacolo_id = evento.spettacolo_id
+        if spettacolo_id not in self._capienza:
+            # spettacolo nuovo: lo stato letto include già questo cambio
+            occupazione = self._leggi_occupazione(spettacolo_id)
+            if occupazione is not None:
+                with self._lock:
+                    self._venduti[spettacolo_id], self._capienza[spettacolo_id] = occupazione
+        else:
+            delta = (evento.stato == StatoPosto.VENDUTO) - (evento.precedente == StatoPosto.VENDUTO)
+            if delta:
+                with self._lock:
+                    self._venduti[spettacolo_id] += delta
+        if evento.precedente == StatoPosto.BLOCCATO and evento.stato == StatoPosto.LIBERO:
+            with self._lock:
+                ordine_id = self._posti_in_corso.get((spettacolo_id, evento.posto_id))
+                ordine = self._in_corso.get(ordine_id) if ordine_id is not None else None
+                if ordine is not None:
+                    self._cambia_esito(ordine, IN_CORSO, SCADUTO)
+
+    def _cambia_esito(self, ordine: OrdineAcquisto, precedente: Optional[int], esito: int) -> None:
+        if precedente == esito:
+            return
+        if precedente is not None:
+            self._applica(ordine, precedente, -1)
+        self._applica(ordine, esito, 1)
+
+    def _applica(self, ordine: OrdineAcquisto, esito: int, segno: int) -> None:
+        self._conteggi[esito] += segno
+        if esito == PAGATO:
+            sp = ordine.spettacolo_id
+            giorno = ordine.creato_il.date()
+            centesimi = segno * _centesimi(ordine.totale_eur)
+            self._ricavi_spettacolo[sp] = self._ricavi_spettacolo.get(sp, 0) + centesimi
+            self._pagati_spettacolo[sp] = self._pagati_spettacolo.get(sp, 0) + segno
+            self._ricavi_giorno[giorno] = self._ricavi_giorno.get(giorno, 0) + centesimi
+        elif esito == IN_CORSO:
+            if segno > 0:
+                self._in_corso[ordine.id] = ordine
+            else:
+                self._in_corso.pop(ordine.id, None)
+            for posto_id in ordine.posti_ids:
+                chiave = (ordine.spettacolo_id, posto_id)
+                if segno > 0:
+                    self._posti_in_corso[chiave] = ordine.id
+                elif self._posti_in_corso.get(chiave) == ordine.id:
+                    del self._posti_in_corso[chiave]
+        elif esito == SCADUTO:
+            if segno > 0:
+                self._scaduti.add(ordine.id)
+            else:
+                self._scaduti.discard(ordine.id)
+
+    # --- metriche ---
+
+    def ricavi_per_spettacolo(self) -> Dict[str, Tuple[float, int]]:
+        with self._lock:
+            return {
+                sp: (centesimi / 100, self._pagati_spettacolo[sp]) for sp, centesimi in self._ricavi_spettacolo.items()
+            }
+
+    def ricavi_per_film(self) -> Dict[str, Tuple[float, int]]:
+        per_film: Dict[str, Tuple[float, int]] = {}
+        for sp, (ricavi, ordini) in self.ricavi_per_spettacolo().items():
+            film_id = self.db.get_spettacolo(sp).film_id
+            r, n = per_film.get(film_id, (0.0, 0))
+            per_film[film_id] = (round(r + ricavi, 2), n + ordini)
+        return per_film
+
+    def ricavi_per_giorno(self) -> Dict[date, float]:
+        with self._lock:
+            return {g: centesimi / 100 for g, centesimi in sorted(self._ricavi_giorno.items())}
+
+    def occupazione_per_spettacolo(self) -> Dict[str, Tuple[int, int]]:
+        # spettacoli ancora senza eventi (es. appena programmati): occupazione letta una volta
+        for sp in self.db.list_spettacoli():
+            if sp.id not in self._capienza:
+                occupazione = self._leggi_occupazione(sp.id)
+                if occupazione is not None:
+                    with self._lock:
+                        self._venduti.setdefault(sp.id, occupazione[0])
+                        self._capienza.setdefault(sp.id, occupazione[1])
+        with self._lock:
+            return {sp: (self._venduti[sp], capienza) for sp, capienza in self._capienza.items()}
+
+    def occupazione_per_sala(self) -> Dict[str, Tuple[int, int]]:
+        per_sala: Dict[str, Tuple[int, int]] = {}
+        for sp, (venduti, capienza) in self.occupazione_per_spettacolo().items():
+            sala_id = self.db.get_spettacolo(sp).sala_id
+            v, c = per_sala.get(sala_id, (0, 0))
+            per_sala[sala_id] = (v + venduti, c + capienza)
+        return per_sala
+
+    def conteggi_ordini(self) -> Dict[str, int]:
+        with self._lock:
+            c = list(self._conteggi)
+        return {"in_corso": c[IN_CORSO], "pagati": c[PAGATO], "annullati": c[ANNULLATO], "scaduti": c[SCADUTO]}
+
+    def tasso_conversione(self) -> Optional[float]:
+        # ordini pagati su ordini conclusi (pagati + annullati)
+        c = self.conteggi_ordini()
+        return _tasso(c["pagati"], c["pagati"] + c["annullati"])
+
+    def tasso_abbandono_hold(self) -> Optional[float]:
+        # hold terminati senza vendita (annullati o scaduti) su tutti gli hold terminati
+        c = self.conteggi_ordini()
+        abbandonati = c["annullati"] + c["scaduti"]
+        return _tasso(abbandonati, abbandonati + c["pagati"])
+
+    def riepilogo(self) -> Dict[str, Any]:
+        db = self.db
+        return {
+            "ricavi_per_film": [
+                {"film_id": fid, "titolo": db.get_film(fid).titolo, "ricavi_eur": round(r, 2), "ordini": n}
+                for fid, (r, n) in sorted(self.ricavi_per_film().items())
+            ],
+            "ricavi_per_spettacolo": [
+                {"spettacolo_id": sp, "ricavi_eur": round(r, 2), "ordini": n}
+                for sp, (r, n) in sorted(self.ricavi_per_spettacolo().items())
+            ],
+            "ricavi_per_giorno": [
+                {"giorno": g.isoformat(), "ricavi_eur": round(r, 2)} for g, r in self.ricavi_per_giorno().items()
+            ],
+            "occupazione_per_spettacolo": [
+                {"spettacolo_id": sp, "venduti": v, "capienza": c, "occupazione": _tasso(v, c)}
+                for sp, (v, c) in sorted(self.occupazione_per_spettacolo().items())
+            ],
+            "occupazione_per_sala": [
+                {"sala_id": s, "nome": db.get_sala(s).nome, "venduti": v, "capienza": c, "occupazione": _tasso(v, c)}
+                for s, (v, c) in sorted(self.occupazione_per_sala().items())
+            ],
+            "ordini": self.conteggi_ordini(),
+            "tasso_conversione": self.tasso_conversione(),
+            "tasso_abbandono_hold": self.tasso_abbandono_hold(),
+        }
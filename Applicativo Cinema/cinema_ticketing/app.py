@@ -1,13 +1,22 @@
 from __future__ import annotations
 
+import json
 import os
+from contextlib import nullcontext
 from dataclasses import dataclass
 from datetime import datetime, timedelta
+from typing import Any, ContextManager, Dict, Iterable, List, Optional, Tuple, Union
 
-from .adapters import ConsoleAdattatoreNotifiche, MockAdattatorePagamenti
+from .adapters import ConsoleAdattatoreNotifiche, GatewayNotifiche, MockAdattatorePagamenti
+from .analytics import AnalisiVendite, analisi_path
 from .domain import Cliente, DisponibilitaPosti, Film, Posto, SalaCinema, Spettacolo, StatoPosto
+from .journal import Journal, apri_journal, journal_path
+from .metrics import Metriche
+from .notifications import DispatcherNotifiche, Outbox, outbox_path
+from .partitions import ArchivioPartizioni, partizioni_path
 from .persistence import load_db, save_db
-from .repositories import InMemoryDB, SeedData
+from .repositories import InMemoryDB, RepositoryCinema, SeedData
+from .sqlite_repository import SqliteDB
 from .services import (
     AdattatorePagamentiService,
     GestoreAcquisto,
@@ -21,16 +30,113 @@ from .services import (
 
 @dataclass
 class AppContext:
-    db: InMemoryDB
+    db: RepositoryCinema
     gestore: GestoreAcquisto
     servizio_spettacoli: ServizioSpettacoli
     servizio_posti: ServizioPosti
     servizio_ordini: ServizioOrdini
     servizio_lista_attesa: ServizioListaAttesa
     state_file: str
+    storage: str = "json"
+    journal: Optional[Journal] = None
+    dispatcher: Optional[DispatcherNotifiche] = None
+    metriche: Optional[Metriche] = None
+    partizioni: Optional[ArchivioPartizioni] = None
+    # aggregati del report mantenuti dagli eventi e salvati con lo stato; None finché nessuno
+    # li ha chiesti o se quelli salvati non corrispondono più allo stato
+    analisi: Optional[AnalisiVendite] = None
 
     def save(self) -> None:
-        save_db(self.db, self.state_file)
+        if self.dispatcher:
+            self.dispatcher.outbox.sync()
+        if isinstance(self.db, SqliteDB):
+            if self.analisi:
+                self.db.save_aggregati(json.dumps(self.analisi.esporta()))
+            self.db.commit()
+            return
+        if not isinstance(self.db, InMemoryDB):
+            raise TypeError(f"Storage senza salvataggio: {type(self.db).__name__}")
+        self._salva_stato(self.db)
+        if self.analisi:
+            # dopo lo stato e con la sua firma: un crash tra le due scritture forza un ricalcolo
+            with _misura(self.metriche, "analisi.salva"):
+                _salva_aggregati(self.state_file, self.storage, self.analisi.esporta())
+
+    def _salva_stato(self, db: InMemoryDB) -> None:
+        if self.partizioni:
+            with _misura(self.metriche, "partizioni.salva"):
+                self.partizioni.salva(db)
+            return
+        # journal e file unico non usano le modifiche tracciate: si azzerano perché non crescano
+        modifiche = db.prendi_modifiche()
+        if self.journal:
+            self.journal.sync()
+            # il journal registra solo le tabelle operative: nuovi spettacoli richiedono uno snapshot
+            if self.journal.da_compattare() or "spettacoli" in modifiche:
+                self.journal.compatta(db, self.state_file)
+            return
+        with _misura(self.metriche, "persistence.save_db"):
+            save_db(db, self.state_file)
+
+    def analisi_vendite(self, ricalcola: bool = False) -> AnalisiVendite:
+        # senza aggregati validi si ricostruiscono dagli ordini (una volta: poi li mantiene save)
+        if self.analisi is None:
+            self.analisi = AnalisiVendite(self.db)
+            self.analisi.avvia()
+        elif ricalcola:
+            self.analisi.ricalcola()
+        return self.analisi
+
+    def chiudi(self, timeout_notifiche_s: float = 10.0) -> None:
+        # le notifiche non consegnate entro il timeout restano in outbox per il prossimo avvio
+        if self.dispatcher:
+            self.dispatcher.ferma(timeout_notifiche_s)
+
+
+def _firma_stato(state_file: str, storage: str) -> List[Optional[List[int]]]:
+    # i file che save riscrive: se cambiano senza che gli aggregati siano stati salvati con loro
+    # (crash tra le due scritture, record del journal non seguiti da un salvataggio) non valgono più
+    if storage == "partizioni":
+        paths = [partizioni_path(state_file)]
+    elif storage == "journal":
+        paths = [state_file, journal_path(state_file)]
+    else:
+        paths = [state_file]
+    firma: List[Optional[List[int]]] = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            firma.append(None)
+            continue
+        firma.append([st.st_mtime_ns, st.st_size])
+    return firma
+
+
+def _salva_aggregati(state_file: str, storage: str, dati: Dict[str, Any]) -> None:
+    path = analisi_path(state_file)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"firma": _firma_stato(state_file, storage), "dati": dati}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _leggi_aggregati(db: RepositoryCinema, state_file: str, storage: str) -> Optional[Dict[str, Any]]:
+    if isinstance(db, SqliteDB):
+        testo = db.get_aggregati()
+        return json.loads(testo) if testo else None
+    try:
+        with open(analisi_path(state_file), encoding="utf-8") as f:
+            salvati = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    return salvati["dati"] if salvati.get("firma") == _firma_stato(state_file, storage) else None
+
+
+def _misura(metriche: Optional[Metriche], nome: str) -> ContextManager[None]:
+    return metriche.misura(nome) if metriche else nullcontext()
 
 
 def _seed_db() -> InMemoryDB:
@@ -48,7 +154,7 @@ def _seed_db() -> InMemoryDB:
     pid = 1
     for r in range(1, sala1.righe + 1):
         for c in range(1, sala1.colonne + 1):
-            posti.append(Posto(id=f"p{pid}", riga=r, colonna=c))
+            posti.append(Posto(id=f"p{pid}", riga=r, colonna=c, sala_id=sala1.id))
             pid += 1
 
     now = datetime.now()
@@ -84,14 +190,75 @@ def _seed_db() -> InMemoryDB:
     return db
 
 
-def build_app_context(state_file: str = ".cinema_state.json") -> AppContext:
-    if os.path.exists(state_file):
-        db = load_db(state_file)
+def sqlite_path(state_file: str) -> str:
+    return os.path.splitext(state_file)[0] + ".sqlite3"
+
+
+def _apri_sqlite(state_file: str) -> SqliteDB:
+    db = SqliteDB(sqlite_path(state_file))
+    if db.vuoto():
+        # primo avvio: importa lo stato JSON esistente, altrimenti il seed
+        db.importa(load_db(state_file) if os.path.exists(state_file) else _seed_db())
+    return db
+
+
+def _apri_partizioni(state_file: str, tabelle: Optional[Iterable[str]]) -> Tuple[InMemoryDB, ArchivioPartizioni]:
+    archivio = ArchivioPartizioni(partizioni_path(state_file))
+    if not archivio.inizializzato():
+        # primo avvio: importa lo stato JSON esistente, altrimenti il seed
+        archivio.inizializza(load_db(state_file) if os.path.exists(state_file) else _seed_db())
+    return archivio.carica(tabelle), archivio
+
+
+def build_app_context(
+    state_file: str = ".cinema_state.json",
+    storage: str = "json",
+    tabelle: Optional[Iterable[str]] = None,
+    notifiche_async: bool = False,
+    provider_notifiche: Optional[GatewayNotifiche] = None,
+    metriche: Optional[Metriche] = None,
+) -> AppContext:
+    db: Union[InMemoryDB, SqliteDB]
+    partizioni = None
+    if storage == "sqlite":
+        with _misura(metriche, "sqlite.apri"):
+            db = _apri_sqlite(state_file)
+    elif storage == "partizioni":
+        with _misura(metriche, "partizioni.apri"):
+            db, partizioni = _apri_partizioni(state_file, tabelle)
+    elif os.path.exists(state_file):
+        with _misura(metriche, "persistence.load_db"):
+            db = load_db(state_file, tabelle=tabelle)
     else:
         db = _seed_db()
-        save_db(db, state_file)
+        with _misura(metriche, "persistence.save_db"):
+            save_db(db, state_file)
+    if metriche:
+        metriche.strumenta(db, "db")
+
+    journal = None
+    if storage == "journal" and isinstance(db, InMemoryDB):
+        with _misura(metriche, "journal.apri"):
+            journal = apri_journal(db, state_file)
+
+    # dopo il replay del journal e prima delle scadenze degli hold: gli aggregati salvati
+    # descrivono lo stato su disco, gli eventi di questo processo ci si sommano
+    analisi = None
+    with _misura(metriche, "analisi.carica"):
+        aggregati = _leggi_aggregati(db, state_file, storage)
+    if aggregati is not None:
+        analisi = AnalisiVendite(db)
+        analisi.importa(aggregati)
+        analisi.avvia(ricalcola=False)
 
-    notifiche = ConsoleAdattatoreNotifiche()
+    notifiche: GatewayNotifiche = provider_notifiche or ConsoleAdattatoreNotifiche()
+    if metriche:
+        metriche.strumenta(notifiche, "gateway_notifiche")
+    dispatcher = None
+    if notifiche_async:
+        dispatcher = DispatcherNotifiche(provider=notifiche, outbox=Outbox(outbox_path(state_file)))
+        dispatcher.avvia()
+        notifiche = dispatcher
     gateway_pagamenti = MockAdattatorePagamenti()
 
     servizio_spettacoli = ServizioSpettacoli(db=db)
@@ -100,6 +267,29 @@ def build_app_context(state_file: str = ".cinema_state.json") -> AppContext:
     servizio_biglietti = ServizioBiglietti(db=db)
     pagamenti_service = AdattatorePagamentiService(db=db, gateway=gateway_pagamenti)
     servizio_lista_attesa = ServizioListaAttesa(db=db, notifiche=notifiche, posti=servizio_posti)
+    if metriche:
+        # prima di collegare i sottoscrittori: anche le reazioni agli eventi finiscono nel profilo
+        for obj, prefisso in (
+            (journal, "journal"),
+            (gateway_pagamenti, "gateway_pagamenti"),
+            (servizio_spettacoli, "servizio_spettacoli"),
+            (servizio_posti, "servizio_posti"),
+            (servizio_posti.scadenze, "scadenze_hold"),
+            (servizio_ordini, "servizio_ordini"),
+            (servizio_biglietti, "servizio_biglietti"),
+            (pagamenti_service, "servizio_pagamenti"),
+            (servizio_lista_attesa, "servizio_lista_attesa"),
+            (dispatcher, "dispatcher_notifiche"),
+        ):
+            if obj is not None:
+                metriche.strumenta(obj, prefisso)
+
+    # posti liberati (admin, hold scaduti, pagamenti rifiutati) avvisano subito la lista d'attesa;
+    # il sottoscrittore si collega dopo il replay del journal per non riemettere notifiche passate
+    db.eventi_posti.sottoscrivi(servizio_lista_attesa.su_evento_posto)
+    scaduti = 0
+    if not isinstance(db, InMemoryDB) or db.tabella_caricata("disponibilita"):
+        scaduti = servizio_posti.scadenze.expire_due()
 
     gestore = GestoreAcquisto(
         spettacoli=servizio_spettacoli,
@@ -110,8 +300,10 @@ def build_app_context(state_file: str = ".cinema_state.json") -> AppContext:
         lista_attesa=servizio_lista_attesa,
         notifiche=notifiche,
     )
+    if metriche:
+        metriche.strumenta(gestore, "gestore")
 
-    return AppContext(
+    ctx = AppContext(
         db=db,
         gestore=gestore,
         servizio_spettacoli=servizio_spettacoli,
@@ -119,4 +311,15 @@ def build_app_context(state_file: str = ".cinema_state.json") -> AppContext:
         servizio_ordini=servizio_ordini,
         servizio_lista_attesa=servizio_lista_attesa,
         state_file=state_file,
-    )
\ No newline at end of file
+        storage=storage,
+        journal=journal,
+        dispatcher=dispatcher,
+        metriche=metriche,
+        partizioni=partizioni,
+        analisi=analisi,
+    )
+    if scaduti:
+        # hold scaduti e avvisi partiti all'avvio si salvano subito: anche i comandi di sola
+        # lettura, che non chiamano save, non rimandano gli stessi avvisi al prossimo avvio
+        ctx.save()
+    return ctx
\ No newline at end of file
@@ -3,24 +3,25 @@ from __future__ import annotations
 from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
-from typing import Optional
+from typing import List, Optional
 
 
-@dataclass(frozen=True)
+# slots: niente __dict__ per istanza, gli oggetti del dominio esistono a milioni (ordini, pagamenti)
+@dataclass(frozen=True, slots=True)
 class Cliente:
     id: str
     nome: str
     email: str
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Film:
     id: str
     titolo: str
     durata_min: int
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class SalaCinema:
     id: str
     nome: str
@@ -31,7 +32,7 @@ class SalaCinema:
         return self.righe * self.colonne
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Spettacolo:
     id: str
     film_id: str
@@ -40,11 +41,12 @@ class Spettacolo:
     prezzo_eur: float
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Posto:
     id: str
     riga: int
     colonna: int
+    sala_id: Optional[str] = None
 
     def etichetta(self) -> str:
         return f"{chr(ord('A') + self.riga - 1)}{self.colonna}"
@@ -56,7 +58,7 @@ class StatoPosto(str, Enum):
     VENDUTO = "VENDUTO"
 
 
-@dataclass
+@dataclass(slots=True)
 class DisponibilitaPosti:
     spettacolo_id: str
     posto_id: str
@@ -71,12 +73,12 @@ class StatoOrdine(str, Enum):
     ANNULLATO = "ANNULLATO"
 
 
-@dataclass
+@dataclass(slots=True)
 class OrdineAcquisto:
     id: str
     cliente_id: str
     spettacolo_id: str
-    posto_id: str
+    posti_ids: List[str]
     totale_eur: float
     stato: StatoOrdine
     creato_il: datetime
@@ -88,7 +90,7 @@ class EsitoPagamento(str, Enum):
     ANNULLATO = "ANNULLATO"
 
 
-@dataclass
+@dataclass(slots=True)
 class Pagamento:
     id: str
     ordine_id: str
@@ -99,7 +101,7 @@ class Pagamento:
     ricevuto_il: Optional[datetime] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Biglietto:
     id: str
     ordine_id: str
@@ -107,10 +109,24 @@ class Biglietto:
     emesso_il: datetime
 
 
-@dataclass
+@dataclass(slots=True)
 class IscrizioneListaAttesa:
     id: str
     cliente_id: str
     spettacolo_id: str
     creata_il: datetime
-    notificato: bool
\ No newline at end of file
+    notificato: bool
+
+
+@dataclass(slots=True)
+class EventoWebhook:
+    id: str  # chiave di idempotenza: pagamento_id|transaction_ref|esito
+    pagamento_id: str
+    transaction_ref: Optional[str]
+    esito: EsitoPagamento
+    biglietto_id: Optional[str]
+    ricevuto_il: datetime
+
+
+def chiave_webhook(pagamento_id: str, transaction_ref: Optional[str], esito: EsitoPagamento) -> str:
+    return f"{pagamento_id}|{transaction_ref or ''}|{esito.value}"
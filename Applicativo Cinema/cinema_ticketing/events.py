@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Generic, Iterator, List, Optional, TypeVar
+
+from .domain import OrdineAcquisto, StatoOrdine, StatoPosto
+
+
+@dataclass(frozen=True)
+class EventoPosto:
+    spettacolo_id: str
+    posto_id: str
+    precedente: Optional[StatoPosto]
+    stato: StatoPosto
+
+    @property
+    def liberato(self) -> bool:
+        return self.stato == StatoPosto.LIBERO and self.precedente != StatoPosto.LIBERO
+
+
+@dataclass(frozen=True)
+class EventoOrdine:
+    ordine: OrdineAcquisto
+    # stato prima del salvataggio, None per un ordine nuovo
+    precedente: Optional[StatoOrdine]
+
+
+SottoscrittorePosti = Callable[[EventoPosto], None]
+SottoscrittoreOrdini = Callable[[EventoOrdine], None]
+
+E = TypeVar("E")
+
+
+# Bus in-process e sincrono: i repository pubblicano ogni cambio dopo averlo applicato
+# (fuori dal lock dello spettacolo), i sottoscrittori reagiscono subito. Un servizio che modifica
+# più posti tenendo lui il lock dello spettacolo li pubblica all'uscita con rinviati().
+class _Bus(Generic[E]):
+    def __init__(self) -> None:
+        self._sottoscrittori: List[Callable[[E], None]] = []
+        self._locale = threading.local()
+
+    def attivo(self) -> bool:
+        return bool(self._sottoscrittori)
+
+    def sottoscrivi(self, callback: Callable[[E], None]) -> None:
+        self._sottoscrittori.append(callback)
+
+    def annulla(self, callback: Callable[[E], None]) -> None:
+        if callback in self._sottoscrittori:
+            self._sottoscrittori.remove(callback)
+
+    def pubblica(self, evento: E) -> None:
+        in_attesa = getattr(self._locale, "in_attesa", None)
+        if in_attesa is not None:
+            in_attesa.append(evento)
+            return
+        for callback in list(self._sottoscrittori):
+            callback(evento)
+
+    @contextmanager
+    def rinviati(self) -> Iterator[None]:
+        # trattiene gli eventi pubblicati da questo thread fino all'uscita dal blocco più esterno;
+        # escono anche se il blocco fallisce, perché i cambi già applicati restano
+        if getattr(self._locale, "in_attesa", None) is not None:
+            yield
+            return
+        self._locale.in_attesa = []
+        try:
+            yield
+        finally:
+            eventi, self._locale.in_attesa = self._locale.in_attesa, None
+            for evento in eventi:
+                self.pubblica(evento)
+
+
+class BusEventiPosti(_Bus[EventoPosto]):
+    pass
+
+
+class BusEventiOrdini(_Bus[EventoOrdine]):
+    pass
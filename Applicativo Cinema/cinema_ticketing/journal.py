@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from typing import Any, Optional, TextIO
+
+from .persistence import from_row, save_db, to_row
+from .repositories import InMemoryDB
+
+TABELLE_JOURNAL = ("disponibilita", "ordini", "pagamenti", "biglietti", "waitlist", "webhook")
+
+
+def journal_path(state_file: str) -> str:
+    return state_file + ".journal"
+
+
+def _applica(db: InMemoryDB, tabella: str, row: Any) -> None:
+    obj = from_row(tabella, row)
+    if tabella == "disponibilita":
+        db.set_stato_posto(obj.spettacolo_id, obj.posto_id, obj.stato, hold_scadenza=obj.hold_scadenza)
+    elif tabella == "ordini":
+        db.save_ordine(obj)
+    elif tabella == "pagamenti":
+        db.save_pagamento(obj)
+    elif tabella == "biglietti":
+        db.save_biglietto(obj)
+    elif tabella == "waitlist":
+        db.save_waitlist(obj)
+    elif tabella == "webhook":
+        db.save_evento_webhook(obj)
+
+
+def replay_journal(db: InMemoryDB, path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    applicati = 0
+    offset = 0
+    with open(path, "rb+") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                # ultimo record scritto a metà da un crash: non era confermato, lo scartiamo
+                f.truncate(offset)
+                break
+            tabella, row = json.loads(line)
+            _applica(db, tabella, row)
+            applicati += 1
+            offset += len(line)
+    return applicati
+
+
+class Journal:
+    def __init__(self, path: str, batch_size: int = 64, soglia_compattazione: int = 10_000, record: int = 0) -> None:
+        self.path = path
+        self.batch_size = batch_size
+        self.soglia_compattazione = soglia_compattazione
+        self.record = record
+        self._in_attesa = 0
+        self._f: Optional[TextIO] = None
+        self._lock = threading.Lock()
+
+    def _file(self) -> TextIO:
+        if self._f is None:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            self._f = open(self.path, "a", encoding="utf-8")
+        return self._f
+
+    def registra(self, tabella: str, obj: Any) -> None:
+        if tabella not in TABELLE_JOURNAL:
+            return
+        line = json.dumps([tabella, to_row(tabella, obj)], ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._file().write(line + "\n")
+            self.record += 1
+            self._in_attesa += 1
+            if self._in_attesa >= self.batch_size:
+                self._sync()
+
+    def sync(self) -> None:
+        with self._lock:
+            self._sync()
+
+    def _sync(self) -> None:
+        if self._f is None or not self._in_attesa:
+            return
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._in_attesa = 0
+
+    def da_compattare(self) -> bool:
+        return self.record >= self.soglia_compattazione
+
+    def compatta(self, db: InMemoryDB, state_file: str) -> None:
+        self.sync()
+        # save_db scrive su file temporaneo e lo rinomina: lo snapshot è sempre completo
+        save_db(db, state_file)
+        # un crash qui rigioca record già inclusi nello snapshot: sono upsert, quindi idempotenti
+        self.chiudi()
+        with open(self.path, "w", encoding="utf-8"):
+            pass
+        self.record = 0
+
+    def chiudi(self) -> None:
+        if self._f is not None:
+            self.sync()
+            self._f.close()
+            self._f = None
+
+
+def apri_journal(db: InMemoryDB, state_file: str, **kwargs: Any) -> Journal:
+    path = journal_path(state_file)
+    applicati = replay_journal(db, path)
+    journal = Journal(path, record=applicati, **kwargs)
+    db.osserva(journal.registra)
+    return journal
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import inspect
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, TextIO, Tuple
+
+# limiti superiori dei bucket dell'istogramma delle latenze, in secondi
+BUCKET_S = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class _Istogramma:
+    __slots__ = ("bucket", "chiamate", "errori", "totale_s", "proprio_s", "massimo_s")
+
+    def __init__(self) -> None:
+        self.bucket = [0] * (len(BUCKET_S) + 1)
+        self.chiamate = 0
+        self.errori = 0
+        self.totale_s = 0.0
+        self.proprio_s = 0.0
+        self.massimo_s = 0.0
+
+
+@dataclass
+class StadioProfilo:
+    operazione: str
+    chiamate: int
+    errori: int
+    totale_s: float
+    proprio_s: float
+    massimo_s: float
+
+
+def _etichetta(valore: str) -> str:
+    return valore.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Chiamate, errori e istogramma delle latenze per operazione. La strumentazione non tocca le
+# classi: avvolge i metodi delle singole istanze (strumenta), quindi senza un oggetto Metriche il
+# costo è nullo.
+# Per ogni chiamata si registra il tempo totale e quello "proprio", al netto delle chiamate
+# strumentate annidate nello stesso thread: è la ripartizione per stadio del profilo.
+@dataclass
+class Metriche:
+    _istogrammi: Dict[str, _Istogramma] = field(default_factory=dict, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+    _locale: threading.local = field(default_factory=threading.local, init=False, repr=False)
+
+    def _istogramma(self, nome: str) -> _Istogramma:
+        with self._lock:
+            h = self._istogrammi.get(nome)
+            if h is None:
+                h = self._istogrammi[nome] = _Istogramma()
+            return h
+
+    def _pila(self) -> List[float]:
+        try:
+            return self._locale.pila
+        except AttributeError:
+            pila = self._locale.pila = []
+            return pila
+
+    def _registra(self, h: _Istogramma, durata_s: float, proprio_s: float, errore: bool) -> None:
+        with self._lock:
+            h.bucket[bisect_left(BUCKET_S, durata_s)] += 1
+            h.chiamate += 1
+            h.errori += errore
+            h.totale_s += durata_s
+            h.proprio_s += proprio_s
+            if durata_s > h.massimo_s:
+                h.massimo_s = durata_s
+
+    @contextmanager
+    def misura(self, nome: str) -> Iterator[None]:
+        h = self._istogramma(nome)
+        pila = self._pila()
+        pila.append(0.0)
+        t0 = time.perf_counter()
+        errore = False
+        try:
+            yield
+        except BaseException:
+            errore = True
+            raise
+        finally:
+            durata = time.perf_counter() - t0
+            figli = pila.pop()
+            if pila:
+                pila[-1] += durata
+            self._registra(h, durata, durata - figli, errore)
+
+    def avvolgi(self, nome: str, funzione: Callable[..., Any]) -> Callable[..., Any]:
+        # percorso caldo: tutto in variabili locali della closure, istogramma risolto una volta sola
+        h = self._istogramma(nome)
+        bucket = h.bucket
+        locale = self._locale
+        lock = self._lock
+        orologio = time.perf_counter
+
+        def strumentata(*args: Any, **kwargs: Any) -> Any:
+            try:
+                pila = locale.pila
+            except AttributeError:
+                pila = locale.pila = []
+            pila.append(0.0)
+            t0 = orologio()
+            try:
+                return funzione(*args, **kwargs)
+            except BaseException:
+                with lock:
+                    h.errori += 1
+                raise
+            finally:
+                durata = orologio() - t0
+                figli = pila.pop()
+                if pila:
+                    pila[-1] += durata
+                with lock:
+                    bucket[bisect_left(BUCKET_S, durata)] += 1
+                    h.chiamate += 1
+                    h.totale_s += durata
+                    h.proprio_s += durata - figli
+                    if durata > h.massimo_s:
+                        h.massimo_s = durata
+
+        strumentata.__wrapped__ = funzione  # type: ignore[attr-defined]
+        return strumentata
+
+    def strumenta(self, obj: Any, prefisso: str) -> None:
+        # avvolge i metodi pubblici dell'istanza; i generatori sono esclusi (misurerebbero solo la
+        # creazione dell'iteratore, non lo scorrimento)
+        for nome, attributo in inspect.getmembers(type(obj)):
+            if nome.startswith("_") or not inspect.isfunction(attributo):
+                continue
+            if inspect.isgeneratorfunction(attributo) or nome in vars(obj):
+                continue
+            setattr(obj, nome, self.avvolgi(f"{prefisso}.{nome}", getattr(obj, nome)))
+
+    # --- lettura ed esportazione ---
+
+    def stadi(self) -> List[StadioProfilo]:
+        with self._lock:
+            voci = [
+                StadioProfilo(nome, h.chiamate, h.errori, h.totale_s, h.proprio_s, h.massimo_s)
+                for nome, h in self._istogrammi.items()
+                if h.chiamate
+            ]
+        return sorted(voci, key=lambda s: s.proprio_s, reverse=True)
+
+    def stampa_profilo(self, out: TextIO) -> None:
+        stadi = self.stadi()
+        totale = sum(s.proprio_s for s in stadi)
+        print("-- profilo per stadio (tempo proprio = al netto delle chiamate annidate) --", file=out)
+        print(
+            f"{'operazione':<44} {'chiamate':>8} {'totale ms':>10} {'proprio ms':>10} {'%':>6} {'media ms':>9} {'max ms':>8}",
+            file=out,
+        )
+        for s in stadi:
+            quota = s.proprio_s / totale if totale else 0.0
+            print(
+                f"{s.operazione:<44} {s.chiamate:>8} {s.totale_s * 1e3:>10.3f} {s.proprio_s * 1e3:>10.3f} "
+                f"{quota:>6.1%} {s.totale_s / s.chiamate * 1e3:>9.3f} {s.massimo_s * 1e3:>8.3f}",
+                file=out,
+            )
+
+    def prometheus(self, prefisso: str = "cinema") -> str:
+        with self._lock:
+            istogrammi: List[Tuple[str, _Istogramma]] = sorted(
+                (nome, h) for nome, h in self._istogrammi.items() if h.chiamate
+            )
+            righe = [
+                f"# HELP {prefisso}_operazione_secondi Latenza delle operazioni strumentate.",
+                f"# TYPE {prefisso}_operazione_secondi histogram",
+            ]
+            for nome, h in istogrammi:
+                op = _etichetta(nome)
+                cumulato = 0
+                for limite, n in zip(BUCKET_S, h.bucket):
+                    cumulato += n
+                    righe.append(f'{prefisso}_operazione_secondi_bucket{{operazione="{op}",le="{limite:g}"}} {cumulato}')
+                righe.append(f'{prefisso}_operazione_secondi_bucket{{operazione="{op}",le="+Inf"}} {h.chiamate}')
+                righe.append(f'{prefisso}_operazione_secondi_sum{{operazione="{op}"}} {h.totale_s!r}')
+                righe.append(f'{prefisso}_operazione_secondi_count{{operazione="{op}"}} {h.chiamate}')
+            righe += [
+                f"# HELP {prefisso}_operazione_errori_total Chiamate terminate con un'eccezione.",
+                f"# TYPE {prefisso}_operazione_errori_total counter",
+            ]
+            righe += [f'{prefisso}_operazione_errori_total{{operazione="{_etichetta(n)}"}} {h.errori}' for n, h in istogrammi]
+        return "\n".join(righe) + "\n"
+
+    def esporta_prometheus(self, path: str, prefisso: str = "cinema") -> None:
+        # scrittura atomica: chi raccoglie il file (textfile collector) non legge mai metà export
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.prometheus(prefisso))
+        os.replace(tmp, path)
@@ -0,0 +1,279 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, TextIO, Tuple
+
+from .adapters import GatewayNotifiche
+from .domain import Biglietto
+from .persistence import from_row, to_row
+
+BIGLIETTO = "biglietto"
+DISPONIBILITA = "disponibilita"
+
+
+@dataclass
+class MessaggioNotifica:
+    id: str
+    tipo: str
+    email: str
+    payload: Dict[str, Any]
+    tentativi: int = 0
+
+
+def outbox_path(state_file: str) -> str:
+    return state_file + ".outbox"
+
+
+def _riga(op: str, valore: Any) -> str:
+    return json.dumps([op, valore], ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+# Outbox durevole, append-only come il journal: "+" accoda un messaggio, "-" lo segna consegnato,
+# "x" lo scarta dopo l'ultimo tentativo. All'avvio i messaggi non chiusi vengono rispediti.
+class Outbox:
+    def __init__(self, path: str, soglia_compattazione: int = 1_000) -> None:
+        self.path = path
+        self.soglia_compattazione = soglia_compattazione
+        self._pendenti: Dict[str, MessaggioNotifica] = {}
+        self._chiusi = 0
+        self._lock = threading.Lock()
+        self._f: Optional[TextIO] = None
+        self._carica()
+
+    def _carica(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        offset = 0
+        with open(self.path, "rb+") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # record scritto a metà da un crash: non era confermato
+                    f.truncate(offset)
+                    break
+                op, valore = json.loads(line)
+                if op == "+":
+                    self._pendenti[valore["id"]] = MessaggioNotifica(**valore)
+                else:
+                    self._pendenti.pop(valore, None)
+                    self._chiusi += 1
+                offset += len(line)
+
+    def _file(self) -> TextIO:
+        if self._f is None:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            self._f = open(self.path, "a", encoding="utf-8")
+        return self._f
+
+    def pendenti(self) -> List[MessaggioNotifica]:
+        with self._lock:
+            return list(self._pendenti.values())
+
+    def aggiungi(self, msg: MessaggioNotifica) -> None:
+        with self._lock:
+            self._pendenti[msg.id] = msg
+            f = self._file()
+            f.write(_riga("+", asdict(msg)))
+            f.flush()
+
+    def chiudi_messaggi(self, ids: List[str], op: str = "-") -> None:
+        with self._lock:
+            f = self._file()
+            for mid in ids:
+                self._pendenti.pop(mid, None)
+                f.write(_riga(op, mid))
+            f.flush()
+            self._chiusi += len(ids)
+            if self._chiusi >= self.soglia_compattazione:
+                self._compatta()
+
+    def sync(self) -> None:
+        with self._lock:
+            if self._f is not None:
+                self._f.flush()
+                os.fsync(self._f.fileno())
+
+    def _compatta(self) -> None:
+        # riscrive solo i messaggi ancora da consegnare
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for msg in self._pendenti.values():
+                f.write(_riga("+", asdict(msg)))
+            f.flush()
+            os.fsync(f.fileno())
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+        os.replace(tmp, self.path)
+        self._chiusi = 0
+
+    def close(self) -> None:
+        with self._lock:
+            if self._f is not None:
+                self._f.flush()
+                os.fsync(self._f.fileno())
+                self._f.close()
+                self._f = None
+
+
+# Implementa GatewayNotifiche mettendo i messaggi in outbox e in una coda limitata: chi notifica
+# (webhook, lista d'attesa) non aspetta il provider. Un pool di worker consegna a lotti; gli
+# errori vengono ritentati con backoff esponenziale fino a max_tentativi.
+@dataclass
+class DispatcherNotifiche:
+    provider: GatewayNotifiche
+    outbox: Outbox
+    capacita: int = 1_000
+    worker: int = 4
+    lotto: int = 20
+    max_tentativi: int = 5
+    backoff_s: float = 0.5
+    backoff_max_s: float = 30.0
+    falliti: List[MessaggioNotifica] = field(default_factory=list, init=False)
+    _coda: queue.Queue = field(init=False, repr=False)
+    _ritardati: List[Tuple[float, int, MessaggioNotifica]] = field(default_factory=list, init=False, repr=False)
+    _trabocco: List[MessaggioNotifica] = field(default_factory=list, init=False, repr=False)
+    _seq: Any = field(default_factory=itertools.count, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+    _stop: threading.Event = field(default_factory=threading.Event, init=False, repr=False)
+    _threads: List[threading.Thread] = field(default_factory=list, init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self._coda = queue.Queue(maxsize=self.capacita)
+
+    def avvia(self) -> None:
+        if self._threads:
+            return
+        self._stop.clear()
+        # messaggi rimasti in outbox da un'esecuzione precedente
+        for msg in self.outbox.pendenti():
+            self._accoda(msg)
+        for n in range(self.worker):
+            t = threading.Thread(target=self._loop, name=f"notifiche-{n}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def ferma(self, timeout_s: Optional[float] = 10.0) -> bool:
+        # attende lo svuotamento della coda (entro timeout_s); ciò che resta è comunque in outbox
+        svuotato = self.attendi(timeout_s)
+        self._stop.set()
+        for t in self._threads:
+            t.join()
+        self._threads = []
+        self.outbox.close()
+        return svuotato
+
+    def attendi(self, timeout_s: Optional[float] = None) -> bool:
+        limite = None if timeout_s is None else time.monotonic() + timeout_s
+        while True:
+            with self._lock:
+                # unfinished_tasks scende solo dopo consegna o rimessa in attesa del messaggio
+                vuoto = not self._coda.unfinished_tasks and not self._ritardati and not self._trabocco
+            if vuoto:
+                return True
+            if limite is not None and time.monotonic() >= limite:
+                return False
+            time.sleep(0.01)
+
+    def invia_biglietto(self, email: str, biglietto: Biglietto) -> None:
+        self._nuovo(BIGLIETTO, email, to_row("biglietti", biglietto))
+
+    def invia_notifica_disponibilita(self, email: str, spettacolo_id: str) -> None:
+        self._nuovo(DISPONIBILITA, email, {"spettacolo_id": spettacolo_id})
+
+    def _nuovo(self, tipo: str, email: str, payload: Dict[str, Any]) -> None:
+        msg = MessaggioNotifica(id=f"ntf_{secrets.token_hex(6)}", tipo=tipo, email=email, payload=payload)
+        self.outbox.aggiungi(msg)
+        self._accoda(msg)
+
+    def _accoda(self, msg: MessaggioNotifica) -> None:
+        try:
+            self._coda.put_nowait(msg)
+        except queue.Full:
+            # coda piena: il messaggio è già in outbox, lo riprende un worker appena c'è posto
+            with self._lock:
+                self._trabocco.append(msg)
+
+    def _promuovi(self) -> None:
+        # sposta in coda i ritentativi scaduti e i messaggi in trabocco, finché c'è spazio
+        ora = time.monotonic()
+        with self._lock:
+            while self._ritardati and self._ritardati[0][0] <= ora and not self._coda.full():
+                self._coda.put_nowait(heapq.heappop(self._ritardati)[2])
+            while self._trabocco and not self._coda.full():
+                self._coda.put_nowait(self._trabocco.pop(0))
+
+    def _prendi_lotto(self) -> List[MessaggioNotifica]:
+        try:
+            primo = self._coda.get(timeout=0.05)
+        except queue.Empty:
+            return []
+        lotto = [primo]
+        while len(lotto) < self.lotto:
+            try:
+                lotto.append(self._coda.get_nowait())
+            except queue.Empty:
+                break
+        return lotto
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self._promuovi()
+            lotto = self._prendi_lotto()
+            if not lotto:
+                continue
+            try:
+                consegnati, da_ritentare = self._consegna(lotto)
+                self.outbox.chiudi_messaggi([m.id for m in consegnati])
+                for msg in da_ritentare:
+                    self._ritenta(msg)
+            finally:
+                for _ in lotto:
+                    self._coda.task_done()
+
+    def _consegna(self, lotto: List[MessaggioNotifica]) -> Tuple[List[MessaggioNotifica], List[MessaggioNotifica]]:
+        # provider con invio a lotti (un round-trip per lotto): tutto o niente
+        invia_lotto = getattr(self.provider, "invia_lotto", None)
+        if invia_lotto is not None:
+            try:
+                invia_lotto([self._argomenti(m) for m in lotto])
+                return lotto, []
+            except Exception:
+                return [], lotto
+        consegnati, da_ritentare = [], []
+        for msg in lotto:
+            try:
+                tipo, email, valore = self._argomenti(msg)
+                if tipo == BIGLIETTO:
+                    self.provider.invia_biglietto(email, valore)
+                else:
+                    self.provider.invia_notifica_disponibilita(email, valore)
+                consegnati.append(msg)
+            except Exception:
+                da_ritentare.append(msg)
+        return consegnati, da_ritentare
+
+    def _argomenti(self, msg: MessaggioNotifica) -> Tuple[str, str, Any]:
+        if msg.tipo == BIGLIETTO:
+            return msg.tipo, msg.email, from_row("biglietti", msg.payload)
+        return msg.tipo, msg.email, msg.payload["spettacolo_id"]
+
+    def _ritenta(self, msg: MessaggioNotifica) -> None:
+        msg.tentativi += 1
+        if msg.tentativi >= self.max_tentativi:
+            self.outbox.chiudi_messaggi([msg.id], op="x")
+            with self._lock:
+                self.falliti.append(msg)
+            return
+        attesa = min(self.backoff_max_s, self.backoff_s * 2 ** (msg.tentativi - 1))
+        with self._lock:
+            heapq.heappush(self._ritardati, (time.monotonic() + attesa, next(self._seq), msg))
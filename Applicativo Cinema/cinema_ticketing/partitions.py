@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import zlib
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import quote
+
+from .persistence import _carica_tabella, _righe_tabella, to_row
+from .repositories import TABELLE, InMemoryDB
+
+# tabelle che crescono con le vendite: divise in secchi per hash dell'id, così salvare un ordine
+# riscrive solo il secchio che lo contiene e non tutto lo storico
+TABELLE_A_SECCHI = ("ordini", "pagamenti", "biglietti", "waitlist")
+SECCHI = 64
+# tutte le altre tabelle sono una partizione unica (la disponibilità va per spettacolo)
+TUTTO = "tutto"
+# i secchi perdono l'ordine di inserimento tra record: al caricamento si ricompone quello cronologico
+_CRONOLOGIA = {"ordini": "creato_il", "biglietti": "emesso_il", "waitlist": "creata_il"}
+
+_FORMATO = "formato.json"
+_COMMIT = "_commit.json"
+_NUOVO = ".nuovo"
+
+
+def partizioni_path(state_file: str) -> str:
+    return os.path.splitext(state_file)[0] + ".d"
+
+
+def partizione(tabella: str, chiave: str) -> str:
+    if tabella == "disponibilita":
+        return chiave
+    if tabella in TABELLE_A_SECCHI:
+        return f"{zlib.crc32(chiave.encode('utf-8')) % SECCHI:02x}"
+    return TUTTO
+
+
+def _fsync_cartella(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _scrivi_sincrono(path: str, contenuto: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(contenuto)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _codifica(righe: List[Any]) -> bytes:
+    return json.dumps(righe, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class _CaricatorePartizioni:
+    def __init__(self, cartella: str) -> None:
+        self.cartella = cartella
+
+    def __call__(self, db: InMemoryDB) -> None:
+        tabella = os.path.basename(self.cartella)
+        righe: List[Dict[str, Any]] = []
+        for nome in sorted(os.listdir(self.cartella)):
+            if nome.endswith(".json"):
+                with open(os.path.join(self.cartella, nome), "rb") as f:
+                    righe.extend(json.loads(f.read()))
+        campo = _CRONOLOGIA.get(tabella)
+        if campo:
+            # date ISO dello stesso formato: l'ordine delle stringhe è quello temporale
+            righe.sort(key=lambda r: r[campo] or "")
+        _carica_tabella(db, tabella, righe)
+
+
+# Stato su disco diviso in partizioni: <cartella>/<tabella>/<partizione>.json, ognuna una lista
+# JSON di righe. Un salvataggio riscrive solo le partizioni che contengono modifiche (insiemi
+# "sporchi" tenuti dall'InMemoryDB): le partizioni fredde non vengono nemmeno aperte.
+# Commit atomico su più file: si scrivono i .nuovo, poi _commit.json (rename atomico) che li
+# elenca, poi i rename sui file definitivi. Un crash prima di _commit.json lascia lo stato
+# precedente, un crash dopo viene completato all'apertura successiva.
+@dataclass
+class ArchivioPartizioni:
+    cartella: str
+
+    def _path(self, tabella: str, nome: str) -> str:
+        return os.path.join(self.cartella, tabella, quote(nome, safe="") + ".json")
+
+    def inizializzato(self) -> bool:
+        return os.path.exists(os.path.join(self.cartella, _FORMATO))
+
+    def inizializza(self, db: InMemoryDB) -> None:
+        # primo avvio (o import interrotto): si scrivono tutte le partizioni da zero
+        if os.path.exists(self.cartella):
+            shutil.rmtree(self.cartella)
+        for tabella in TABELLE:
+            os.makedirs(os.path.join(self.cartella, tabella))
+            gruppi: Dict[str, List[Dict[str, Any]]] = {}
+            for obj in _righe_tabella(db, tabella):
+                riga = to_row(tabella, obj)
+                chiave = riga["spettacolo_id"] if tabella == "disponibilita" else riga["id"]
+                gruppi.setdefault(partizione(tabella, chiave), []).append(riga)
+            for nome, righe in gruppi.items():
+                _scrivi_sincrono(self._path(tabella, nome), _codifica(righe))
+            _fsync_cartella(os.path.join(self.cartella, tabella))
+        _scrivi_sincrono(os.path.join(self.cartella, _FORMATO), _codifica([{"version": 1, "secchi": SECCHI}]))
+        _fsync_cartella(self.cartella)
+        db.prendi_modifiche()
+
+    def carica(self, tabelle: Optional[Iterable[str]] = None) -> InMemoryDB:
+        self.recupera()
+        db = InMemoryDB()
+        for tabella in TABELLE:
+            db.carica_lazy(tabella, _CaricatorePartizioni(os.path.join(self.cartella, tabella)))
+        for tabella in TABELLE if tabelle is None else tabelle:
+            db.materializza(tabella)
+        return db
+
+    def recupera(self) -> None:
+        commit = os.path.join(self.cartella, _COMMIT)
+        if os.path.exists(commit):
+            with open(commit, "rb") as f:
+                for relativo in json.loads(f.read()):
+                    path = os.path.join(self.cartella, relativo)
+                    if os.path.exists(path + _NUOVO):
+                        os.replace(path + _NUOVO, path)
+            os.remove(commit)
+        # .nuovo senza commit: salvataggio interrotto prima del punto di non ritorno
+        if os.path.exists(commit + _NUOVO):
+            os.remove(commit + _NUOVO)
+        for tabella in TABELLE:
+            cartella = os.path.join(self.cartella, tabella)
+            for nome in os.listdir(cartella):
+                if nome.endswith(_NUOVO):
+                    os.remove(os.path.join(cartella, nome))
+
+    def salva(self, db: InMemoryDB) -> int:
+        modifiche = db.prendi_modifiche()
+        try:
+            return self._scrivi(db, modifiche)
+        except BaseException:
+            db.ripristina_modifiche(modifiche)
+            raise
+
+    def _scrivi(self, db: InMemoryDB, modifiche: Dict[str, Set[str]]) -> int:
+        contenuti: List[Tuple[str, bytes]] = []
+        for tabella, chiavi in modifiche.items():
+            per_partizione: Dict[str, Set[str]] = {}
+            for chiave in chiavi:
+                per_partizione.setdefault(partizione(tabella, chiave), set()).add(chiave)
+            for nome, chiavi_partizione in per_partizione.items():
+                righe = self._righe_partizione(db, tabella, nome, chiavi_partizione)
+                contenuti.append((os.path.relpath(self._path(tabella, nome), self.cartella), _codifica(righe)))
+        if not contenuti:
+            return 0
+
+        for relativo, contenuto in contenuti:
+            _scrivi_sincrono(os.path.join(self.cartella, relativo) + _NUOVO, contenuto)
+        commit = os.path.join(self.cartella, _COMMIT)
+        _scrivi_sincrono(commit + _NUOVO, _codifica([r for r, _ in contenuti]))
+        os.replace(commit + _NUOVO, commit)
+        _fsync_cartella(self.cartella)
+        for relativo, _ in contenuti:
+            path = os.path.join(self.cartella, relativo)
+            os.replace(path + _NUOVO, path)
+        for tabella in {relativo.split(os.sep, 1)[0] for relativo, _ in contenuti}:
+            _fsync_cartella(os.path.join(self.cartella, tabella))
+        os.remove(commit)
+        return len(contenuti)
+
+    def _righe_partizione(self, db: InMemoryDB, tabella: str, nome: str, chiavi: Set[str]) -> List[Dict[str, Any]]:
+        if tabella == "disponibilita":
+            return [to_row(tabella, d) for d in db.list_disponibilita_spettacolo(nome)]
+        if tabella not in TABELLE_A_SECCHI:
+            return [to_row(tabella, obj) for obj in _righe_tabella(db, tabella)]
+        # secchio: si rilegge la versione su disco e si sostituiscono solo le righe modificate
+        righe: Dict[str, Dict[str, Any]] = {}
+        try:
+            with open(self._path(tabella, nome), "rb") as f:
+                righe = {r["id"]: r for r in json.loads(f.read())}
+        except FileNotFoundError:
+            pass
+        record = getattr(db, tabella)
+        for chiave in sorted(chiavi):
+            righe[chiave] = to_row(tabella, record[chiave])
+        return list(righe.values())
@@ -3,13 +3,15 @@ from __future__ import annotations
 import json
 import os
 from datetime import datetime
-from typing import Any, Dict, Optional
+from sys import intern
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
 
 from .domain import (
     Biglietto,
     Cliente,
     DisponibilitaPosti,
     EsitoPagamento,
+    EventoWebhook,
     Film,
     IscrizioneListaAttesa,
     OrdineAcquisto,
@@ -20,7 +22,15 @@ from .domain import (
     StatoOrdine,
     StatoPosto,
 )
-from .repositories import InMemoryDB
+from . import snapshot
+from .repositories import TABELLE, InMemoryDB
+
+
+# Gli id ripetuti tra righe e tabelle (spettacolo, posto, cliente, ordine) sono internati al
+# caricamento: milioni di riferimenti condividono una sola stringa invece di una copia per riga
+# decodificata dal JSON.
+def _intern_opz(s: Optional[str]) -> Optional[str]:
+    return intern(s) if s is not None else None
 
 
 def _dt_to_str(dt: Optional[datetime]) -> Optional[str]:
@@ -31,172 +41,354 @@ def _str_to_dt(s: Optional[str]) -> Optional[datetime]:
     return datetime.fromisoformat(s) if s else None
 
 
-def save_db(db: InMemoryDB, path: str) -> None:
-    payload: Dict[str, Any] = {
-        "version": 1,
-        "clienti": [{"id": c.id, "nome": c.nome, "email": c.email} for c in db.clienti.values()],
-        "films": [{"id": f.id, "titolo": f.titolo, "durata_min": f.durata_min} for f in db.films.values()],
-        "sale": [{"id": s.id, "nome": s.nome, "righe": s.righe, "colonne": s.colonne} for s in db.sale.values()],
-        "posti": [{"id": p.id, "riga": p.riga, "colonna": p.colonna} for p in db.posti.values()],
-        "spettacoli": [
-            {
-                "id": sp.id,
-                "film_id": sp.film_id,
-                "sala_id": sp.sala_id,
-                "inizio": _dt_to_str(sp.inizio),
-                "prezzo_eur": sp.prezzo_eur,
-            }
-            for sp in db.spettacoli.values()
-        ],
-        "disponibilita": [
-            {
-                "spettacolo_id": d.spettacolo_id,
-                "posto_id": d.posto_id,
-                "stato": d.stato.value,
-                "hold_scadenza": _dt_to_str(d.hold_scadenza),
-            }
-            for d in db.disponibilita.values()
-        ],
-        "ordini": [
-            {
-                "id": o.id,
-                "cliente_id": o.cliente_id,
-                "spettacolo_id": o.spettacolo_id,
-                "posto_id": o.posto_id,
-                "totale_eur": o.totale_eur,
-                "stato": o.stato.value,
-                "creato_il": _dt_to_str(o.creato_il),
-            }
-            for o in db.ordini.values()
-        ],
-        "pagamenti": [
-            {
-                "id": p.id,
-                "ordine_id": p.ordine_id,
-                "provider": p.provider,
-                "importo_eur": p.importo_eur,
-                "esito": p.esito.value,
-                "transaction_ref": p.transaction_ref,
-                "ricevuto_il": _dt_to_str(p.ricevuto_il),
-            }
-            for p in db.pagamenti.values()
-        ],
-        "biglietti": [
-            {
-                "id": b.id,
-                "ordine_id": b.ordine_id,
-                "qr_code": b.qr_code,
-                "emesso_il": _dt_to_str(b.emesso_il),
-            }
-            for b in db.biglietti.values()
-        ],
-        "waitlist": [
-            {
-                "id": w.id,
-                "cliente_id": w.cliente_id,
-                "spettacolo_id": w.spettacolo_id,
-                "creata_il": _dt_to_str(w.creata_il),
-                "notificato": w.notificato,
-            }
-            for w in db.waitlist.values()
-        ],
+def _cliente_to_row(c: Cliente) -> Dict[str, Any]:
+    return {"id": c.id, "nome": c.nome, "email": c.email}
+
+
+def _row_to_cliente(c: Dict[str, Any]) -> Cliente:
+    return Cliente(id=intern(c["id"]), nome=c["nome"], email=c["email"])
+
+
+def _film_to_row(f: Film) -> Dict[str, Any]:
+    return {"id": f.id, "titolo": f.titolo, "durata_min": f.durata_min}
+
+
+def _row_to_film(f: Dict[str, Any]) -> Film:
+    return Film(id=intern(f["id"]), titolo=f["titolo"], durata_min=int(f["durata_min"]))
+
+
+def _sala_to_row(s: SalaCinema) -> Dict[str, Any]:
+    return {"id": s.id, "nome": s.nome, "righe": s.righe, "colonne": s.colonne}
+
+
+def _row_to_sala(s: Dict[str, Any]) -> SalaCinema:
+    return SalaCinema(id=intern(s["id"]), nome=s["nome"], righe=int(s["righe"]), colonne=int(s["colonne"]))
+
+
+def _posto_to_row(p: Posto) -> Dict[str, Any]:
+    return {"id": p.id, "riga": p.riga, "colonna": p.colonna, "sala_id": p.sala_id}
+
+
+def _row_to_posto(p: Dict[str, Any]) -> Posto:
+    return Posto(id=intern(p["id"]), riga=int(p["riga"]), colonna=int(p["colonna"]), sala_id=_intern_opz(p.get("sala_id")))
+
+
+def _spettacolo_to_row(sp: Spettacolo) -> Dict[str, Any]:
+    return {
+        "id": sp.id,
+        "film_id": sp.film_id,
+        "sala_id": sp.sala_id,
+        "inizio": _dt_to_str(sp.inizio),
+        "prezzo_eur": sp.prezzo_eur,
+    }
+
+
+def _row_to_spettacolo(sp: Dict[str, Any]) -> Spettacolo:
+    return Spettacolo(
+        id=intern(sp["id"]),
+        film_id=intern(sp["film_id"]),
+        sala_id=intern(sp["sala_id"]),
+        inizio=_str_to_dt(sp["inizio"]) or datetime.now(),
+        prezzo_eur=float(sp["prezzo_eur"]),
+    )
+
+
+def _disponibilita_to_row(d: DisponibilitaPosti) -> Dict[str, Any]:
+    return {
+        "spettacolo_id": d.spettacolo_id,
+        "posto_id": d.posto_id,
+        "stato": d.stato.value,
+        "hold_scadenza": _dt_to_str(d.hold_scadenza),
+    }
+
+
+def _row_to_disponibilita(d: Dict[str, Any]) -> DisponibilitaPosti:
+    return DisponibilitaPosti(
+        spettacolo_id=intern(d["spettacolo_id"]),
+        posto_id=intern(d["posto_id"]),
+        stato=StatoPosto(d["stato"]),
+        hold_scadenza=_str_to_dt(d.get("hold_scadenza")),
+    )
+
+
+def _ordine_to_row(o: OrdineAcquisto) -> Dict[str, Any]:
+    return {
+        "id": o.id,
+        "cliente_id": o.cliente_id,
+        "spettacolo_id": o.spettacolo_id,
+        "posti_ids": list(o.posti_ids),
+        "totale_eur": o.totale_eur,
+        "stato": o.stato.value,
+        "creato_il": _dt_to_str(o.creato_il),
+    }
+
+
+def _row_to_ordine(o: Dict[str, Any]) -> OrdineAcquisto:
+    return OrdineAcquisto(
+        id=intern(o["id"]),
+        cliente_id=intern(o["cliente_id"]),
+        spettacolo_id=intern(o["spettacolo_id"]),
+        # stati salvati prima degli ordini multi-posto hanno un solo "posto_id"
+        posti_ids=[intern(p) for p in o["posti_ids"]] if "posti_ids" in o else [intern(o["posto_id"])],
+        totale_eur=float(o["totale_eur"]),
+        stato=StatoOrdine(o["stato"]),
+        creato_il=_str_to_dt(o["creato_il"]) or datetime.utcnow(),
+    )
+
+
+def _pagamento_to_row(p: Pagamento) -> Dict[str, Any]:
+    return {
+        "id": p.id,
+        "ordine_id": p.ordine_id,
+        "provider": p.provider,
+        "importo_eur": p.importo_eur,
+        "esito": p.esito.value,
+        "transaction_ref": p.transaction_ref,
+        "ricevuto_il": _dt_to_str(p.ricevuto_il),
+    }
+
+
+def _row_to_pagamento(p: Dict[str, Any]) -> Pagamento:
+    return Pagamento(
+        id=intern(p["id"]),
+        ordine_id=intern(p["ordine_id"]),
+        provider=intern(p["provider"]),
+        importo_eur=float(p["importo_eur"]),
+        esito=EsitoPagamento(p["esito"]),
+        transaction_ref=p.get("transaction_ref"),
+        ricevuto_il=_str_to_dt(p.get("ricevuto_il")),
+    )
+
+
+def _biglietto_to_row(b: Biglietto) -> Dict[str, Any]:
+    return {
+        "id": b.id,
+        "ordine_id": b.ordine_id,
+        "qr_code": b.qr_code,
+        "emesso_il": _dt_to_str(b.emesso_il),
+    }
+
+
+def _row_to_biglietto(b: Dict[str, Any]) -> Biglietto:
+    return Biglietto(
+        id=intern(b["id"]),
+        ordine_id=intern(b["ordine_id"]),
+        qr_code=b["qr_code"],
+        emesso_il=_str_to_dt(b["emesso_il"]) or datetime.utcnow(),
+    )
+
+
+def _waitlist_to_row(w: IscrizioneListaAttesa) -> Dict[str, Any]:
+    return {
+        "id": w.id,
+        "cliente_id": w.cliente_id,
+        "spettacolo_id": w.spettacolo_id,
+        "creata_il": _dt_to_str(w.creata_il),
+        "notificato": w.notificato,
+    }
+
+
+def _row_to_waitlist(w: Dict[str, Any]) -> IscrizioneListaAttesa:
+    return IscrizioneListaAttesa(
+        id=intern(w["id"]),
+        cliente_id=intern(w["cliente_id"]),
+        spettacolo_id=intern(w["spettacolo_id"]),
+        creata_il=_str_to_dt(w["creata_il"]) or datetime.utcnow(),
+        notificato=bool(w["notificato"]),
+    )
+
+
+def _webhook_to_row(e: EventoWebhook) -> Dict[str, Any]:
+    return {
+        "id": e.id,
+        "pagamento_id": e.pagamento_id,
+        "transaction_ref": e.transaction_ref,
+        "esito": e.esito.value,
+        "biglietto_id": e.biglietto_id,
+        "ricevuto_il": _dt_to_str(e.ricevuto_il),
     }
 
+
+def _row_to_webhook(e: Dict[str, Any]) -> EventoWebhook:
+    return EventoWebhook(
+        id=intern(e["id"]),
+        pagamento_id=intern(e["pagamento_id"]),
+        transaction_ref=e.get("transaction_ref"),
+        esito=EsitoPagamento(e["esito"]),
+        biglietto_id=_intern_opz(e.get("biglietto_id")),
+        ricevuto_il=_str_to_dt(e["ricevuto_il"]) or datetime.utcnow(),
+    )
+
+
+_TO_ROW: Dict[str, Callable[[Any], Dict[str, Any]]] = {
+    "clienti": _cliente_to_row,
+    "films": _film_to_row,
+    "sale": _sala_to_row,
+    "posti": _posto_to_row,
+    "spettacoli": _spettacolo_to_row,
+    "disponibilita": _disponibilita_to_row,
+    "ordini": _ordine_to_row,
+    "pagamenti": _pagamento_to_row,
+    "biglietti": _biglietto_to_row,
+    "waitlist": _waitlist_to_row,
+    "webhook": _webhook_to_row,
+}
+
+_FROM_ROW: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    "clienti": _row_to_cliente,
+    "films": _row_to_film,
+    "sale": _row_to_sala,
+    "posti": _row_to_posto,
+    "spettacoli": _row_to_spettacolo,
+    "disponibilita": _row_to_disponibilita,
+    "ordini": _row_to_ordine,
+    "pagamenti": _row_to_pagamento,
+    "biglietti": _row_to_biglietto,
+    "waitlist": _row_to_waitlist,
+    "webhook": _row_to_webhook,
+}
+
+
+def to_row(tabella: str, obj: Any) -> Dict[str, Any]:
+    return _TO_ROW[tabella](obj)
+
+
+def from_row(tabella: str, row: Dict[str, Any]) -> Any:
+    return _FROM_ROW[tabella](row)
+
+
+_INTESTAZIONE = b'{"version": 1,\n'
+
+
+# Tabella letta dal file ma non ancora convertita in oggetti del dominio: `dati` è la porzione
+# JSON del file (non copiata), `righe` le righe già decodificate da un file in formato indentato.
+class _TabellaGrezza:
+    def __init__(
+        self, tabella: str, dati: Optional[memoryview] = None, righe: Optional[List[Dict[str, Any]]] = None
+    ) -> None:
+        self.tabella = tabella
+        self.dati = dati
+        self.righe = righe
+
+    def __call__(self, db: InMemoryDB) -> None:
+        righe = self.righe if self.righe is not None else json.loads(bytes(self.dati or b"[]"))
+        _carica_tabella(db, self.tabella, righe)
+
+
+def _carica_tabella(db: InMemoryDB, tabella: str, righe: Iterable[Dict[str, Any]]) -> None:
+    if tabella == "posti":
+        for p in righe:
+            db.add_posto(_row_to_posto(p))
+    elif tabella == "disponibilita":
+        for d in righe:
+            db.add_disponibilita(_row_to_disponibilita(d))
+        for mappa in db.iter_mappe():
+            mappa.condividi()
+    else:
+        target = getattr(db, tabella)
+        converti = _FROM_ROW[tabella]
+        for r in righe:
+            obj = converti(r)
+            target[obj.id] = obj
+
+
+def _righe_tabella(db: InMemoryDB, tabella: str) -> Iterable[Any]:
+    if tabella == "disponibilita":
+        return db.iter_disponibilita()
+    return getattr(db, tabella).values()
+
+
+def _json_tabella(db: InMemoryDB, tabella: str) -> Union[bytes, memoryview]:
+    pendente = db.caricatore_pendente(tabella)
+    if isinstance(pendente, _TabellaGrezza):
+        # tabella mai toccata dal comando: si riscrive così com'era, senza materializzarla
+        if pendente.dati is not None:
+            return pendente.dati
+        righe: Iterable[Any] = pendente.righe or []
+    else:
+        converti = _TO_ROW[tabella]
+        righe = [converti(obj) for obj in _righe_tabella(db, tabella)]
+    return json.dumps(righe, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+FORMATI = ("json", "binario")
+
+
+def formato_file(path: str) -> str:
+    try:
+        with open(path, "rb") as f:
+            return "binario" if snapshot.is_binario(f.read(len(snapshot.MAGIC))) else "json"
+    except FileNotFoundError:
+        return "json"
+
+
+def save_db(db: InMemoryDB, path: str, formato: Optional[str] = None) -> None:
+    # senza formato esplicito si mantiene quello del file esistente
+    formato = formato or formato_file(path)
+    if formato not in FORMATI:
+        raise ValueError(f"Formato stato non valido: {formato}")
+
     folder = os.path.dirname(path)
     if folder:
         os.makedirs(folder, exist_ok=True)
 
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False, indent=2)
+    # scrittura su file temporaneo + rename atomico: un crash a metà lascia intatto lo stato precedente
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        if formato == "binario":
+            f.write(snapshot.codifica(db))
+        else:
+            # Una tabella per riga: il file resta JSON valido (version 1) ma load_db può
+            # decodificare solo le tabelle che servono al comando.
+            parti = [(json.dumps(t).encode("utf-8"), _json_tabella(db, t)) for t in TABELLE]
+            f.write(_INTESTAZIONE)
+            for i, (chiave, dati) in enumerate(parti):
+                f.write(chiave)
+                f.write(b": ")
+                f.write(dati)
+                f.write(b",\n" if i < len(parti) - 1 else b"\n")
+            f.write(b"}\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
 
+def _tabelle_grezze(contenuto: bytes) -> Dict[str, Callable[[InMemoryDB], None]]:
+    if snapshot.is_binario(contenuto):
+        return dict(snapshot.sezioni(contenuto))
 
-def load_db(path: str) -> InMemoryDB:
-    with open(path, "r", encoding="utf-8") as f:
-        payload = json.load(f)
+    if contenuto.startswith(_INTESTAZIONE):
+        grezze: Dict[str, Callable[[InMemoryDB], None]] = {}
+        vista = memoryview(contenuto)
+        inizio = len(_INTESTAZIONE)
+        while inizio < len(contenuto):
+            fine = contenuto.find(b"\n", inizio)
+            if fine == -1:
+                fine = len(contenuto)
+            sep = contenuto.find(b": ", inizio, fine)
+            if sep != -1:
+                tabella = json.loads(contenuto[inizio:sep])
+                fine_dati = fine - 1 if contenuto[fine - 1] == ord(",") else fine
+                grezze[tabella] = _TabellaGrezza(tabella, dati=vista[sep + 2 : fine_dati])
+            inizio = fine + 1
+        return grezze
+
+    payload = json.loads(contenuto)
+    return {t: _TabellaGrezza(t, righe=payload.get(t, [])) for t in TABELLE if t in payload}
+
+
+def load_db(path: str, tabelle: Optional[Iterable[str]] = None) -> InMemoryDB:
+    with open(path, "rb") as f:
+        contenuto = f.read()
 
     db = InMemoryDB()
+    for tabella, grezza in _tabelle_grezze(contenuto).items():
+        db.carica_lazy(tabella, grezza)
+
+    for tabella in TABELLE if tabelle is None else tabelle:
+        db.materializza(tabella)
+    return db
+
 
-    for c in payload.get("clienti", []):
-        obj = Cliente(id=c["id"], nome=c["nome"], email=c["email"])
-        db.clienti[obj.id] = obj
-
-    for f_ in payload.get("films", []):
-        obj = Film(id=f_["id"], titolo=f_["titolo"], durata_min=int(f_["durata_min"]))
-        db.films[obj.id] = obj
-
-    for s in payload.get("sale", []):
-        obj = SalaCinema(
-            id=s["id"],
-            nome=s["nome"],
-            righe=int(s["righe"]),
-            colonne=int(s["colonne"]),
-        )
-        db.sale[obj.id] = obj
-
-    for p in payload.get("posti", []):
-        obj = Posto(id=p["id"], riga=int(p["riga"]), colonna=int(p["colonna"]))
-        db.posti[obj.id] = obj
-
-    for sp in payload.get("spettacoli", []):
-        obj = Spettacolo(
-            id=sp["id"],
-            film_id=sp["film_id"],
-            sala_id=sp["sala_id"],
-            inizio=_str_to_dt(sp["inizio"]) or datetime.now(),
-            prezzo_eur=float(sp["prezzo_eur"]),
-        )
-        db.spettacoli[obj.id] = obj
-
-    for d in payload.get("disponibilita", []):
-        obj = DisponibilitaPosti(
-            spettacolo_id=d["spettacolo_id"],
-            posto_id=d["posto_id"],
-            stato=StatoPosto(d["stato"]),
-            hold_scadenza=_str_to_dt(d.get("hold_scadenza")),
-        )
-        db.disponibilita[(obj.spettacolo_id, obj.posto_id)] = obj
-
-    for o in payload.get("ordini", []):
-        obj = OrdineAcquisto(
-            id=o["id"],
-            cliente_id=o["cliente_id"],
-            spettacolo_id=o["spettacolo_id"],
-            posto_id=o["posto_id"],
-            totale_eur=float(o["totale_eur"]),
-            stato=StatoOrdine(o["stato"]),
-            creato_il=_str_to_dt(o["creato_il"]) or datetime.utcnow(),
-        )
-        db.ordini[obj.id] = obj
-
-    for p in payload.get("pagamenti", []):
-        obj = Pagamento(
-            id=p["id"],
-            ordine_id=p["ordine_id"],
-            provider=p["provider"],
-            importo_eur=float(p["importo_eur"]),
-            esito=EsitoPagamento(p["esito"]),
-            transaction_ref=p.get("transaction_ref"),
-            ricevuto_il=_str_to_dt(p.get("ricevuto_il")),
-        )
-        db.pagamenti[obj.id] = obj
-
-    for b in payload.get("biglietti", []):
-        obj = Biglietto(
-            id=b["id"],
-            ordine_id=b["ordine_id"],
-            qr_code=b["qr_code"],
-            emesso_il=_str_to_dt(b["emesso_il"]) or datetime.utcnow(),
-        )
-        db.biglietti[obj.id] = obj
-
-    for w in payload.get("waitlist", []):
-        obj = IscrizioneListaAttesa(
-            id=w["id"],
-            cliente_id=w["cliente_id"],
-            spettacolo_id=w["spettacolo_id"],
-            creata_il=_str_to_dt(w["creata_il"]) or datetime.utcnow(),
-            notificato=bool(w["notificato"]),
-        )
-        db.waitlist[obj.id] = obj
-
-    return db
\ No newline at end of file
+def converti_stato(sorgente: str, destinazione: str, formato: str) -> None:
+    save_db(load_db(sorgente, tabelle=()), destinazione, formato=formato)
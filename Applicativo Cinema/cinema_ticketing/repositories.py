@@ -1,13 +1,16 @@
 from __future__ import annotations
 
+import bisect
+import threading
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Protocol, Set, Tuple
 
 from .domain import (
     Biglietto,
     Cliente,
     DisponibilitaPosti,
+    EventoWebhook,
     Film,
     IscrizioneListaAttesa,
     OrdineAcquisto,
@@ -15,8 +18,11 @@ from .domain import (
     Posto,
     SalaCinema,
     Spettacolo,
+    StatoOrdine,
     StatoPosto,
 )
+from .events import BusEventiOrdini, BusEventiPosti, EventoOrdine, EventoPosto
+from .seatmap import ASSENTE, MappaPosti, codice_stato, dt_to_micro
 
 
 class NotFoundError(RuntimeError):
@@ -37,20 +43,402 @@ class SeedData:
     disponibilita: List[DisponibilitaPosti]
 
 
-class InMemoryDB:
-    def __init__(self) -> None:
-        self.clienti: Dict[str, Cliente] = {}
-        self.films: Dict[str, Film] = {}
-        self.sale: Dict[str, SalaCinema] = {}
-        self.posti: Dict[str, Posto] = {}
-        self.spettacoli: Dict[str, Spettacolo] = {}
+# Lock a strisce per spettacolo: acquisti su spettacoli diversi non si contendono lo stesso lock.
+STRISCE_LOCK = 64
+
+# Webhook di pagamento già elaborati conservati per riconoscere le consegne duplicate.
+RITENZIONE_WEBHOOK = 10_000
+
+TABELLE = (
+    "clienti",
+    "films",
+    "sale",
+    "posti",
+    "spettacoli",
+    "disponibilita",
+    "ordini",
+    "pagamenti",
+    "biglietti",
+    "waitlist",
+    "webhook",
+)
+
+
+_Cronologia = List[Tuple[datetime, str]]
+# posizione in una cronologia: (data, id) dell'ultima riga già restituita
+Cursore = Tuple[datetime, str]
+
+
+def codifica_cursore(cursore: Cursore) -> str:
+    return f"{cursore[0].isoformat()}|{cursore[1]}"
+
+
+def decodifica_cursore(testo: str) -> Cursore:
+    data, sep, rid = testo.partition("|")
+    if not sep or not rid:
+        raise ValueError(f"Cursore non valido: {testo}")
+    return datetime.fromisoformat(data), rid
+
+
+def _intervallo(
+    cronologia: _Cronologia, dal: Optional[datetime], al: Optional[datetime], dopo: Optional[Cursore]
+) -> Iterator[str]:
+    # id delle voci con dal <= data < al e successive al cursore, senza copiare la lista
+    i = 0 if dal is None else bisect.bisect_left(cronologia, (dal, ""))
+    if dopo is not None:
+        i = max(i, bisect.bisect_right(cronologia, dopo))
+    while i < len(cronologia):
+        data, rid = cronologia[i]
+        if al is not None and data >= al:
+            return
+        yield rid
+        i += 1
+
+
+# Indici secondari di una tabella con data di creazione, ciascuno ordinato per (data, id):
+# cronologia completa, righe per cliente e per spettacolo. Le query leggono solo le k voci che servono.
+class _IndiceCronologico:
+    def __init__(self, data_di: Callable[[Any], datetime], righe: Iterable[Any] = ()) -> None:
+        self.data_di = data_di
+        self.cronologia: _Cronologia = []
+        self.per_cliente: Dict[str, _Cronologia] = {}
+        self.per_spettacolo: Dict[str, _Cronologia] = {}
+        for r in righe:
+            chiave = (data_di(r), r.id)
+            self.cronologia.append(chiave)
+            self.per_cliente.setdefault(r.cliente_id, []).append(chiave)
+            self.per_spettacolo.setdefault(r.spettacolo_id, []).append(chiave)
+        for lista in (self.cronologia, *self.per_cliente.values(), *self.per_spettacolo.values()):
+            lista.sort()
+
+    def _chiavi(self, r: Any) -> Tuple[str, str, datetime]:
+        return r.cliente_id, r.spettacolo_id, self.data_di(r)
+
+    def aggiorna(self, precedente: Optional[Any], r: Any) -> None:
+        if precedente is not None:
+            if self._chiavi(precedente) == self._chiavi(r):
+                return
+            self.rimuovi(precedente)
+        chiave = (self.data_di(r), r.id)
+        bisect.insort(self.cronologia, chiave)
+        bisect.insort(self.per_cliente.setdefault(r.cliente_id, []), chiave)
+        bisect.insort(self.per_spettacolo.setdefault(r.spettacolo_id, []), chiave)
+
+    def rimuovi(self, r: Any) -> None:
+        chiave = (self.data_di(r), r.id)
+        liste = (self.cronologia, self.per_cliente.get(r.cliente_id, []), self.per_spettacolo.get(r.spettacolo_id, []))
+        for lista in liste:
+            i = bisect.bisect_left(lista, chiave)
+            if i < len(lista) and lista[i] == chiave:
+                del lista[i]
+
+    def scegli(self, cliente_id: Optional[str], spettacolo_id: Optional[str]) -> _Cronologia:
+        # la lista più ristretta tra quelle compatibili con i filtri
+        if cliente_id is not None:
+            return self.per_cliente.get(cliente_id, [])
+        if spettacolo_id is not None:
+            return self.per_spettacolo.get(spettacolo_id, [])
+        return self.cronologia
+
+
+# Quello che servizi, analisi, programmazione, CLI e servizio HTTP chiedono allo storage:
+# InMemoryDB e SqliteDB lo implementano entrambi (nessuna classe base comune).
+class RepositoryCinema(Protocol):
+    eventi_posti: BusEventiPosti
+    eventi_ordini: BusEventiOrdini
+
+    def osserva(self, callback: Callable[[str, Any], None]) -> None:
+        ...
+
+    def rimuovi_osservatore(self, callback: Callable[[str, Any], None]) -> None:
+        ...
+
+    def lock_spettacolo(self, spettacolo_id: str) -> threading.RLock:
+        ...
+
+    # --- catalogo ---
+
+    def find_cliente(self, cliente_id: str) -> Optional[Cliente]:
+        ...
+
+    def list_spettacoli(self) -> List[Spettacolo]:
+        ...
+
+    def get_spettacolo(self, spettacolo_id: str) -> Spettacolo:
+        ...
+
+    def add_spettacoli(self, spettacoli: Iterable[Spettacolo]) -> None:
+        ...
+
+    def get_film(self, film_id: str) -> Film:
+        ...
+
+    def get_sala(self, sala_id: str) -> SalaCinema:
+        ...
+
+    def get_posto(self, posto_id: str) -> Posto:
+        ...
+
+    def find_posto_by_etichetta(self, sala_id: str, etichetta: str) -> Posto:
+        ...
+
+    # --- disponibilità ---
+
+    def get_disponibilita(self, spettacolo_id: str, posto_id: str) -> DisponibilitaPosti:
+        ...
+
+    def mappa_posti(self, spettacolo_id: str) -> MappaPosti:
+        ...
+
+    def list_disponibilita_by_stato(self, spettacolo_id: str, stato: StatoPosto) -> List[DisponibilitaPosti]:
+        ...
+
+    def list_disponibilita_bloccate(self) -> List[DisponibilitaPosti]:
+        ...
+
+    def conta_posti(self, spettacolo_id: str, stato: StatoPosto) -> int:
+        ...
+
+    def set_stato_posto(
+        self,
+        spettacolo_id: str,
+        posto_id: str,
+        stato: StatoPosto,
+        hold_scadenza: Optional[datetime] = None,
+    ) -> None:
+        ...
+
+    def cas_stato_posto(
+        self,
+        spettacolo_id: str,
+        posto_id: str,
+        attesi: Tuple[StatoPosto, ...],
+        stato: StatoPosto,
+        hold_scadenza: Optional[datetime] = None,
+        scadenza_attesa: Optional[datetime] = None,
+    ) -> bool:
+        ...
+
+    def cas_stato_posti(
+        self,
+        spettacolo_id: str,
+        posti_ids: List[str],
+        attesi: Tuple[StatoPosto, ...],
+        stato: StatoPosto,
+        hold_scadenza: Optional[datetime] = None,
+        scadenza_attesa: Optional[datetime] = None,
+    ) -> bool:
+        ...
+
+    def try_hold(self, spettacolo_id: str, posto_id: str, scadenza: datetime) -> bool:
+        ...
+
+    def try_hold_many(self, spettacolo_id: str, posti_ids: List[str], scadenza: datetime) -> bool:
+        ...
+
+    # --- ordini, pagamenti, biglietti, webhook ---
+
+    def save_ordine(self, ordine: OrdineAcquisto) -> None:
+        ...
+
+    def get_ordine(self, ordine_id: str) -> OrdineAcquisto:
+        ...
+
+    def list_ordini_ordinati(self, limite: Optional[int] = None, recenti_prima: bool = False) -> List[OrdineAcquisto]:
+        ...
+
+    def list_ordini_by_cliente(
+        self, cliente_id: str, limite: Optional[int] = None, recenti_prima: bool = False
+    ) -> List[OrdineAcquisto]:
+        ...
+
+    def list_ordini_by_spettacolo(
+        self, spettacolo_id: str, limite: Optional[int] = None, recenti_prima: bool = False
+    ) -> List[OrdineAcquisto]:
+        ...
+
+    def iter_ordini(
+        self,
+        cliente_id: Optional[str] = None,
+        spettacolo_id: Optional[str] = None,
+        stato: Optional[StatoOrdine] = None,
+        dal: Optional[datetime] = None,
+        al: Optional[datetime] = None,
+        dopo: Optional[Cursore] = None,
+    ) -> Iterator[OrdineAcquisto]:
+        ...
+
+    def save_pagamento(self, pagamento: Pagamento) -> None:
+        ...
+
+    def get_pagamento(self, pagamento_id: str) -> Pagamento:
+        ...
 
-        self.disponibilita: Dict[Tuple[str, str], DisponibilitaPosti] = {}
+    def save_biglietto(self, biglietto: Biglietto) -> None:
+        ...
+
+    def get_biglietto(self, biglietto_id: str) -> Biglietto:
+        ...
+
+    def get_biglietto_by_ordine(self, ordine_id: str) -> Optional[Biglietto]:
+        ...
 
-        self.ordini: Dict[str, OrdineAcquisto] = {}
-        self.pagamenti: Dict[str, Pagamento] = {}
-        self.biglietti: Dict[str, Biglietto] = {}
-        self.waitlist: Dict[str, IscrizioneListaAttesa] = {}
+    def get_evento_webhook(self, chiave: str) -> Optional[EventoWebhook]:
+        ...
+
+    def save_evento_webhook(self, evento: EventoWebhook) -> None:
+        ...
+
+    # --- lista d'attesa ---
+
+    def add_waitlist(self, iscr: IscrizioneListaAttesa) -> None:
+        ...
+
+    def save_waitlist(self, iscr: IscrizioneListaAttesa) -> None:
+        ...
+
+    def list_waitlist(self) -> List[IscrizioneListaAttesa]:
+        ...
+
+    def list_waitlist_by_spettacolo(self, spettacolo_id: str) -> List[IscrizioneListaAttesa]:
+        ...
+
+    def list_waitlist_pending_by_spettacolo(
+        self, spettacolo_id: str, limite: Optional[int] = None
+    ) -> List[IscrizioneListaAttesa]:
+        ...
+
+    def iter_waitlist(
+        self,
+        cliente_id: Optional[str] = None,
+        spettacolo_id: Optional[str] = None,
+        notificato: Optional[bool] = None,
+        dal: Optional[datetime] = None,
+        al: Optional[datetime] = None,
+        dopo: Optional[Cursore] = None,
+    ) -> Iterator[IscrizioneListaAttesa]:
+        ...
+
+    def spettacoli_con_attesa(self) -> List[str]:
+        ...
+
+
+# Attributo di tabella materializzato al primo accesso. Descrittore non-data: dopo il
+# caricamento il valore sta nel __dict__ dell'istanza e l'accesso torna a costo zero.
+class _Tabella:
+    def __init__(self, tabella: str) -> None:
+        self.tabella = tabella
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        self.attr = name
+
+    def __get__(self, obj: Optional[InMemoryDB], objtype: Optional[type] = None) -> Any:
+        if obj is None:
+            return self
+        obj._materializza(self.tabella)
+        return obj.__dict__[self.attr]
+
+
+def _tabella(tabella: str) -> Any:
+    # per i type checker l'attributo ha il tipo annotato, cioè quello del valore materializzato
+    return _Tabella(tabella)
+
+
+class InMemoryDB:
+    clienti: Dict[str, Cliente] = _tabella("clienti")
+    films: Dict[str, Film] = _tabella("films")
+    sale: Dict[str, SalaCinema] = _tabella("sale")
+    posti: Dict[str, Posto] = _tabella("posti")
+    _griglie_sale: Dict[Optional[str], Dict[Tuple[int, int], Posto]] = _tabella("posti")
+    spettacoli: Dict[str, Spettacolo] = _tabella("spettacoli")
+    _mappe: Dict[str, MappaPosti] = _tabella("disponibilita")
+    ordini: Dict[str, OrdineAcquisto] = _tabella("ordini")
+    pagamenti: Dict[str, Pagamento] = _tabella("pagamenti")
+    biglietti: Dict[str, Biglietto] = _tabella("biglietti")
+    waitlist: Dict[str, IscrizioneListaAttesa] = _tabella("waitlist")
+    webhook: Dict[str, EventoWebhook] = _tabella("webhook")
+
+    def __init__(self) -> None:
+        self._caricatori: Dict[str, Callable[[InMemoryDB], None]] = {}
+        for tabella in TABELLE:
+            self._init_tabella(tabella)
+
+        self._indice_posti_sale: Dict[str, List[Optional[str]]] = {}
+        # iscrizioni non notificate per spettacolo, ordinate per (creata_il, id); None = da ricostruire
+        self._attesa_pendenti: Optional[Dict[str, List[Tuple[datetime, str]]]] = None
+        # indici secondari per chiave esterna; None = da ricostruire al primo uso
+        self._indice_ordini: Optional[_IndiceCronologico] = None
+        self._indice_waitlist: Optional[_IndiceCronologico] = None
+        self._pagamenti_per_ordine: Optional[Dict[str, List[str]]] = None
+        self._biglietti_per_ordine: Optional[Dict[str, str]] = None
+        self.ritenzione_webhook = RITENZIONE_WEBHOOK
+        # chiavi modificate dall'ultimo salvataggio, per tabella (disponibilita: id spettacolo)
+        self._modifiche: Dict[str, Set[str]] = {}
+
+        self._osservatori: List[Callable[[str, Any], None]] = []
+        self.eventi_posti = BusEventiPosti()
+        self.eventi_ordini = BusEventiOrdini()
+
+        self._lock_caricamento = threading.RLock()
+        self._lock_strisce = [threading.RLock() for _ in range(STRISCE_LOCK)]
+
+    def _init_tabella(self, tabella: str) -> None:
+        if tabella == "clienti":
+            self.clienti = {}
+        elif tabella == "films":
+            self.films = {}
+        elif tabella == "sale":
+            self.sale = {}
+        elif tabella == "posti":
+            self.posti = {}
+            self._griglie_sale = {}
+        elif tabella == "spettacoli":
+            self.spettacoli = {}
+        elif tabella == "disponibilita":
+            self._mappe = {}
+        elif tabella == "ordini":
+            self.ordini = {}
+            self._indice_ordini = None
+        elif tabella == "pagamenti":
+            self.pagamenti = {}
+            self._pagamenti_per_ordine = None
+        elif tabella == "biglietti":
+            self.biglietti = {}
+            self._biglietti_per_ordine = None
+        elif tabella == "waitlist":
+            self.waitlist = {}
+            self._attesa_pendenti = None
+            self._indice_waitlist = None
+        elif tabella == "webhook":
+            # ordine di inserimento = ordine di arrivo: i più vecchi escono per primi
+            self.webhook = {}
+
+    def carica_lazy(self, tabella: str, caricatore: Callable[[InMemoryDB], None]) -> None:
+        for attr, descr in vars(InMemoryDB).items():
+            if isinstance(descr, _Tabella) and descr.tabella == tabella:
+                self.__dict__.pop(attr, None)
+        self._caricatori[tabella] = caricatore
+
+    def caricatore_pendente(self, tabella: str) -> Optional[Callable[[InMemoryDB], None]]:
+        return self._caricatori.get(tabella)
+
+    def tabella_caricata(self, tabella: str) -> bool:
+        return tabella not in self._caricatori
+
+    def materializza(self, tabella: str) -> None:
+        if tabella in self._caricatori:
+            self._materializza(tabella)
+
+    def _materializza(self, tabella: str) -> None:
+        with self._lock_caricamento:
+            caricatore = self._caricatori.pop(tabella, None)
+            if caricatore is None:
+                if tabella in TABELLE:
+                    # caricata nel frattempo da un altro thread
+                    return
+                raise AttributeError(f"Tabella non disponibile: {tabella}")
+            self._init_tabella(tabella)
+            caricatore(self)
 
     def load_seed(self, seed: SeedData) -> None:
         for c in seed.clienti:
@@ -60,11 +448,54 @@ class InMemoryDB:
         for s in seed.sale:
             self.sale[s.id] = s
         for p in seed.posti:
-            self.posti[p.id] = p
+            self.add_posto(p)
         for sp in seed.spettacoli:
             self.spettacoli[sp.id] = sp
         for d in seed.disponibilita:
-            self.disponibilita[(d.spettacolo_id, d.posto_id)] = d
+            self.add_disponibilita(d)
+
+    def _segna_modifica(self, tabella: str, chiave: str) -> None:
+        chiavi = self._modifiche.get(tabella)
+        if chiavi is None:
+            chiavi = self._modifiche.setdefault(tabella, set())
+        chiavi.add(chiave)
+
+    def prendi_modifiche(self) -> Dict[str, Set[str]]:
+        # restituisce le modifiche accumulate e ricomincia da zero
+        with self._lock_caricamento:
+            modifiche, self._modifiche = self._modifiche, {}
+        return modifiche
+
+    def ripristina_modifiche(self, modifiche: Dict[str, Set[str]]) -> None:
+        # salvataggio fallito: le modifiche restano da scrivere al prossimo tentativo
+        with self._lock_caricamento:
+            for tabella, chiavi in modifiche.items():
+                self._modifiche.setdefault(tabella, set()).update(chiavi)
+
+    def osserva(self, callback: Callable[[str, Any], None]) -> None:
+        self._osservatori.append(callback)
+
+    def rimuovi_osservatore(self, callback: Callable[[str, Any], None]) -> None:
+        if callback in self._osservatori:
+            self._osservatori.remove(callback)
+
+    def _notifica(self, tabella: str, record: Any) -> None:
+        for callback in self._osservatori:
+            callback(tabella, record)
+
+    def add_posto(self, posto: Posto) -> None:
+        old = self.posti.get(posto.id)
+        if old is not None:
+            self._griglie_sale.get(old.sala_id, {}).pop((old.riga, old.colonna), None)
+        self.posti[posto.id] = posto
+        self._indice_posti_sale.clear()
+        self._griglie_sale.setdefault(posto.sala_id, {})[(posto.riga, posto.colonna)] = posto
+
+    def find_cliente(self, cliente_id: str) -> Optional[Cliente]:
+        return self.clienti.get(cliente_id)
+
+    def list_spettacoli(self) -> List[Spettacolo]:
+        return list(self.spettacoli.values())
 
     def get_spettacolo(self, spettacolo_id: str) -> Spettacolo:
         sp = self.spettacoli.get(spettacolo_id)
@@ -106,19 +537,141 @@ class InMemoryDB:
         if riga < 1 or riga > sala.righe or col < 1 or col > sala.colonne:
             raise NotFoundError(f"Posto fuori sala: {etichetta}")
 
-        for p in self.posti.values():
-            if p.riga == riga and p.colonna == col:
-                return p
+        p = self._griglie_sale.get(sala.id, {}).get((riga, col))
+        if p is None:
+            # posti senza sala (stati salvati prima di Posto.sala_id)
+            p = self._griglie_sale.get(None, {}).get((riga, col))
+        if p is not None:
+            return p
         raise NotFoundError(f"Posto non trovato: {etichetta}")
 
+    def _mappa(self, spettacolo_id: str) -> Optional[MappaPosti]:
+        return self._mappe.get(spettacolo_id)
+
+    def _indice_posto(self, mappa: MappaPosti, posto_id: str) -> Optional[int]:
+        p = self.posti.get(posto_id)
+        if p is None or p.riga > mappa.righe or p.colonna > mappa.colonne:
+            return None
+        # la posizione (riga, colonna) da sola indirizzerebbe la cella di un'altra sala;
+        # i posti legacy senza sala valgono per tutte, come in _posti_sala
+        sp = self.spettacoli.get(mappa.spettacolo_id)
+        if sp is not None and p.sala_id is not None and p.sala_id != sp.sala_id:
+            raise NotFoundError(
+                f"Posto {posto_id} della sala {p.sala_id}, non della sala {sp.sala_id} dello spettacolo {sp.id}"
+            )
+        return mappa.indice(p.riga, p.colonna)
+
+    def _posti_sala(self, sala_id: str) -> List[Optional[str]]:
+        ids = self._indice_posti_sale.get(sala_id)
+        if ids is None:
+            sala = self.get_sala(sala_id)
+            griglia = self._griglie_sale.get(sala_id, {})
+            legacy = self._griglie_sale.get(None, {})
+            ids = []
+            for r in range(1, sala.righe + 1):
+                for c in range(1, sala.colonne + 1):
+                    p = griglia.get((r, c)) or legacy.get((r, c))
+                    ids.append(p.id if p else None)
+            self._indice_posti_sale[sala_id] = ids
+        return ids
+
+    def _crea_disponibilita(self, mappa: MappaPosti, i: int, posto_id: str) -> DisponibilitaPosti:
+        stato = mappa.stato(i)
+        if stato is None:
+            raise NotFoundError(f"Disponibilità non trovata: spettacolo={mappa.spettacolo_id}, posto={posto_id}")
+        return DisponibilitaPosti(
+            spettacolo_id=mappa.spettacolo_id,
+            posto_id=posto_id,
+            stato=stato,
+            hold_scadenza=mappa.scadenza(i),
+        )
+
+    def _disponibilita_da_indici(self, mappa: MappaPosti, indici: Iterable[int]) -> List[DisponibilitaPosti]:
+        sala_id = self.spettacoli[mappa.spettacolo_id].sala_id
+        ids = self._posti_sala(sala_id)
+        return [self._crea_disponibilita(mappa, i, posto_id) for i in indici if (posto_id := ids[i]) is not None]
+
     def get_disponibilita(self, spettacolo_id: str, posto_id: str) -> DisponibilitaPosti:
-        d = self.disponibilita.get((spettacolo_id, posto_id))
-        if not d:
-            raise NotFoundError(f"Disponibilità non trovata: spettacolo={spettacolo_id}, posto={posto_id}")
-        return d
+        mappa, i = self._posizione(spettacolo_id, posto_id)
+        return self._crea_disponibilita(mappa, i, posto_id)
+
+    def add_disponibilita(self, d: DisponibilitaPosti) -> None:
+        mappa = self._mappe.get(d.spettacolo_id)
+        if mappa is None:
+            sala = self.get_sala(self.get_spettacolo(d.spettacolo_id).sala_id)
+            mappa = MappaPosti(d.spettacolo_id, sala.righe, sala.colonne)
+            self._mappe[d.spettacolo_id] = mappa
+        i = self._indice_posto(mappa, d.posto_id)
+        if i is None:
+            raise NotFoundError(f"Posto fuori sala: spettacolo={d.spettacolo_id}, posto={d.posto_id}")
+        mappa.imposta(i, d.stato, d.hold_scadenza)
+
+    def modello_sala(self, sala_id: str) -> bytes:
+        # mappa di uno spettacolo senza vendite: LIBERO dove la sala ha un posto, ASSENTE altrove
+        libero = codice_stato(StatoPosto.LIBERO)
+        return bytes(ASSENTE if posto_id is None else libero for posto_id in self._posti_sala(sala_id))
+
+    def add_spettacoli(self, spettacoli: Iterable[Spettacolo]) -> None:
+        # inventario pigro: ogni nuovo spettacolo parte dal modello condiviso della sua sala
+        modelli: Dict[str, bytes] = {}
+        for sp in spettacoli:
+            modello = modelli.get(sp.sala_id)
+            if modello is None:
+                modello = modelli[sp.sala_id] = self.modello_sala(sp.sala_id)
+            sala = self.get_sala(sp.sala_id)
+            self.spettacoli[sp.id] = sp
+            self._mappe[sp.id] = MappaPosti.da_modello(sp.id, sala.righe, sala.colonne, modello)
+            self._segna_modifica("spettacoli", sp.id)
+            self._segna_modifica("disponibilita", sp.id)
+
+    def add_mappa(self, mappa: MappaPosti) -> None:
+        self._mappe[mappa.spettacolo_id] = mappa
+
+    def iter_mappe(self) -> Iterator[MappaPosti]:
+        return iter(self._mappe.values())
+
+    def mappa_posti(self, spettacolo_id: str) -> MappaPosti:
+        mappa = self._mappa(spettacolo_id)
+        if mappa is None:
+            raise NotFoundError(f"Disponibilità non trovata: spettacolo={spettacolo_id}")
+        return mappa
+
+    def iter_disponibilita(self) -> Iterator[DisponibilitaPosti]:
+        for mappa in self._mappe.values():
+            yield from self._disponibilita_da_indici(mappa, mappa.indici_presenti())
 
     def list_disponibilita_spettacolo(self, spettacolo_id: str) -> List[DisponibilitaPosti]:
-        return [d for (sp_id, _), d in self.disponibilita.items() if sp_id == spettacolo_id]
+        mappa = self._mappa(spettacolo_id)
+        if mappa is None:
+            return []
+        return self._disponibilita_da_indici(mappa, mappa.indici_presenti())
+
+    def list_disponibilita_by_stato(self, spettacolo_id: str, stato: StatoPosto) -> List[DisponibilitaPosti]:
+        mappa = self._mappa(spettacolo_id)
+        if mappa is None:
+            return []
+        return self._disponibilita_da_indici(mappa, mappa.indici(stato))
+
+    def list_disponibilita_bloccate(self) -> List[DisponibilitaPosti]:
+        bloccate: List[DisponibilitaPosti] = []
+        for mappa in self._mappe.values():
+            if mappa.conta(StatoPosto.BLOCCATO):
+                bloccate.extend(self._disponibilita_da_indici(mappa, mappa.indici(StatoPosto.BLOCCATO)))
+        return bloccate
+
+    def conta_posti(self, spettacolo_id: str, stato: StatoPosto) -> int:
+        mappa = self._mappa(spettacolo_id)
+        return mappa.conta(stato) if mappa else 0
+
+    def lock_spettacolo(self, spettacolo_id: str) -> threading.RLock:
+        return self._lock_strisce[hash(spettacolo_id) % len(self._lock_strisce)]
+
+    def _posizione(self, spettacolo_id: str, posto_id: str) -> Tuple[MappaPosti, int]:
+        mappa = self._mappa(spettacolo_id)
+        i = self._indice_posto(mappa, posto_id) if mappa else None
+        if mappa is None or i is None or not mappa.presente(i):
+            raise NotFoundError(f"Disponibilità non trovata: spettacolo={spettacolo_id}, posto={posto_id}")
+        return mappa, i
 
     def set_stato_posto(
         self,
@@ -127,12 +680,98 @@ class InMemoryDB:
         stato: StatoPosto,
         hold_scadenza: Optional[datetime] = None,
     ) -> None:
-        d = self.get_disponibilita(spettacolo_id, posto_id)
-        d.stato = stato
-        d.hold_scadenza = hold_scadenza
+        mappa, i = self._posizione(spettacolo_id, posto_id)
+        with self.lock_spettacolo(spettacolo_id):
+            precedente = mappa.stato(i)
+            mappa.imposta(i, stato, hold_scadenza)
+            self._segna_modifica("disponibilita", spettacolo_id)
+            if self._osservatori:
+                self._notifica("disponibilita", DisponibilitaPosti(spettacolo_id, posto_id, stato, hold_scadenza))
+        if self.eventi_posti.attivo():
+            self.eventi_posti.pubblica(EventoPosto(spettacolo_id, posto_id, precedente, stato))
+
+    def cas_stato_posto(
+        self,
+        spettacolo_id: str,
+        posto_id: str,
+        attesi: Tuple[StatoPosto, ...],
+        stato: StatoPosto,
+        hold_scadenza: Optional[datetime] = None,
+        scadenza_attesa: Optional[datetime] = None,
+    ) -> bool:
+        # compare-and-set: cambia stato solo se quello corrente è tra gli attesi (e, se indicata,
+        # la scadenza hold coincide). Confronto e scrittura avvengono sotto il lock dello spettacolo.
+        mappa, i = self._posizione(spettacolo_id, posto_id)
+        codici = [codice_stato(s) for s in attesi]
+        with self.lock_spettacolo(spettacolo_id):
+            if mappa.stati[i] not in codici:
+                return False
+            if scadenza_attesa is not None and mappa.scadenza_micro(i) != dt_to_micro(scadenza_attesa):
+                return False
+            precedente = mappa.stato(i)
+            mappa.imposta(i, stato, hold_scadenza)
+            self._segna_modifica("disponibilita", spettacolo_id)
+            # notifica sotto lock: gli osservatori (journal) vedono le transizioni nell'ordine reale
+            if self._osservatori:
+                self._notifica("disponibilita", DisponibilitaPosti(spettacolo_id, posto_id, stato, hold_scadenza))
+        if self.eventi_posti.attivo():
+            self.eventi_posti.pubblica(EventoPosto(spettacolo_id, posto_id, precedente, stato))
+        return True
+
+    def try_hold(self, spettacolo_id: str, posto_id: str, scadenza: datetime) -> bool:
+        return self.cas_stato_posto(
+            spettacolo_id, posto_id, (StatoPosto.LIBERO,), StatoPosto.BLOCCATO, hold_scadenza=scadenza
+        )
+
+    def cas_stato_posti(
+        self,
+        spettacolo_id: str,
+        posti_ids: List[str],
+        attesi: Tuple[StatoPosto, ...],
+        stato: StatoPosto,
+        hold_scadenza: Optional[datetime] = None,
+        scadenza_attesa: Optional[datetime] = None,
+    ) -> bool:
+        # tutto-o-niente: se anche un solo posto non è in uno stato atteso (o, se indicata, non ha
+        # quella scadenza hold) non se ne modifica nessuno
+        posizioni = [self._posizione(spettacolo_id, posto_id) for posto_id in posti_ids]
+        codici = [codice_stato(s) for s in attesi]
+        with self.lock_spettacolo(spettacolo_id):
+            if any(mappa.stati[i] not in codici for mappa, i in posizioni):
+                return False
+            if scadenza_attesa is not None:
+                attesa = dt_to_micro(scadenza_attesa)
+                if any(mappa.scadenza_micro(i) != attesa for mappa, i in posizioni):
+                    return False
+            precedenti = [mappa.stato(i) for mappa, i in posizioni]
+            self._segna_modifica("disponibilita", spettacolo_id)
+            for (mappa, i), posto_id in zip(posizioni, posti_ids):
+                mappa.imposta(i, stato, hold_scadenza)
+                if self._osservatori:
+                    self._notifica("disponibilita", DisponibilitaPosti(spettacolo_id, posto_id, stato, hold_scadenza))
+        if self.eventi_posti.attivo():
+            for posto_id, precedente in zip(posti_ids, precedenti):
+                self.eventi_posti.pubblica(EventoPosto(spettacolo_id, posto_id, precedente, stato))
+        return True
+
+    def try_hold_many(self, spettacolo_id: str, posti_ids: List[str], scadenza: datetime) -> bool:
+        return self.cas_stato_posti(
+            spettacolo_id, posti_ids, (StatoPosto.LIBERO,), StatoPosto.BLOCCATO, hold_scadenza=scadenza
+        )
+
+    def _indice_ordini_aggiornato(self) -> _IndiceCronologico:
+        if self._indice_ordini is None:
+            self._indice_ordini = _IndiceCronologico(lambda o: o.creato_il, self.ordini.values())
+        return self._indice_ordini
 
     def save_ordine(self, ordine: OrdineAcquisto) -> None:
+        precedente = self.ordini.get(ordine.id)
+        self._indice_ordini_aggiornato().aggiorna(precedente, ordine)
         self.ordini[ordine.id] = ordine
+        self._segna_modifica("ordini", ordine.id)
+        self._notifica("ordini", ordine)
+        if self.eventi_ordini.attivo():
+            self.eventi_ordini.pubblica(EventoOrdine(ordine, precedente.stato if precedente else None))
 
     def get_ordine(self, ordine_id: str) -> OrdineAcquisto:
         o = self.ordini.get(ordine_id)
@@ -140,8 +779,67 @@ class InMemoryDB:
             raise NotFoundError(f"Ordine non trovato: {ordine_id}")
         return o
 
+    def list_ordini(self) -> List[OrdineAcquisto]:
+        return list(self.ordini.values())
+
+    def _ordini(self, cronologia: _Cronologia, limite: Optional[int], recenti_prima: bool) -> List[OrdineAcquisto]:
+        if recenti_prima:
+            inizio = 0 if limite is None else max(len(cronologia) - limite, 0)
+            voci = cronologia[inizio:][::-1]
+        else:
+            voci = cronologia[:limite]
+        return [self.ordini[oid] for _, oid in voci]
+
+    def list_ordini_ordinati(self, limite: Optional[int] = None, recenti_prima: bool = False) -> List[OrdineAcquisto]:
+        return self._ordini(self._indice_ordini_aggiornato().cronologia, limite, recenti_prima)
+
+    def list_ordini_by_cliente(
+        self, cliente_id: str, limite: Optional[int] = None, recenti_prima: bool = False
+    ) -> List[OrdineAcquisto]:
+        return self._ordini(self._indice_ordini_aggiornato().per_cliente.get(cliente_id, []), limite, recenti_prima)
+
+    def list_ordini_by_spettacolo(
+        self, spettacolo_id: str, limite: Optional[int] = None, recenti_prima: bool = False
+    ) -> List[OrdineAcquisto]:
+        cronologia = self._indice_ordini_aggiornato().per_spettacolo.get(spettacolo_id, [])
+        return self._ordini(cronologia, limite, recenti_prima)
+
+    def iter_ordini(
+        self,
+        cliente_id: Optional[str] = None,
+        spettacolo_id: Optional[str] = None,
+        stato: Optional[StatoOrdine] = None,
+        dal: Optional[datetime] = None,
+        al: Optional[datetime] = None,
+        dopo: Optional[Cursore] = None,
+    ) -> Iterator[OrdineAcquisto]:
+        cronologia = self._indice_ordini_aggiornato().scegli(cliente_id, spettacolo_id)
+        for oid in _intervallo(cronologia, dal, al, dopo):
+            o = self.ordini[oid]
+            if spettacolo_id is not None and o.spettacolo_id != spettacolo_id:
+                continue
+            if stato is not None and o.stato != stato:
+                continue
+            yield o
+
+    def _indice_pagamenti(self) -> Dict[str, List[str]]:
+        if self._pagamenti_per_ordine is None:
+            indice: Dict[str, List[str]] = {}
+            for p in self.pagamenti.values():
+                indice.setdefault(p.ordine_id, []).append(p.id)
+            self._pagamenti_per_ordine = indice
+        return self._pagamenti_per_ordine
+
     def save_pagamento(self, pagamento: Pagamento) -> None:
+        indice = self._indice_pagamenti()
+        if pagamento.id not in self.pagamenti:
+            indice.setdefault(pagamento.ordine_id, []).append(pagamento.id)
         self.pagamenti[pagamento.id] = pagamento
+        self._segna_modifica("pagamenti", pagamento.id)
+        self._notifica("pagamenti", pagamento)
+
+    def list_pagamenti_by_ordine(self, ordine_id: str) -> List[Pagamento]:
+        return [self.pagamenti[pid] for pid in self._indice_pagamenti().get(ordine_id, [])]
 
     def get_pagamento(self, pagamento_id: str) -> Pagamento:
         p = self.pagamenti.get(pagamento_id)
@@ -151,18 +849,110 @@ class InMemoryDB:
 
     def save_biglietto(self, biglietto: Biglietto) -> None:
         self.biglietti[biglietto.id] = biglietto
+        self._indice_biglietti().setdefault(biglietto.ordine_id, biglietto.id)
+        self._segna_modifica("biglietti", biglietto.id)
+        self._notifica("biglietti", biglietto)
+
+    def get_biglietto(self, biglietto_id: str) -> Biglietto:
+        b = self.biglietti.get(biglietto_id)
+        if not b:
+            raise NotFoundError(f"Biglietto non trovato: {biglietto_id}")
+        return b
+
+    def _indice_biglietti(self) -> Dict[str, str]:
+        if self._biglietti_per_ordine is None:
+            indice: Dict[str, str] = {}
+            for b in self.biglietti.values():
+                indice.setdefault(b.ordine_id, b.id)
+            self._biglietti_per_ordine = indice
+        return self._biglietti_per_ordine
 
     def get_biglietto_by_ordine(self, ordine_id: str) -> Optional[Biglietto]:
-        for b in self.biglietti.values():
-            if b.ordine_id == ordine_id:
-                return b
-        return None
+        biglietto_id = self._indice_biglietti().get(ordine_id)
+        return self.biglietti[biglietto_id] if biglietto_id else None
+
+    def get_evento_webhook(self, chiave: str) -> Optional[EventoWebhook]:
+        return self.webhook.get(chiave)
+
+    def save_evento_webhook(self, evento: EventoWebhook) -> None:
+        eventi = self.webhook
+        eventi[evento.id] = evento
+        # ritenzione limitata: anche il replay del journal applica lo stesso taglio
+        while len(eventi) > self.ritenzione_webhook:
+            del eventi[next(iter(eventi))]
+        self._segna_modifica("webhook", evento.id)
+        self._notifica("webhook", evento)
+
+    def _indice_attesa(self) -> Dict[str, List[Tuple[datetime, str]]]:
+        if self._attesa_pendenti is None:
+            indice: Dict[str, List[Tuple[datetime, str]]] = {}
+            for w in self.waitlist.values():
+                if not w.notificato:
+                    indice.setdefault(w.spettacolo_id, []).append((w.creata_il, w.id))
+            for coda in indice.values():
+                coda.sort()
+            self._attesa_pendenti = indice
+        return self._attesa_pendenti
+
+    def _aggiorna_indice_attesa(self, iscr: IscrizioneListaAttesa) -> None:
+        indice = self._indice_attesa()
+        chiave = (iscr.creata_il, iscr.id)
+        coda = indice.setdefault(iscr.spettacolo_id, [])
+        i = bisect.bisect_left(coda, chiave)
+        presente = i < len(coda) and coda[i] == chiave
+        if iscr.notificato and presente:
+            del coda[i]
+            if not coda:
+                del indice[iscr.spettacolo_id]
+        elif not iscr.notificato and not presente:
+            coda.insert(i, chiave)
+        elif not coda:
+            del indice[iscr.spettacolo_id]
 
     def add_waitlist(self, iscr: IscrizioneListaAttesa) -> None:
+        self.save_waitlist(iscr)
+
+    def _indice_waitlist_aggiornato(self) -> _IndiceCronologico:
+        if self._indice_waitlist is None:
+            self._indice_waitlist = _IndiceCronologico(lambda w: w.creata_il, self.waitlist.values())
+        return self._indice_waitlist
+
+    def save_waitlist(self, iscr: IscrizioneListaAttesa) -> None:
+        self._indice_waitlist_aggiornato().aggiorna(self.waitlist.get(iscr.id), iscr)
         self.waitlist[iscr.id] = iscr
+        self._aggiorna_indice_attesa(iscr)
+        self._segna_modifica("waitlist", iscr.id)
+        self._notifica("waitlist", iscr)
 
     def list_waitlist_by_spettacolo(self, spettacolo_id: str) -> List[IscrizioneListaAttesa]:
         return [w for w in self.waitlist.values() if w.spettacolo_id == spettacolo_id]
 
-    def list_waitlist_pending(self) -> List[IscrizioneListaAttesa]:
-        return [w for w in self.waitlist.values() if not w.notificato]
\ No newline at end of file
+    def list_waitlist(self) -> List[IscrizioneListaAttesa]:
+        return list(self.waitlist.values())
+
+    def iter_waitlist(
+        self,
+        cliente_id: Optional[str] = None,
+        spettacolo_id: Optional[str] = None,
+        notificato: Optional[bool] = None,
+        dal: Optional[datetime] = None,
+        al: Optional[datetime] = None,
+        dopo: Optional[Cursore] = None,
+    ) -> Iterator[IscrizioneListaAttesa]:
+        cronologia = self._indice_waitlist_aggiornato().scegli(cliente_id, spettacolo_id)
+        for wid in _intervallo(cronologia, dal, al, dopo):
+            w = self.waitlist[wid]
+            if spettacolo_id is not None and w.spettacolo_id != spettacolo_id:
+                continue
+            if notificato is not None and w.notificato != notificato:
+                continue
+            yield w
+
+    def spettacoli_con_attesa(self) -> List[str]:
+        return list(self._indice_attesa())
+
+    def list_waitlist_pending_by_spettacolo(
+        self, spettacolo_id: str, limite: Optional[int] = None
+    ) -> List[IscrizioneListaAttesa]:
+        coda = self._indice_attesa().get(spettacolo_id, [])
+        return [self.waitlist[wid] for _, wid in coda[:limite]]
\ No newline at end of file
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import bisect
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .domain import Spettacolo
+from .repositories import RepositoryCinema
+
+GIORNI = ("lun", "mar", "mer", "gio", "ven", "sab", "dom")
+
+
+@dataclass(frozen=True)
+class RegolaProgrammazione:
+    # il film va in sala a ciascuno degli orari, nei giorni della settimana indicati (0 = lunedì)
+    film_id: str
+    sala_id: str
+    orari: Tuple[time, ...]
+    prezzo_eur: float
+    giorni: Tuple[int, ...] = tuple(range(7))
+
+
+def regole_da_json(dati: Iterable[Dict[str, Any]]) -> List[RegolaProgrammazione]:
+    # [{"film_id": "f1", "sala_id": "s1", "orari": ["18:00", "21:00"], "prezzo_eur": 9.9, "giorni": ["sab", "dom"]}]
+    regole = []
+    for r in dati:
+        try:
+            orari = tuple(time.fromisoformat(o) for o in r["orari"])
+            giorni = tuple(GIORNI.index(g) for g in r.get("giorni", GIORNI))
+            regole.append(
+                RegolaProgrammazione(
+                    film_id=r["film_id"],
+                    sala_id=r["sala_id"],
+                    orari=orari,
+                    prezzo_eur=float(r["prezzo_eur"]),
+                    giorni=giorni,
+                )
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Regola di programmazione non valida: {r!r} ({e})") from None
+    return regole
+
+
+# Intervalli [inizio, fine) occupati, per sala. Gli spettacoli di una sala non si sovrappongono,
+# quindi ordinati per inizio lo sono anche per fine: un nuovo intervallo si sovrappone solo se
+# l'ultimo che inizia prima della sua fine termina dopo il suo inizio (una ricerca binaria).
+class IndiceIntervalli:
+    def __init__(self) -> None:
+        self._inizi: Dict[str, List[datetime]] = {}
+        self._fini: Dict[str, List[datetime]] = {}
+        self._ids: Dict[str, List[str]] = {}
+
+    def conflitto(self, sala_id: str, inizio: datetime, fine: datetime) -> Optional[str]:
+        inizi = self._inizi.get(sala_id)
+        if not inizi:
+            return None
+        i = bisect.bisect_left(inizi, fine)
+        if i and self._fini[sala_id][i - 1] > inizio:
+            return self._ids[sala_id][i - 1]
+        return None
+
+    def aggiungi(self, sala_id: str, inizio: datetime, fine: datetime, spettacolo_id: str) -> None:
+        inizi = self._inizi.setdefault(sala_id, [])
+        i = bisect.bisect_right(inizi, inizio)
+        inizi.insert(i, inizio)
+        self._fini.setdefault(sala_id, []).insert(i, fine)
+        self._ids.setdefault(sala_id, []).insert(i, spettacolo_id)
+
+
+@dataclass
+class ProgrammaGenerato:
+    spettacoli: List[Spettacolo] = field(default_factory=list)
+    # spettacoli scartati e id di quello già in sala con cui si sovrappongono
+    conflitti: List[Tuple[Spettacolo, str]] = field(default_factory=list)
+
+
+def spettacolo_id(sala_id: str, inizio: datetime) -> str:
+    # in una sala non possono iniziare due spettacoli alla stessa ora: l'id è stabile tra rigenerazioni
+    return f"sp_{sala_id}_{inizio:%Y%m%d%H%M}"
+
+
+# Genera la programmazione di un periodo da regole film × sala × orari. La sovrapposizione in sala
+# usa la durata del film più la pausa tra due proiezioni; in caso di conflitto vince lo spettacolo
+# già in programma, poi la regola che viene prima. L'inventario posti dei nuovi spettacoli è pigro
+# (InMemoryDB.add_spettacoli): finché non si vende nulla non occupa memoria per posto.
+@dataclass
+class ServizioProgrammazione:
+    db: RepositoryCinema
+    pausa_min: int = 0
+
+    def _fine(self, inizio: datetime, durata_min: int) -> datetime:
+        return inizio + timedelta(minutes=durata_min + self.pausa_min)
+
+    def indice(self) -> IndiceIntervalli:
+        indice = IndiceIntervalli()
+        durate: Dict[str, int] = {}
+        for sp in sorted(self.db.list_spettacoli(), key=lambda s: s.inizio):
+            durata = durate.get(sp.film_id)
+            if durata is None:
+                durata = durate[sp.film_id] = self.db.get_film(sp.film_id).durata_min
+            indice.aggiungi(sp.sala_id, sp.inizio, self._fine(sp.inizio, durata), sp.id)
+        return indice
+
+    def genera(self, regole: Sequence[RegolaProgrammazione], dal: date, al: date) -> ProgrammaGenerato:
+        # giorni da `dal` incluso ad `al` escluso
+        if al <= dal:
+            raise ValueError(f"Periodo vuoto: dal={dal} al={al}")
+        durate = [self.db.get_film(r.film_id).durata_min for r in regole]
+        for r in regole:
+            self.db.get_sala(r.sala_id)
+
+        indice = self.indice()
+        esito = ProgrammaGenerato()
+        giorno = dal
+        while giorno < al:
+            settimana = giorno.weekday()
+            for regola, durata in zip(regole, durate):
+                if settimana not in regola.giorni:
+                    continue
+                for orario in regola.orari:
+                    inizio = datetime.combine(giorno, orario)
+                    fine = self._fine(inizio, durata)
+                    sp = Spettacolo(
+                        id=spettacolo_id(regola.sala_id, inizio),
+                        film_id=regola.film_id,
+                        sala_id=regola.sala_id,
+                        inizio=inizio,
+                        prezzo_eur=regola.prezzo_eur,
+                    )
+                    altro = indice.conflitto(regola.sala_id, inizio, fine)
+                    if altro is not None:
+                        esito.conflitti.append((sp, altro))
+                        continue
+                    indice.aggiungi(regola.sala_id, inizio, fine, sp.id)
+                    esito.spettacoli.append(sp)
+            giorno += timedelta(days=1)
+
+        self.db.add_spettacoli(esito.spettacoli)
+        return esito
@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import re
+from array import array
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from .domain import StatoPosto
+
+ASSENTE = 0xFF
+
+_CODICI = {StatoPosto.LIBERO: 0, StatoPosto.BLOCCATO: 1, StatoPosto.VENDUTO: 2}
+_STATI = (StatoPosto.LIBERO, StatoPosto.BLOCCATO, StatoPosto.VENDUTO)
+_LIBERO = _CODICI[StatoPosto.LIBERO]
+_BLOCCATO = _CODICI[StatoPosto.BLOCCATO]
+_VENDUTO = _CODICI[StatoPosto.VENDUTO]
+_CORSA_LIBERA = re.compile(re.escape(bytes([_LIBERO])) + b"+")
+
+_EPOCH = datetime(1970, 1, 1)
+_MICRO = timedelta(microseconds=1)
+
+
+def dt_to_micro(dt: Optional[datetime]) -> int:
+    return (dt - _EPOCH) // _MICRO if dt else 0
+
+
+def micro_to_dt(v: int) -> Optional[datetime]:
+    return _EPOCH + timedelta(microseconds=v) if v else None
+
+
+# stati di mappe mai toccate (solo LIBERO/ASSENTE), uno per disposizione di sala: le mappe di tutti
+# gli spettacoli senza vendite li condividono. Sono pochi (uno per sala), restano per la vita del processo.
+_MODELLI: Dict[bytes, bytes] = {}
+
+
+def modello_condiviso(stati: bytes) -> bytes:
+    return _MODELLI.setdefault(stati, stati)
+
+
+def codice_stato(stato: StatoPosto) -> int:
+    return _CODICI[stato]
+
+
+def stato_da_codice(codice: int) -> Optional[StatoPosto]:
+    return None if codice == ASSENTE else _STATI[codice]
+
+
+# Un byte di stato per posto (ordine riga-major) e un array parallelo di scadenze hold
+# in microsecondi dall'epoch (0 = nessuna). Solo i posti bloccati hanno una scadenza: l'array
+# esiste finché lo spettacolo ha almeno un posto BLOCCATO (None altrimenti), quindi uno
+# spettacolo senza hold in corso costa un byte per posto. Le posizioni senza inventario valgono ASSENTE.
+# Finché nessun posto è stato toccato `stati` è il bytes condiviso del modello di sala (nessun byte
+# per posto a carico dello spettacolo): la prima scrittura ne fa una copia privata.
+# _corse indicizza per riga le sequenze di posti liberi consecutivi (creato alla prima lettura); una riga
+# torna a None (da ricalcolare alla prossima lettura) solo quando un suo posto entra o esce da LIBERO.
+class MappaPosti:
+    __slots__ = ("spettacolo_id", "righe", "colonne", "stati", "scadenze", "_conteggi", "_corse")
+
+    def __init__(self, spettacolo_id: str, righe: int, colonne: int, iniziale: Optional[StatoPosto] = None) -> None:
+        n = righe * colonne
+        codice = ASSENTE if iniziale is None else _CODICI[iniziale]
+        self.spettacolo_id = spettacolo_id
+        self.righe = righe
+        self.colonne = colonne
+        self.stati: Union[bytes, bytearray] = bytearray([codice]) * n
+        self.scadenze: Optional[array] = None
+        self._conteggi = [0, 0, 0]
+        self._corse: Optional[List[Optional[List[Tuple[int, int]]]]] = None
+        if iniziale is not None:
+            self._conteggi[codice] = n
+
+    @classmethod
+    def da_modello(cls, spettacolo_id: str, righe: int, colonne: int, modello: bytes) -> MappaPosti:
+        if len(modello) != righe * colonne:
+            raise ValueError(f"Modello di sala incompatibile: spettacolo={spettacolo_id}")
+        mappa = cls(spettacolo_id, righe, colonne)
+        mappa.stati = modello_condiviso(modello)
+        mappa._conteggi = [mappa.stati.count(codice) for codice in range(len(_STATI))]
+        return mappa
+
+    @classmethod
+    def da_bytes(
+        cls,
+        spettacolo_id: str,
+        righe: int,
+        colonne: int,
+        stati: Union[bytes, memoryview],
+        scadenze: Union[bytes, memoryview],
+    ) -> MappaPosti:
+        mappa = cls(spettacolo_id, righe, colonne)
+        if len(stati) != righe * colonne or len(scadenze) != 8 * righe * colonne:
+            raise ValueError(f"Mappa posti corrotta: spettacolo={spettacolo_id}")
+        mappa.stati = bytearray(stati)
+        if mappa.stati.find(bytes([_BLOCCATO])) != -1:
+            mappa.scadenze = array("q")
+            mappa.scadenze.frombytes(scadenze)
+        mappa._conteggi = [mappa.stati.count(codice) for codice in range(len(_STATI))]
+        mappa._corse = None
+        mappa.condividi()
+        return mappa
+
+    def condividi(self) -> None:
+        # mappa ancora intatta (caricata da disco): torna a usare il modello condiviso
+        if not self._conteggi[_BLOCCATO] and not self._conteggi[_VENDUTO] and isinstance(self.stati, bytearray):
+            self.stati = modello_condiviso(bytes(self.stati))
+
+    def condivisa(self) -> bool:
+        return isinstance(self.stati, bytes)
+
+    def indice(self, riga: int, colonna: int) -> int:
+        if riga < 1 or riga > self.righe or colonna < 1 or colonna > self.colonne:
+            raise IndexError(f"Posto fuori mappa: riga={riga}, colonna={colonna}")
+        return (riga - 1) * self.colonne + (colonna - 1)
+
+    def riga_colonna(self, i: int) -> Tuple[int, int]:
+        r, c = divmod(i, self.colonne)
+        return r + 1, c + 1
+
+    def presente(self, i: int) -> bool:
+        return self.stati[i] != ASSENTE
+
+    def stato(self, i: int) -> Optional[StatoPosto]:
+        return stato_da_codice(self.stati[i])
+
+    def scadenza(self, i: int) -> Optional[datetime]:
+        return micro_to_dt(self.scadenza_micro(i))
+
+    def scadenza_micro(self, i: int) -> int:
+        return self.scadenze[i] if self.scadenze is not None else 0
+
+    def scadenze_bytes(self) -> bytes:
+        # lo snapshot binario ha sempre 8 byte per posto (0 = nessuna scadenza)
+        return self.scadenze.tobytes() if self.scadenze is not None else bytes(8 * len(self.stati))
+
+    def imposta(self, i: int, stato: StatoPosto, hold_scadenza: Optional[datetime] = None) -> None:
+        if isinstance(self.stati, bytes):
+            self.stati = bytearray(self.stati)
+        vecchio = self.stati[i]
+        nuovo = _CODICI[stato]
+        if vecchio != ASSENTE:
+            self._conteggi[vecchio] -= 1
+        self._conteggi[nuovo] += 1
+        self.stati[i] = nuovo
+        if hold_scadenza is not None:
+            if self.scadenze is None:
+                self.scadenze = array("q", bytes(8 * len(self.stati)))
+            self.scadenze[i] = dt_to_micro(hold_scadenza)
+        elif self.scadenze is not None:
+            if self._conteggi[_BLOCCATO]:
+                self.scadenze[i] = 0
+            else:
+                self.scadenze = None
+        if self._corse is not None and (vecchio == _LIBERO) != (nuovo == _LIBERO):
+            self._corse[i // self.colonne] = None
+
+    def conta(self, stato: StatoPosto) -> int:
+        return self._conteggi[_CODICI[stato]]
+
+    def indici(self, stato: StatoPosto) -> Iterator[int]:
+        return self._trova(bytes([_CODICI[stato]]))
+
+    def indici_presenti(self) -> Iterator[int]:
+        for i, codice in enumerate(self.stati):
+            if codice != ASSENTE:
+                yield i
+
+    def _trova(self, ago: bytes) -> Iterator[int]:
+        i = self.stati.find(ago)
+        while i != -1:
+            yield i
+            i = self.stati.find(ago, i + 1)
+
+    def riga(self, riga: int) -> bytes:
+        inizio = (riga - 1) * self.colonne
+        return bytes(self.stati[inizio : inizio + self.colonne])
+
+    def liberi_per_riga(self) -> List[int]:
+        libero = _CODICI[StatoPosto.LIBERO]
+        return [self.riga(r).count(libero) for r in range(1, self.righe + 1)]
+
+    def occupazione_per_riga(self) -> List[int]:
+        bloccato = _CODICI[StatoPosto.BLOCCATO]
+        venduto = _CODICI[StatoPosto.VENDUTO]
+        occupati = []
+        for r in range(1, self.righe + 1):
+            row = self.riga(r)
+            occupati.append(row.count(bloccato) + row.count(venduto))
+        return occupati
+
+    def corse_libere(self, riga: int) -> List[Tuple[int, int]]:
+        # (colonna iniziale 1-based, lunghezza) delle sequenze di posti liberi della riga
+        if self._corse is None:
+            self._corse = [None] * self.righe
+        corse = self._corse[riga - 1]
+        if corse is None:
+            corse = [(m.start() + 1, m.end() - m.start()) for m in _CORSA_LIBERA.finditer(self.riga(riga))]
+            self._corse[riga - 1] = corse
+        return corse
+
+    def blocchi_liberi(self, n: int) -> Iterator[Tuple[int, int, int]]:
+        # per ogni sequenza lunga almeno n: (riga, prima e ultima colonna da cui può partire il blocco)
+        for r in range(1, self.righe + 1):
+            for inizio, lunghezza in self.corse_libere(r):
+                if lunghezza >= n:
+                    yield r, inizio, inizio + lunghezza - n
+
+    def blocco_contiguo(self, riga: int, n: int) -> Optional[int]:
+        if n < 1 or n > self.colonne:
+            return None
+        row = self.riga(riga)
+        ago = bytes([_CODICI[StatoPosto.LIBERO]]) * n
+        centro = (self.colonne - n) / 2
+        migliore: Optional[int] = None
+        i = row.find(ago)
+        while i != -1:
+            if migliore is None or abs(i - centro) < abs(migliore - centro):
+                migliore = i
+            i = row.find(ago, i + 1)
+        return None if migliore is None else migliore + 1
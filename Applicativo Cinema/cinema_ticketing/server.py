@@ -0,0 +1,320 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import re
+import signal
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Pattern, Tuple, Union
+from urllib.parse import parse_qs, urlsplit
+
+from .analytics import AnalisiVendite
+from .app import AppContext
+from .domain import EsitoPagamento, StatoPosto
+from .events import EventoPosto
+from .persistence import to_row
+from .repositories import ConflictError, NotFoundError
+from .seatmap import ASSENTE, codice_stato
+
+_MOTIVI = {
+    200: "OK",
+    201: "Created",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+MAX_CORPO = 1 << 20
+
+# un carattere per posto nella mappa: L libero, B bloccato, V venduto, - senza inventario
+_SIMBOLI = bytes.maketrans(
+    bytes([codice_stato(StatoPosto.LIBERO), codice_stato(StatoPosto.BLOCCATO), codice_stato(StatoPosto.VENDUTO), ASSENTE]),
+    b"LBV-",
+)
+
+Risposta = Tuple[int, Union[bytes, Any]]
+
+
+class ErroreHttp(Exception):
+    def __init__(self, status: int, messaggio: str) -> None:
+        super().__init__(messaggio)
+        self.status = status
+
+
+def _json(corpo: bytes) -> Dict[str, Any]:
+    try:
+        dati = json.loads(corpo or b"{}")
+    except ValueError as e:
+        raise ErroreHttp(400, f"JSON non valido: {e}") from e
+    if not isinstance(dati, dict):
+        raise ErroreHttp(400, "Il corpo deve essere un oggetto JSON.")
+    return dati
+
+
+def _campo(dati: Dict[str, Any], nome: str) -> Any:
+    if nome not in dati:
+        raise ErroreHttp(400, f"Campo obbligatorio mancante: {nome}")
+    return dati[nome]
+
+
+def _codifica(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# Servizio HTTP/1.1 (keep-alive) su asyncio: lo stato resta in memoria nel processo, tutte le
+# operazioni girano sul thread dell'event loop (nessuna contesa sui dati) e il salvataggio avviene
+# a intervalli, solo se qualcosa è cambiato. Le mappe posti già serializzate restano in cache
+# finché il bus eventi non segnala un cambio sullo spettacolo.
+@dataclass
+class ServizioHttp:
+    ctx: AppContext
+    intervallo_salvataggio_s: float = 1.0
+    intervallo_scadenze_s: float = 1.0
+    file_metriche: Optional[str] = None
+    _rotte: List[Tuple[str, Pattern[str], Callable[..., Risposta]]] = field(default_factory=list, init=False)
+    _cache_mappe: Dict[str, bytes] = field(default_factory=dict, init=False, repr=False)
+    _sporco: bool = field(default=False, init=False, repr=False)
+    _attivita: List[asyncio.Task] = field(default_factory=list, init=False, repr=False)
+    _analisi: AnalisiVendite = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self._rotte = [
+            ("GET", re.compile(r"/spettacoli"), self._lista_spettacoli),
+            ("GET", re.compile(r"/spettacoli/(?P<spettacolo_id>[^/]+)/posti"), self._mappa_posti),
+            ("POST", re.compile(r"/acquisti"), self._acquista),
+            ("POST", re.compile(r"/webhook"), self._webhook),
+            ("GET", re.compile(r"/waitlist"), self._lista_waitlist),
+            ("POST", re.compile(r"/waitlist"), self._iscrivi_waitlist),
+            ("GET", re.compile(r"/ordini"), self._lista_ordini),
+            ("GET", re.compile(r"/ordini/(?P<ordine_id>[^/]+)"), self._ordine),
+            ("GET", re.compile(r"/report"), self._report),
+        ]
+        # aggregati residenti (caricati con lo stato o ricostruiti una volta): il report non scorre gli ordini
+        self._analisi = self.ctx.analisi_vendite()
+        self.ctx.db.osserva(self._su_modifica)
+        self.ctx.db.eventi_posti.sottoscrivi(self._su_evento_posto)
+
+    def _su_modifica(self, tabella: str, record: Any) -> None:
+        self._sporco = True
+
+    def _su_evento_posto(self, evento: EventoPosto) -> None:
+        self._sporco = True
+        self._cache_mappe.pop(evento.spettacolo_id, None)
+
+    # --- ciclo di vita ---
+
+    async def avvia(self, host: str = "127.0.0.1", port: int = 8080) -> asyncio.AbstractServer:
+        server = await asyncio.start_server(self._connessione, host, port)
+        self._attivita = [
+            asyncio.create_task(self._periodico(self.intervallo_salvataggio_s, self.salva)),
+            asyncio.create_task(self._periodico(self.intervallo_scadenze_s, self.ctx.servizio_posti.scadenze.expire_due)),
+        ]
+        if self.ctx.metriche and self.file_metriche:
+            self._attivita.append(
+                asyncio.create_task(self._periodico(self.intervallo_salvataggio_s, self.esporta_metriche))
+            )
+        return server
+
+    async def ferma(self, server: asyncio.AbstractServer) -> None:
+        server.close()
+        await server.wait_closed()
+        for t in self._attivita:
+            t.cancel()
+        await asyncio.gather(*self._attivita, return_exceptions=True)
+        self._attivita = []
+        self.salva()
+        self.esporta_metriche()
+
+    async def esegui(self, host: str = "127.0.0.1", port: int = 8080) -> None:
+        server = await self.avvia(host, port)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+        try:
+            await stop.wait()
+        finally:
+            await self.ferma(server)
+
+    async def _periodico(self, intervallo_s: float, funzione: Callable[[], Any]) -> None:
+        while True:
+            await asyncio.sleep(intervallo_s)
+            funzione()
+
+    def salva(self) -> None:
+        if self._sporco:
+            self._sporco = False
+            self.ctx.save()
+
+    def esporta_metriche(self) -> None:
+        if self.ctx.metriche and self.file_metriche:
+            self.ctx.metriche.esporta_prometheus(self.file_metriche)
+
+    # --- HTTP ---
+
+    async def _connessione(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    testa = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                try:
+                    metodo, bersaglio, versione, intestazioni = self._analizza(testa)
+                    lunghezza = int(intestazioni.get("content-length") or 0)
+                    if lunghezza < 0:
+                        raise ErroreHttp(400, "Content-Length negativo.")
+                    if lunghezza > MAX_CORPO:
+                        raise ErroreHttp(413, "Corpo della richiesta troppo grande.")
+                except ErroreHttp as e:
+                    writer.write(self._risposta(e.status, {"errore": str(e)}, chiudi=True))
+                    break
+                except ValueError:
+                    writer.write(self._risposta(400, {"errore": "Richiesta HTTP non valida."}, chiudi=True))
+                    break
+                corpo = await reader.readexactly(lunghezza) if lunghezza else b""
+                chiudi = intestazioni.get("connection", "").lower() == "close" or versione == "HTTP/1.0"
+                status, contenuto = self.gestisci(metodo, bersaglio, corpo)
+                writer.write(self._risposta(status, contenuto, chiudi))
+                await writer.drain()
+                if chiudi:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def _analizza(self, testa: bytes) -> Tuple[str, str, str, Dict[str, str]]:
+        righe = testa.decode("latin-1").split("\r\n")
+        metodo, bersaglio, versione = righe[0].split(" ", 2)
+        intestazioni = {}
+        for riga in righe[1:]:
+            if riga:
+                nome, valore = riga.split(":", 1)
+                intestazioni[nome.strip().lower()] = valore.strip()
+        return metodo, bersaglio, versione, intestazioni
+
+    def _risposta(self, status: int, contenuto: Union[bytes, Any], chiudi: bool) -> bytes:
+        corpo = contenuto if isinstance(contenuto, bytes) else _codifica(contenuto)
+        testa = (
+            f"HTTP/1.1 {status} {_MOTIVI.get(status, '')}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(corpo)}\r\n"
+            f"Connection: {'close' if chiudi else 'keep-alive'}\r\n\r\n"
+        )
+        return testa.encode("latin-1") + corpo
+
+    def gestisci(self, metodo: str, bersaglio: str, corpo: bytes) -> Risposta:
+        url = urlsplit(bersaglio)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        percorso_trovato = False
+        for metodo_rotta, schema, gestore in self._rotte:
+            m = schema.fullmatch(url.path)
+            if m is None:
+                continue
+            percorso_trovato = True
+            if metodo_rotta != metodo:
+                continue
+            try:
+                return gestore(corpo=corpo, query=query, **m.groupdict())
+            except ErroreHttp as e:
+                return e.status, {"errore": str(e)}
+            except NotFoundError as e:
+                return 404, {"errore": str(e)}
+            except ConflictError as e:
+                return 409, {"errore": str(e)}
+            except Exception as e:  # noqa: BLE001 - il servizio non deve cadere per una richiesta
+                return 500, {"errore": f"{type(e).__name__}: {e}"}
+        if percorso_trovato:
+            return 405, {"errore": f"Metodo non ammesso: {metodo} {url.path}"}
+        return 404, {"errore": f"Risorsa non trovata: {url.path}"}
+
+    # --- operazioni ---
+
+    def _lista_spettacoli(self, **_: Any) -> Risposta:
+        servizio = self.ctx.servizio_spettacoli
+        return 200, [{"id": sid, "descrizione": servizio.descrivi_spettacolo(sid)} for sid in servizio.lista_spettacoli()]
+
+    def _mappa_posti(self, spettacolo_id: str, **_: Any) -> Risposta:
+        corpo = self._cache_mappe.get(spettacolo_id)
+        if corpo is None:
+            mappa = self.ctx.db.mappa_posti(spettacolo_id)
+            simboli = bytes(mappa.stati).translate(_SIMBOLI).decode("ascii")
+            corpo = _codifica(
+                {
+                    "spettacolo_id": spettacolo_id,
+                    "righe": mappa.righe,
+                    "colonne": mappa.colonne,
+                    "liberi": mappa.conta(StatoPosto.LIBERO),
+                    "posti": [simboli[r * mappa.colonne : (r + 1) * mappa.colonne] for r in range(mappa.righe)],
+                }
+            )
+            self._cache_mappe[spettacolo_id] = corpo
+        return 200, corpo
+
+    def _acquista(self, corpo: bytes, **_: Any) -> Risposta:
+        dati = _json(corpo)
+        cliente_id = _campo(dati, "cliente_id")
+        spettacolo_id = _campo(dati, "spettacolo_id")
+        if "quantita" in dati:
+            quantita = dati["quantita"]
+            if not isinstance(quantita, int) or isinstance(quantita, bool) or quantita < 1:
+                raise ErroreHttp(400, "Quantità non valida: serve un intero positivo.")
+            ordine, pagamento = self.ctx.gestore.avvia_acquisto_migliori(cliente_id, spettacolo_id, quantita)
+        else:
+            posti = _campo(dati, "posti")
+            if not isinstance(posti, str) and not (
+                isinstance(posti, list) and all(isinstance(et, str) for et in posti)
+            ):
+                raise ErroreHttp(400, "Posti non validi: serve un'etichetta o una lista di etichette.")
+            ordine, pagamento = self.ctx.gestore.avvia_acquisto(cliente_id, spettacolo_id, posti)
+        return 201, {"ordine": to_row("ordini", ordine), "pagamento": to_row("pagamenti", pagamento)}
+
+    def _webhook(self, corpo: bytes, **_: Any) -> Risposta:
+        dati = _json(corpo)
+        try:
+            esito = EsitoPagamento[str(_campo(dati, "esito")).upper()]
+        except KeyError as e:
+            raise ErroreHttp(400, "Esito non valido. Usa: AUTORIZZATO, RIFIUTATO, ANNULLATO") from e
+        biglietto = self.ctx.gestore.webhook_esito_pagamento(
+            _campo(dati, "pagamento_id"), esito, dati.get("transaction_ref")
+        )
+        return 200, {"biglietto": to_row("biglietti", biglietto) if biglietto else None}
+
+    def _lista_waitlist(self, query: Dict[str, str], **_: Any) -> Risposta:
+        spettacolo_id: Optional[str] = query.get("spettacolo")
+        db = self.ctx.db
+        items = db.list_waitlist_by_spettacolo(spettacolo_id) if spettacolo_id else db.list_waitlist()
+        return 200, [to_row("waitlist", w) for w in sorted(items, key=lambda w: w.creata_il)]
+
+    def _iscrivi_waitlist(self, corpo: bytes, **_: Any) -> Risposta:
+        dati = _json(corpo)
+        iscr = self.ctx.servizio_lista_attesa.iscrivi(_campo(dati, "cliente_id"), _campo(dati, "spettacolo_id"))
+        return 201, to_row("waitlist", iscr)
+
+    def _lista_ordini(self, query: Dict[str, str], **_: Any) -> Risposta:
+        db = self.ctx.db
+        try:
+            limite = int(query["limite"]) if "limite" in query else None
+        except ValueError as e:
+            raise ErroreHttp(400, "Parametro limite non valido.") from e
+        recenti_prima = query.get("recenti") in ("1", "true")
+        if "cliente" in query:
+            ordini = db.list_ordini_by_cliente(query["cliente"], limite, recenti_prima)
+        elif "spettacolo" in query:
+            ordini = db.list_ordini_by_spettacolo(query["spettacolo"], limite, recenti_prima)
+        else:
+            ordini = db.list_ordini_ordinati(limite, recenti_prima)
+        return 200, [to_row("ordini", o) for o in ordini]
+
+    def _ordine(self, ordine_id: str, **_: Any) -> Risposta:
+        return 200, to_row("ordini", self.ctx.db.get_ordine(ordine_id))
+
+    def _report(self, **_: Any) -> Risposta:
+        return 200, self._analisi.riepilogo()
@@ -1,21 +1,26 @@
 from __future__ import annotations
 
+import heapq
 import secrets
-from dataclasses import dataclass
+import threading
+from dataclasses import dataclass, field, replace
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import List, Optional, Sequence, Set, Tuple, Union
 
 from .adapters import GatewayNotifiche, GatewayPagamenti
 from .domain import (
     Biglietto,
     EsitoPagamento,
+    EventoWebhook,
     IscrizioneListaAttesa,
     OrdineAcquisto,
     Pagamento,
     StatoOrdine,
     StatoPosto,
+    chiave_webhook,
 )
-from .repositories import ConflictError, InMemoryDB, NotFoundError
+from .events import EventoPosto
+from .repositories import ConflictError, NotFoundError, RepositoryCinema
 
 
 def _new_id(prefix: str) -> str:
@@ -24,10 +29,10 @@ def _new_id(prefix: str) -> str:
 
 @dataclass
 class ServizioSpettacoli:
-    db: InMemoryDB
+    db: RepositoryCinema
 
     def lista_spettacoli(self) -> List[str]:
-        return list(self.db.spettacoli.keys())
+        return [sp.id for sp in self.db.list_spettacoli()]
 
     def descrivi_spettacolo(self, spettacolo_id: str) -> str:
         sp = self.db.get_spettacolo(spettacolo_id)
@@ -36,74 +41,260 @@ class ServizioSpettacoli:
         return f"{sp.id} | {film.titolo} | Sala {sala.nome} | {sp.inizio:%Y-%m-%d %H:%M} | €{sp.prezzo_eur:.2f}"
 
 
+@dataclass
+class ScadenzeHold:
+    db: RepositoryCinema
+    _heap: List[Tuple[datetime, str, str]] = field(default_factory=list, init=False, repr=False)
+    _caricato: bool = field(default=False, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+    _stop: threading.Event = field(default_factory=threading.Event, init=False, repr=False)
+    _ticker: Optional[threading.Thread] = field(default=None, init=False, repr=False)
+
+    def carica(self) -> None:
+        with self._lock:
+            self._carica()
+
+    def _carica(self) -> None:
+        self._heap = [
+            (d.hold_scadenza, d.spettacolo_id, d.posto_id)
+            for d in self.db.list_disponibilita_bloccate()
+            if d.hold_scadenza
+        ]
+        heapq.heapify(self._heap)
+        self._caricato = True
+
+    def registra(self, spettacolo_id: str, posto_id: str, scadenza: datetime) -> None:
+        with self._lock:
+            if not self._caricato:
+                self._carica()
+            heapq.heappush(self._heap, (scadenza, spettacolo_id, posto_id))
+
+    def prossima_scadenza(self) -> Optional[datetime]:
+        with self._lock:
+            if not self._caricato:
+                self._carica()
+            return self._heap[0][0] if self._heap else None
+
+    def expire_due(self, now: Optional[datetime] = None) -> int:
+        now = now or datetime.utcnow()
+        # percorso veloce senza lock (chiamato a ogni blocco): nessuna scadenza dovuta
+        if self._caricato:
+            try:
+                if self._heap[0][0] > now:
+                    return 0
+            except IndexError:
+                return 0
+        rilasciati = 0
+        with self._lock:
+            if not self._caricato:
+                self._carica()
+            while self._heap and self._heap[0][0] <= now:
+                scadenza, spettacolo_id, posto_id = heapq.heappop(self._heap)
+                try:
+                    d = self.db.get_disponibilita(spettacolo_id, posto_id)
+                except NotFoundError:
+                    continue
+                # voce superata: posto venduto, liberato o ribloccato con un'altra scadenza
+                if d.stato != StatoPosto.BLOCCATO or d.hold_scadenza != scadenza:
+                    continue
+                if self.db.cas_stato_posto(
+                    spettacolo_id, posto_id, (StatoPosto.BLOCCATO,), StatoPosto.LIBERO, scadenza_attesa=scadenza
+                ):
+                    rilasciati += 1
+        return rilasciati
+
+    def avvia_ticker(self, intervallo_s: float = 1.0) -> None:
+        if self._ticker and self._ticker.is_alive():
+            return
+        self._stop.clear()
+        self._ticker = threading.Thread(target=self._loop, args=(intervallo_s,), name="scadenze-hold", daemon=True)
+        self._ticker.start()
+
+    def ferma_ticker(self) -> None:
+        self._stop.set()
+        if self._ticker:
+            self._ticker.join()
+            self._ticker = None
+
+    def _loop(self, intervallo_s: float) -> None:
+        while not self._stop.wait(intervallo_s):
+            self.expire_due()
+
+
+@dataclass(frozen=True)
+class PreferenzePosti:
+    riga_ideale: Optional[int] = None  # default: a circa 2/3 della sala dallo schermo
+    peso_centro: float = 1.0
+    peso_riga: float = 1.0
+
+
 @dataclass
 class ServizioPosti:
-    db: InMemoryDB
+    db: RepositoryCinema
     hold_minutes: int = 10
+    scadenze: ScadenzeHold = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.scadenze = ScadenzeHold(self.db)
 
     def posti_liberi(self, spettacolo_id: str) -> List[str]:
-        self._scadenze_hold(spettacolo_id)
         posti = []
-        for d in self.db.list_disponibilita_spettacolo(spettacolo_id):
-            if d.stato == StatoPosto.LIBERO:
-                p = self.db.get_posto(d.posto_id)
-                posti.append(p.etichetta())
+        for d in self.db.list_disponibilita_by_stato(spettacolo_id, StatoPosto.LIBERO):
+            p = self.db.get_posto(d.posto_id)
+            posti.append(p.etichetta())
         return sorted(posti)
 
     def verifica_disponibilita(self, spettacolo_id: str) -> bool:
-        return len(self.posti_liberi(spettacolo_id)) > 0
+        return self.db.conta_posti(spettacolo_id, StatoPosto.LIBERO) > 0
+
+    def occupazione_per_riga(self, spettacolo_id: str) -> List[int]:
+        return self.db.mappa_posti(spettacolo_id).occupazione_per_riga()
+
+    def posti_contigui(self, spettacolo_id: str, riga: int, n: int) -> Optional[List[str]]:
+        mappa = self.db.mappa_posti(spettacolo_id)
+        colonna = mappa.blocco_contiguo(riga, n)
+        if colonna is None:
+            return None
+        return [f"{chr(ord('A') + riga - 1)}{c}" for c in range(colonna, colonna + n)]
+
+    def migliori_posti(
+        self, spettacolo_id: str, n: int, preferenze: Optional[PreferenzePosti] = None
+    ) -> Optional[List[str]]:
+        preferenze = preferenze or PreferenzePosti()
+        mappa = self.db.mappa_posti(spettacolo_id)
+        riga_ideale = preferenze.riga_ideale or max(1, round(mappa.righe * 2 / 3))
+        inizio_ideale = (mappa.colonne - n) / 2 + 1
+        migliore: Optional[Tuple[float, int, int]] = None
+        with self.db.lock_spettacolo(spettacolo_id):
+            for riga, primo, ultimo in mappa.blocchi_liberi(n):
+                # inizio più vicino al centro tra quelli ammessi dalla sequenza libera
+                colonna = min(max(round(inizio_ideale), primo), ultimo)
+                punteggio = (
+                    preferenze.peso_centro * abs(colonna - inizio_ideale) / mappa.colonne
+                    + preferenze.peso_riga * abs(riga - riga_ideale) / mappa.righe
+                )
+                if migliore is None or punteggio < migliore[0]:
+                    migliore = (punteggio, riga, colonna)
+        if migliore is None:
+            return None
+        _, riga, colonna = migliore
+        return [f"{chr(ord('A') + riga - 1)}{c}" for c in range(colonna, colonna + n)]
 
     def blocca_posto(self, spettacolo_id: str, posto_id: str) -> None:
-        self._scadenze_hold(spettacolo_id)
-        d = self.db.get_disponibilita(spettacolo_id, posto_id)
-        if d.stato != StatoPosto.LIBERO:
+        now = datetime.utcnow()
+        self.scadenze.expire_due(now)
+        scad = now + timedelta(minutes=self.hold_minutes)
+        if not self.db.try_hold(spettacolo_id, posto_id, scad):
+            d = self.db.get_disponibilita(spettacolo_id, posto_id)
             raise ConflictError(f"Posto non disponibile (stato={d.stato}).")
-        scad = datetime.utcnow() + timedelta(minutes=self.hold_minutes)
-        self.db.set_stato_posto(spettacolo_id, posto_id, StatoPosto.BLOCCATO, hold_scadenza=scad)
+        self.scadenze.registra(spettacolo_id, posto_id, scad)
+
+    def blocca_posti(self, spettacolo_id: str, posti_ids: List[str], now: Optional[datetime] = None) -> None:
+        now = now or datetime.utcnow()
+        self.scadenze.expire_due(now)
+        scad = now + timedelta(minutes=self.hold_minutes)
+        if not self.db.try_hold_many(spettacolo_id, posti_ids, scad):
+            raise ConflictError(f"Posti non disponibili: {', '.join(posti_ids)}.")
+        for posto_id in posti_ids:
+            self.scadenze.registra(spettacolo_id, posto_id, scad)
 
     def vendi_posto(self, spettacolo_id: str, posto_id: str) -> None:
-        d = self.db.get_disponibilita(spettacolo_id, posto_id)
-        if d.stato not in (StatoPosto.BLOCCATO, StatoPosto.LIBERO):
+        attesi = (StatoPosto.BLOCCATO, StatoPosto.LIBERO)
+        if not self.db.cas_stato_posto(spettacolo_id, posto_id, attesi, StatoPosto.VENDUTO):
+            d = self.db.get_disponibilita(spettacolo_id, posto_id)
             raise ConflictError(f"Impossibile vendere: stato={d.stato}")
-        self.db.set_stato_posto(spettacolo_id, posto_id, StatoPosto.VENDUTO, hold_scadenza=None)
+
+    def scadenza_hold(self, ordine: OrdineAcquisto) -> datetime:
+        # l'hold di un ordine parte quando l'ordine nasce: la sua scadenza riconosce i posti ancora suoi
+        return ordine.creato_il + timedelta(minutes=self.hold_minutes)
+
+    def vendi_posti(self, ordine: OrdineAcquisto) -> None:
+        # tutto-o-niente, solo posti ancora dell'ordine: bloccati con la scadenza del suo hold oppure
+        # tornati liberi alla scadenza e da allora mai entrati in un ordine successivo
+        spettacolo_id = ordine.spettacolo_id
+        scadenza = self.scadenza_hold(ordine)
+        with self.db.lock_spettacolo(spettacolo_id):
+            stati = {posto_id: self.db.get_disponibilita(spettacolo_id, posto_id) for posto_id in ordine.posti_ids}
+            bloccati = [
+                posto_id
+                for posto_id, d in stati.items()
+                if d.stato == StatoPosto.BLOCCATO and d.hold_scadenza == scadenza
+            ]
+            liberi = [posto_id for posto_id, d in stati.items() if d.stato == StatoPosto.LIBERO]
+            ripresi = self._posti_ripresi(ordine, liberi) if liberi else set()
+            persi = [p for p in ordine.posti_ids if p not in bloccati and (p not in liberi or p in ripresi)]
+            if persi:
+                occupati = ", ".join(f"{posto_id} (stato={stati[posto_id].stato})" for posto_id in persi)
+                raise ConflictError(f"Impossibile vendere, posti non più riservati all'ordine: {occupati}.")
+            # il lock esclude scritture concorrenti: i compare-and-set non possono fallire dopo il controllo
+            if bloccati:
+                self.db.cas_stato_posti(
+                    spettacolo_id, bloccati, (StatoPosto.BLOCCATO,), StatoPosto.VENDUTO, scadenza_attesa=scadenza
+                )
+            if liberi:
+                self.db.cas_stato_posti(spettacolo_id, liberi, (StatoPosto.LIBERO,), StatoPosto.VENDUTO)
+
+    def rilascia_posti(self, ordine: OrdineAcquisto) -> None:
+        # solo i posti ancora bloccati dall'hold dell'ordine: quelli ripresi da altri restano come sono
+        spettacolo_id = ordine.spettacolo_id
+        scadenza = self.scadenza_hold(ordine)
+        with self.db.lock_spettacolo(spettacolo_id):
+            propri = [
+                posto_id
+                for posto_id in ordine.posti_ids
+                if self.db.get_disponibilita(spettacolo_id, posto_id).hold_scadenza == scadenza
+            ]
+            if propri:
+                self.db.cas_stato_posti(
+                    spettacolo_id, propri, (StatoPosto.BLOCCATO,), StatoPosto.LIBERO, scadenza_attesa=scadenza
+                )
+
+    def _posti_ripresi(self, ordine: OrdineAcquisto, posti_ids: List[str]) -> Set[str]:
+        # ogni hold nasce con un ordine: un posto è stato ripreso se compare in un ordine successivo
+        cercati = set(posti_ids)
+        ripresi: Set[str] = set()
+        for o in self.db.iter_ordini(spettacolo_id=ordine.spettacolo_id, dopo=(ordine.creato_il, ordine.id)):
+            ripresi.update(cercati.intersection(o.posti_ids))
+        return ripresi
 
     def libera_posto_admin(self, spettacolo_id: str, posto_id: str) -> None:
         self.db.set_stato_posto(spettacolo_id, posto_id, StatoPosto.LIBERO, hold_scadenza=None)
 
-    def _scadenze_hold(self, spettacolo_id: str) -> None:
-        now = datetime.utcnow()
-        for d in self.db.list_disponibilita_spettacolo(spettacolo_id):
-            if d.stato == StatoPosto.BLOCCATO and d.hold_scadenza and d.hold_scadenza <= now:
-                self.db.set_stato_posto(spettacolo_id, d.posto_id, StatoPosto.LIBERO, hold_scadenza=None)
-
 
 @dataclass
 class ServizioOrdini:
-    db: InMemoryDB
-
-    def crea_ordine(self, cliente_id: str, spettacolo_id: str, posto_id: str, totale_eur: float) -> OrdineAcquisto:
+    db: RepositoryCinema
+
+    def crea_ordine(
+        self,
+        cliente_id: str,
+        spettacolo_id: str,
+        posti_ids: List[str],
+        totale_eur: float,
+        creato_il: Optional[datetime] = None,
+    ) -> OrdineAcquisto:
         ordine = OrdineAcquisto(
             id=_new_id("ord"),
             cliente_id=cliente_id,
             spettacolo_id=spettacolo_id,
-            posto_id=posto_id,
+            posti_ids=list(posti_ids),
             totale_eur=totale_eur,
             stato=StatoOrdine.IN_PAGAMENTO,
-            creato_il=datetime.utcnow(),
+            creato_il=creato_il or datetime.utcnow(),
         )
         self.db.save_ordine(ordine)
         return ordine
 
     def aggiorna_stato(self, ordine_id: str, stato: StatoOrdine) -> OrdineAcquisto:
-        ordine = self.db.get_ordine(ordine_id)
-        ordine.stato = stato
+        # un nuovo record, non una modifica sul posto: il repository vede ancora lo stato precedente
+        ordine = replace(self.db.get_ordine(ordine_id), stato=stato)
         self.db.save_ordine(ordine)
         return ordine
 
 
 @dataclass
 class ServizioBiglietti:
-    db: InMemoryDB
+    db: RepositoryCinema
 
     def emetti_biglietto(self, ordine_id: str) -> Biglietto:
         existing = self.db.get_biglietto_by_ordine(ordine_id)
@@ -121,7 +312,7 @@ class ServizioBiglietti:
 
 @dataclass
 class ServizioListaAttesa:
-    db: InMemoryDB
+    db: RepositoryCinema
     notifiche: GatewayNotifiche
     posti: ServizioPosti
 
@@ -137,21 +328,45 @@ class ServizioListaAttesa:
         return iscr
 
     def processa_notifiche(self) -> int:
+        self.posti.scadenze.expire_due()
         inviate = 0
-        for w in self.db.list_waitlist_pending():
-            if self.posti.verifica_disponibilita(w.spettacolo_id):
-                cliente = self.db.clienti.get(w.cliente_id)
+        for spettacolo_id in self.db.spettacoli_con_attesa():
+            inviate += self.notifica_spettacolo(spettacolo_id)
+        return inviate
+
+    def su_evento_posto(self, evento: EventoPosto) -> None:
+        # sottoscrittore del bus: ogni posto che torna libero avvisa subito il prossimo in coda
+        if evento.liberato:
+            self.notifica_spettacolo(evento.spettacolo_id, massimo=1)
+
+    def notifica_spettacolo(self, spettacolo_id: str, massimo: Optional[int] = None) -> int:
+        # avvisa, in ordine di iscrizione, al più tanti iscritti quanti sono i posti liberi
+        liberi = self.db.conta_posti(spettacolo_id, StatoPosto.LIBERO)
+        if massimo is not None:
+            liberi = min(liberi, massimo)
+        inviate = 0
+        # iscrizioni senza cliente restano in testa alla coda e non consumano posti
+        orfane = 0
+        while inviate < liberi:
+            coda = self.db.list_waitlist_pending_by_spettacolo(spettacolo_id, limite=orfane + liberi - inviate)
+            nuove = coda[orfane:]
+            if not nuove:
+                break
+            for w in nuove:
+                cliente = self.db.find_cliente(w.cliente_id)
                 if not cliente:
+                    orfane += 1
                     continue
                 self.notifiche.invia_notifica_disponibilita(cliente.email, w.spettacolo_id)
                 w.notificato = True
+                self.db.save_waitlist(w)
                 inviate += 1
         return inviate
 
 
 @dataclass
 class AdattatorePagamentiService:
-    db: InMemoryDB
+    db: RepositoryCinema
     gateway: GatewayPagamenti
 
     def avvia_pagamento(self, ordine_id: str, importo_eur: float) -> Pagamento:
@@ -187,39 +402,131 @@ class GestoreAcquisto:
     notifiche: GatewayNotifiche
 
     @property
-    def db(self) -> InMemoryDB:
+    def db(self) -> RepositoryCinema:
         return self.spettacoli.db
 
-    def avvia_acquisto(self, cliente_id: str, spettacolo_id: str, etichetta_posto: str):
+    def avvia_acquisto(self, cliente_id: str, spettacolo_id: str, etichette_posti: Union[str, Sequence[str]]):
+        if isinstance(etichette_posti, str):
+            etichette_posti = [etichette_posti]
+        if not etichette_posti:
+            raise ConflictError("Nessun posto indicato.")
         sp = self.db.get_spettacolo(spettacolo_id)
         sala = self.db.get_sala(sp.sala_id)
-        posto = self.db.find_posto_by_etichetta(sala.id, etichetta_posto)
-
-        d = self.db.get_disponibilita(spettacolo_id, posto.id)
-        if d.stato != StatoPosto.LIBERO:
-            raise ConflictError(f"Posto {etichetta_posto} non libero (stato={d.stato}).")
-
-        self.posti.blocca_posto(spettacolo_id, posto.id)
-        ordine = self.ordini.crea_ordine(cliente_id, spettacolo_id, posto.id, sp.prezzo_eur)
+        posti = [self.db.find_posto_by_etichetta(sala.id, et) for et in etichette_posti]
+        posti_ids = [p.id for p in posti]
+        if len(set(posti_ids)) != len(posti_ids):
+            raise ConflictError(f"Posti ripetuti nell'ordine: {', '.join(etichette_posti)}.")
+
+        # niente controllo preventivo: il blocco di tutti i posti è un compare-and-set atomico sul repository.
+        # L'ordine nasce con l'istante dell'hold, da cui ServizioPosti.scadenza_hold ricava la sua scadenza.
+        inizio = datetime.utcnow()
+        try:
+            self.posti.blocca_posti(spettacolo_id, posti_ids, inizio)
+        except ConflictError:
+            stati = {et: self.db.get_disponibilita(spettacolo_id, p.id).stato for et, p in zip(etichette_posti, posti)}
+            if len(stati) == 1:
+                ((et, stato),) = stati.items()
+                raise ConflictError(f"Posto {et} non libero (stato={stato}).") from None
+            occupati = ", ".join(f"{et} (stato={s})" for et, s in stati.items() if s != StatoPosto.LIBERO)
+            raise ConflictError(f"Posti non liberi: {occupati}.") from None
+        ordine = self.ordini.crea_ordine(
+            cliente_id, spettacolo_id, posti_ids, sp.prezzo_eur * len(posti_ids), creato_il=inizio
+        )
         pagamento = self.pagamenti.avvia_pagamento(ordine.id, ordine.totale_eur)
         return ordine, pagamento
 
-    def webhook_esito_pagamento(self, pagamento_id: str, esito: EsitoPagamento) -> Optional[Biglietto]:
-        p = self.pagamenti.registra_esito_webhook(pagamento_id, esito)
+    def avvia_acquisto_migliori(
+        self,
+        cliente_id: str,
+        spettacolo_id: str,
+        quantita: int,
+        preferenze: Optional[PreferenzePosti] = None,
+        tentativi: int = 3,
+    ):
+        if quantita < 1:
+            raise ConflictError("La quantità deve essere almeno 1.")
+        for _ in range(tentativi):
+            etichette = self.posti.migliori_posti(spettacolo_id, quantita, preferenze)
+            if etichette is None:
+                raise ConflictError(f"Nessun blocco di {quantita} posti contigui libero.")
+            try:
+                return self.avvia_acquisto(cliente_id, spettacolo_id, etichette)
+            except ConflictError:
+                # blocco preso da un acquisto concorrente tra la ricerca e l'hold: si ricerca
+                continue
+        raise ConflictError(f"Impossibile bloccare {quantita} posti contigui: troppi acquisti concorrenti.")
+
+    def webhook_esito_pagamento(
+        self, pagamento_id: str, esito: EsitoPagamento, transaction_ref: Optional[str] = None
+    ) -> Optional[Biglietto]:
+        # i provider ritentano i webhook: una consegna già elaborata (stessa chiave) riceve il
+        # risultato originale senza toccare posti, ordini o notifiche
+        p = self.db.get_pagamento(pagamento_id)
+        transaction_ref = transaction_ref or p.transaction_ref
+        chiave = chiave_webhook(pagamento_id, transaction_ref, esito)
+        evento = self.db.get_evento_webhook(chiave)
+        if evento is not None:
+            return self._risultato_webhook(evento)
+
         ordine = self.db.get_ordine(p.ordine_id)
+        # gli eventi di posti e ordini partono dopo il rilascio del lock: la lista d'attesa
+        # notifica i posti liberati senza tenere fermo lo spettacolo durante la chiamata al provider
+        with self.db.eventi_posti.rinviati(), self.db.eventi_ordini.rinviati():
+            with self.db.lock_spettacolo(ordine.spettacolo_id):
+                # consegne concorrenti dello stesso evento: elabora solo la prima
+                evento = self.db.get_evento_webhook(chiave)
+                if evento is not None:
+                    return self._risultato_webhook(evento)
+                # un esito diverso arrivato in ritardo ha un'altra chiave: un ordine già concluso
+                # non torna indietro e posti e ordine restano come sono
+                ordine = self.db.get_ordine(p.ordine_id)
+                pagamento = self.db.get_pagamento(pagamento_id)
+                if ordine.stato in (StatoOrdine.PAGATO, StatoOrdine.ANNULLATO) or pagamento.ricevuto_il is not None:
+                    return self._esito_concluso(ordine, esito)
+                b, email = self._applica_esito(pagamento_id, esito)
+                self.db.save_evento_webhook(
+                    EventoWebhook(
+                        id=chiave,
+                        pagamento_id=pagamento_id,
+                        transaction_ref=transaction_ref,
+                        esito=esito,
+                        biglietto_id=b.id if b else None,
+                        ricevuto_il=datetime.utcnow(),
+                    )
+                )
+        if b and email:
+            self.notifiche.invia_biglietto(email, b)
+        return b
 
-        if esito == EsitoPagamento.AUTORIZZATO:
-            self.ordini.aggiorna_stato(ordine.id, StatoOrdine.PAGATO)
-            self.posti.vendi_posto(ordine.spettacolo_id, ordine.posto_id)
+    def _risultato_webhook(self, evento: EventoWebhook) -> Optional[Biglietto]:
+        return self.db.get_biglietto(evento.biglietto_id) if evento.biglietto_id else None
 
-            b = self.biglietti.emetti_biglietto(ordine.id)
+    def _esito_concluso(self, ordine: OrdineAcquisto, esito: EsitoPagamento) -> Optional[Biglietto]:
+        # stesso esito con un altro transaction_ref: il risultato registrato; esito opposto: conflitto
+        autorizzato = esito == EsitoPagamento.AUTORIZZATO
+        if autorizzato != (ordine.stato == StatoOrdine.PAGATO):
+            raise ConflictError(
+                f"Ordine {ordine.id} già concluso (stato={ordine.stato.value}): esito {esito.value} ignorato."
+            )
+        return self.db.get_biglietto_by_ordine(ordine.id) if autorizzato else None
+
+    def _applica_esito(self, pagamento_id: str, esito: EsitoPagamento) -> Tuple[Optional[Biglietto], Optional[str]]:
+        ordine = self.db.get_ordine(self.db.get_pagamento(pagamento_id).ordine_id)
 
-            cliente = self.db.clienti.get(ordine.cliente_id)
+        if esito == EsitoPagamento.AUTORIZZATO:
+            cliente = self.db.find_cliente(ordine.cliente_id)
             if not cliente:
                 raise NotFoundError("Cliente ordine non trovato.")
-            self.notifiche.invia_biglietto(cliente.email, b)
-            return b
+            # prima i posti, tutti o nessuno: se uno è passato a un altro ordine nel frattempo
+            # la ConflictError lascia pagamento, ordine e posti come prima e l'esito non viene registrato
+            self.posti.vendi_posti(ordine)
+            self.pagamenti.registra_esito_webhook(pagamento_id, esito)
+            self.ordini.aggiorna_stato(ordine.id, StatoOrdine.PAGATO)
+
+            b = self.biglietti.emetti_biglietto(ordine.id)
+            return b, cliente.email
 
+        self.pagamenti.registra_esito_webhook(pagamento_id, esito)
         self.ordini.aggiorna_stato(ordine.id, StatoOrdine.ANNULLATO)
-        self.posti.libera_posto_admin(ordine.spettacolo_id, ordine.posto_id)
-        return None
\ No newline at end of file
+        self.posti.rilascia_posti(ordine)
+        return None, None
\ No newline at end of file
@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+import zlib
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from .app import _seed_db, build_app_context
+from .domain import EsitoPagamento
+from .persistence import load_db, save_db
+from .repositories import InMemoryDB, NotFoundError
+
+# operazioni eseguibili da un worker: nome -> metodo del contesto dello shard
+_OPERAZIONI: Dict[str, Callable[[Any], Callable[..., Any]]] = {
+    "avvia_acquisto": lambda ctx: ctx.gestore.avvia_acquisto,
+    "avvia_acquisto_migliori": lambda ctx: ctx.gestore.avvia_acquisto_migliori,
+    "webhook_esito_pagamento": lambda ctx: ctx.gestore.webhook_esito_pagamento,
+    "iscrivi_waitlist": lambda ctx: ctx.servizio_lista_attesa.iscrivi,
+    "processa_notifiche": lambda ctx: ctx.servizio_lista_attesa.processa_notifiche,
+    "posti_liberi": lambda ctx: ctx.servizio_posti.posti_liberi,
+    "get_pagamento": lambda ctx: ctx.db.get_pagamento,
+}
+
+
+@dataclass(frozen=True)
+class PianoShard:
+    # `generali` shard condivisi per hash dello spettacolo; ogni spettacolo in `dedicati` (es. una
+    # prima molto attesa) ha uno shard, e quindi un processo, tutto per sé
+    generali: int
+    dedicati: Tuple[str, ...] = ()
+
+    def __post_init__(self) -> None:
+        if self.generali < 1:
+            raise ValueError("Serve almeno uno shard generale.")
+
+    @property
+    def totale(self) -> int:
+        return self.generali + len(self.dedicati)
+
+    def shard_di(self, spettacolo_id: str) -> int:
+        if spettacolo_id in self.dedicati:
+            return self.generali + self.dedicati.index(spettacolo_id)
+        return zlib.crc32(spettacolo_id.encode("utf-8")) % self.generali
+
+
+def shard_path(state_file: str, indice: int) -> str:
+    base, estensione = os.path.splitext(state_file)
+    return f"{base}.shard{indice}{estensione or '.json'}"
+
+
+def piano_path(state_file: str) -> str:
+    return os.path.splitext(state_file)[0] + ".shard.json"
+
+
+def dividi_stato(db: InMemoryDB, piano: PianoShard) -> List[InMemoryDB]:
+    # clienti, film, sale, posti e spettacoli sono replicati in ogni shard (sola lettura);
+    # disponibilità, ordini, pagamenti, biglietti, webhook e lista d'attesa vanno allo shard dello spettacolo
+    shard = [InMemoryDB() for _ in range(piano.totale)]
+    for s in shard:
+        s.clienti.update(db.clienti)
+        s.films.update(db.films)
+        s.sale.update(db.sale)
+        for p in db.posti.values():
+            s.add_posto(p)
+        s.spettacoli.update(db.spettacoli)
+    for mappa in db.iter_mappe():
+        shard[piano.shard_di(mappa.spettacolo_id)].add_mappa(mappa)
+
+    shard_ordine: Dict[str, int] = {}
+    for o in db.ordini.values():
+        shard_ordine[o.id] = i = piano.shard_di(o.spettacolo_id)
+        shard[i].ordini[o.id] = o
+    shard_pagamento: Dict[str, int] = {}
+    for pag in db.pagamenti.values():
+        shard_pagamento[pag.id] = i = shard_ordine.get(pag.ordine_id, 0)
+        shard[i].pagamenti[pag.id] = pag
+    for b in db.biglietti.values():
+        shard[shard_ordine.get(b.ordine_id, 0)].biglietti[b.id] = b
+    for e in db.webhook.values():
+        shard[shard_pagamento.get(e.pagamento_id, 0)].webhook[e.id] = e
+    for w in db.waitlist.values():
+        shard[piano.shard_di(w.spettacolo_id)].waitlist[w.id] = w
+    return shard
+
+
+def prepara_shard(state_file: str, piano: PianoShard, seed: Callable[[], InMemoryDB]) -> None:
+    # al primo avvio lo stato esistente (o il seed) viene diviso in un file di stato per shard;
+    # il piano resta registrato accanto perché gli spettacoli non cambino shard tra un avvio e l'altro
+    path = piano_path(state_file)
+    registrato = {"generali": piano.generali, "dedicati": list(piano.dedicati)}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            if json.load(f) != registrato:
+                raise ValueError(f"Piano shard diverso da quello registrato in {path}.")
+        return
+    db = load_db(state_file) if os.path.exists(state_file) else seed()
+    for i, parte in enumerate(dividi_stato(db, piano)):
+        save_db(parte, shard_path(state_file, i))
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(registrato, f)
+    os.replace(tmp, path)
+
+
+def _worker(state_file: str, storage: str, conn: Any, intervallo_scadenze_s: float) -> None:
+    ctx = build_app_context(state_file=state_file, storage=storage)
+    operazioni = {nome: risolvi(ctx) for nome, risolvi in _OPERAZIONI.items()}
+    # ogni scrittura passa dagli osservatori: un gruppo di sole letture non si salva
+    modificato = threading.Event()
+    ctx.db.osserva(lambda _tabella, _valore: modificato.set())
+    attivo = True
+    while attivo:
+        if not conn.poll(intervallo_scadenze_s):
+            if ctx.servizio_posti.scadenze.expire_due():
+                ctx.save()
+            continue
+        # commit di gruppo: si eseguono tutte le richieste in coda, un solo salvataggio, poi le risposte
+        risposte = []
+        while attivo and conn.poll():
+            richiesta = conn.recv()
+            if richiesta is None:
+                attivo = False
+                break
+            rid, nome, args, kwargs = richiesta
+            try:
+                risposte.append((rid, True, operazioni[nome](*args, **kwargs)))
+            except Exception as e:  # noqa: BLE001 - l'errore torna al chiamante, il worker resta vivo
+                risposte.append((rid, False, e))
+        if modificato.is_set():
+            modificato.clear()
+            ctx.save()
+        for risposta in risposte:
+            conn.send(risposta)
+    ctx.chiudi()
+    conn.close()
+
+
+class _Shard:
+    def __init__(self, indice: int, processo: Any, conn: Any) -> None:
+        self.indice = indice
+        self.processo = processo
+        self.conn = conn
+        self._lock = threading.Lock()
+        self._pendenti: Dict[int, Future] = {}
+        self._lettore = threading.Thread(target=self._leggi, name=f"shard-{indice}", daemon=True)
+        self._lettore.start()
+
+    def invia(self, rid: int, nome: str, args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> Future:
+        futuro: Future = Future()
+        with self._lock:
+            self._pendenti[rid] = futuro
+            self.conn.send((rid, nome, args, kwargs))
+        return futuro
+
+    def _leggi(self) -> None:
+        while True:
+            try:
+                rid, ok, valore = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            futuro = self._pendenti.pop(rid)
+            if ok:
+                futuro.set_result(valore)
+            else:
+                futuro.set_exception(valore)
+        errore = RuntimeError(f"Worker dello shard {self.indice} terminato.")
+        for futuro in list(self._pendenti.values()):
+            futuro.set_exception(errore)
+
+    def ferma(self, timeout_s: float) -> None:
+        with self._lock:
+            self.conn.send(None)
+        self.processo.join(timeout_s)
+        self._lettore.join(timeout_s)
+
+
+# Router davanti a un processo worker per shard: ogni worker ha il proprio InMemoryDB, file di
+# stato e GestoreAcquisto, quindi acquisti su spettacoli di shard diversi girano in parallelo su
+# core diversi. Le richieste si instradano per spettacolo_id; i webhook, che conoscono solo il
+# pagamento, usano lo shard registrato alla creazione del pagamento (o lo cercano tra gli shard
+# dopo un riavvio del router). Le chiamate sono asincrone (Future) per tenere piene le code dei
+# worker, che salvano una volta per gruppo di richieste.
+@dataclass
+class RouterAcquisti:
+    state_file: str
+    piano: PianoShard
+    storage: str = "partizioni"
+    seed: Optional[Callable[[], InMemoryDB]] = None
+    intervallo_scadenze_s: float = 1.0
+    _shard: List[_Shard] = field(default_factory=list, init=False, repr=False)
+    _shard_pagamenti: Dict[str, int] = field(default_factory=dict, init=False, repr=False)
+    _contatore: Any = field(default_factory=itertools.count, init=False, repr=False)
+
+    def avvia(self) -> None:
+        prepara_shard(self.state_file, self.piano, self.seed or _seed_db)
+        # spawn: il worker parte pulito, senza ereditare thread e lock del processo del router
+        mp = multiprocessing.get_context("spawn")
+        for i in range(self.piano.totale):
+            conn, conn_worker = mp.Pipe()
+            processo = mp.Process(
+                target=_worker,
+                args=(shard_path(self.state_file, i), self.storage, conn_worker, self.intervallo_scadenze_s),
+                name=f"cinema-shard-{i}",
+                daemon=True,
+            )
+            processo.start()
+            conn_worker.close()
+            self._shard.append(_Shard(i, processo, conn))
+
+    def ferma(self, timeout_s: float = 10.0) -> None:
+        for s in self._shard:
+            s.ferma(timeout_s)
+        self._shard = []
+
+    def richiedi(self, indice: int, nome: str, *args: Any, **kwargs: Any) -> Future:
+        return self._shard[indice].invia(next(self._contatore), nome, args, kwargs)
+
+    def shard_di(self, spettacolo_id: str) -> int:
+        return self.piano.shard_di(spettacolo_id)
+
+    # --- operazioni instradate ---
+
+    def avvia_acquisto_async(
+        self, cliente_id: str, spettacolo_id: str, etichette_posti: Union[str, Sequence[str]]
+    ) -> Future:
+        indice = self.shard_di(spettacolo_id)
+        futuro = self.richiedi(indice, "avvia_acquisto", cliente_id, spettacolo_id, etichette_posti)
+        futuro.add_done_callback(lambda f: self._registra_pagamento(f, indice))
+        return futuro
+
+    def avvia_acquisto(self, cliente_id: str, spettacolo_id: str, etichette_posti: Union[str, Sequence[str]]):
+        return self.avvia_acquisto_async(cliente_id, spettacolo_id, etichette_posti).result()
+
+    def avvia_acquisto_migliori(self, cliente_id: str, spettacolo_id: str, quantita: int, **kwargs: Any):
+        indice = self.shard_di(spettacolo_id)
+        futuro = self.richiedi(indice, "avvia_acquisto_migliori", cliente_id, spettacolo_id, quantita, **kwargs)
+        futuro.add_done_callback(lambda f: self._registra_pagamento(f, indice))
+        return futuro.result()
+
+    def _registra_pagamento(self, futuro: Future, indice: int) -> None:
+        if futuro.exception() is None:
+            _, pagamento = futuro.result()
+            self._shard_pagamenti[pagamento.id] = indice
+
+    def webhook_esito_pagamento(self, pagamento_id: str, esito: EsitoPagamento, transaction_ref: Optional[str] = None):
+        indice = self._shard_pagamenti.get(pagamento_id)
+        if indice is None:
+            indice = self._shard_pagamenti[pagamento_id] = self._cerca_shard_pagamento(pagamento_id)
+        return self.richiedi(indice, "webhook_esito_pagamento", pagamento_id, esito, transaction_ref).result()
+
+    def _cerca_shard_pagamento(self, pagamento_id: str) -> int:
+        # pagamento creato prima dell'avvio del router: lo shard giusto è l'unico che lo conosce.
+        # Si interroga solo il pagamento, così un NotFoundError del webhook vero (ordine, cliente)
+        # arriva al chiamante invece di far provare gli altri shard
+        futuri = [self.richiedi(i, "get_pagamento", pagamento_id) for i in range(len(self._shard))]
+        trovato = None
+        for i, futuro in enumerate(futuri):
+            try:
+                futuro.result()
+            except NotFoundError:
+                continue
+            trovato = i
+        if trovato is None:
+            raise NotFoundError(f"Pagamento non trovato: {pagamento_id}")
+        return trovato
+
+    def iscrivi_waitlist(self, cliente_id: str, spettacolo_id: str):
+        return self.richiedi(self.shard_di(spettacolo_id), "iscrivi_waitlist", cliente_id, spettacolo_id).result()
+
+    def posti_liberi(self, spettacolo_id: str) -> List[str]:
+        return self.richiedi(self.shard_di(spettacolo_id), "posti_liberi", spettacolo_id).result()
+
+    def processa_notifiche(self) -> int:
+        futuri = [self.richiedi(i, "processa_notifiche") for i in range(len(self._shard))]
+        return sum(f.result() for f in futuri)
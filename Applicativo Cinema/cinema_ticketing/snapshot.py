@@ -0,0 +1,316 @@
+from __future__ import annotations
+
+import struct
+from array import array
+from datetime import datetime, timedelta
+from enum import Enum
+from sys import intern
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Type
+
+from .domain import (
+    Biglietto,
+    Cliente,
+    EsitoPagamento,
+    EventoWebhook,
+    Film,
+    IscrizioneListaAttesa,
+    OrdineAcquisto,
+    Pagamento,
+    Posto,
+    SalaCinema,
+    Spettacolo,
+    StatoOrdine,
+)
+from .repositories import TABELLE, InMemoryDB
+from .seatmap import MappaPosti
+
+# Formato binario dello stato (version 2):
+#   MAGIC | u16 versione | per ogni tabella: str nome | u64 lunghezza | payload
+# Le tabelle sono colonnari: stringhe unite da \0, interi/float/datetime come array di 64 bit
+# (datetime = microsecondi dall'epoch), enum e bool come un byte, liste di stringhe come
+# stringhe separate da virgola (un id singolo, come negli snapshot precedenti, è una lista di
+# un elemento). La disponibilità è salvata per spettacolo come i byte di stato e le scadenze
+# della MappaPosti.
+MAGIC = b"CINEMA\x1a"
+VERSIONE = 2
+
+_U16 = struct.Struct("<H")
+_U64 = struct.Struct("<Q")
+_NULLO = -(2**63)
+_EPOCH = datetime(1970, 1, 1)
+
+_Colonna = Tuple[str, str, Optional[Type[Enum]]]
+
+_SCHEMI: Dict[str, Tuple[Callable[..., Any], Sequence[_Colonna]]] = {
+    "clienti": (Cliente, (("id", "s", None), ("nome", "s", None), ("email", "s", None))),
+    "films": (Film, (("id", "s", None), ("titolo", "s", None), ("durata_min", "i", None))),
+    "sale": (SalaCinema, (("id", "s", None), ("nome", "s", None), ("righe", "i", None), ("colonne", "i", None))),
+    "posti": (Posto, (("id", "s", None), ("riga", "i", None), ("colonna", "i", None), ("sala_id", "s?", None))),
+    "spettacoli": (
+        Spettacolo,
+        (("id", "s", None), ("film_id", "s", None), ("sala_id", "s", None), ("inizio", "t", None), ("prezzo_eur", "f", None)),
+    ),
+    "ordini": (
+        OrdineAcquisto,
+        (
+            ("id", "s", None),
+            ("cliente_id", "s", None),
+            ("spettacolo_id", "s", None),
+            ("posti_ids", "l", None),
+            ("totale_eur", "f", None),
+            ("stato", "e", StatoOrdine),
+            ("creato_il", "t", None),
+        ),
+    ),
+    "pagamenti": (
+        Pagamento,
+        (
+            ("id", "s", None),
+            ("ordine_id", "s", None),
+            ("provider", "s", None),
+            ("importo_eur", "f", None),
+            ("esito", "e", EsitoPagamento),
+            ("transaction_ref", "s?", None),
+            ("ricevuto_il", "t", None),
+        ),
+    ),
+    "biglietti": (Biglietto, (("id", "s", None), ("ordine_id", "s", None), ("qr_code", "s", None), ("emesso_il", "t", None))),
+    "waitlist": (
+        IscrizioneListaAttesa,
+        (
+            ("id", "s", None),
+            ("cliente_id", "s", None),
+            ("spettacolo_id", "s", None),
+            ("creata_il", "t", None),
+            ("notificato", "b", None),
+        ),
+    ),
+    "webhook": (
+        EventoWebhook,
+        (
+            ("id", "s", None),
+            ("pagamento_id", "s", None),
+            ("transaction_ref", "s?", None),
+            ("esito", "e", EsitoPagamento),
+            ("biglietto_id", "s?", None),
+            ("ricevuto_il", "t", None),
+        ),
+    ),
+}
+
+
+def is_binario(contenuto: bytes) -> bool:
+    return contenuto.startswith(MAGIC)
+
+
+class _Scrittore:
+    def __init__(self) -> None:
+        self.parti: List[bytes] = []
+
+    def u16(self, v: int) -> None:
+        self.parti.append(_U16.pack(v))
+
+    def u64(self, v: int) -> None:
+        self.parti.append(_U64.pack(v))
+
+    def blob(self, b: bytes) -> None:
+        self.u64(len(b))
+        self.parti.append(b)
+
+    def stringa(self, s: str) -> None:
+        b = s.encode("utf-8")
+        self.u16(len(b))
+        self.parti.append(b)
+
+
+class _Lettore:
+    def __init__(self, dati: memoryview) -> None:
+        self.dati = dati
+        self.pos = 0
+
+    def u16(self) -> int:
+        (v,) = _U16.unpack_from(self.dati, self.pos)
+        self.pos += 2
+        return v
+
+    def u64(self) -> int:
+        (v,) = _U64.unpack_from(self.dati, self.pos)
+        self.pos += 8
+        return v
+
+    def blob(self) -> memoryview:
+        n = self.u64()
+        b = self.dati[self.pos : self.pos + n]
+        self.pos += n
+        return b
+
+    def stringa(self) -> str:
+        n = self.u16()
+        s = bytes(self.dati[self.pos : self.pos + n]).decode("utf-8")
+        self.pos += n
+        return s
+
+
+def _micro(dt: Optional[datetime]) -> int:
+    return (dt - _EPOCH) // timedelta(microseconds=1) if dt else _NULLO
+
+
+def _da_micro(v: int) -> Optional[datetime]:
+    return None if v == _NULLO else _EPOCH + timedelta(microseconds=v)
+
+
+def _scrivi_stringhe(w: _Scrittore, valori: List[str]) -> None:
+    if any("\x00" in v for v in valori):
+        raise ValueError("Carattere NUL non ammesso nello snapshot binario.")
+    w.blob("\x00".join(valori).encode("utf-8"))
+
+
+def _leggi_stringhe(r: _Lettore, n: int) -> List[str]:
+    b = r.blob()
+    return bytes(b).decode("utf-8").split("\x00") if n else []
+
+
+def _scrivi_colonna(w: _Scrittore, tipo: str, enum: Optional[Type[Enum]], valori: List[Any]) -> None:
+    if tipo == "s":
+        _scrivi_stringhe(w, valori)
+    elif tipo == "s?":
+        w.blob(bytes(v is not None for v in valori))
+        _scrivi_stringhe(w, [v or "" for v in valori])
+    elif tipo == "l":
+        if any("," in v for lista in valori for v in lista):
+            raise ValueError("Virgola non ammessa negli id di una lista nello snapshot binario.")
+        _scrivi_stringhe(w, [",".join(lista) for lista in valori])
+    elif tipo == "i":
+        w.blob(array("q", valori).tobytes())
+    elif tipo == "f":
+        w.blob(array("d", valori).tobytes())
+    elif tipo == "t":
+        w.blob(array("q", [_micro(v) for v in valori]).tobytes())
+    elif tipo == "e" and enum is not None:
+        codici = {m: i for i, m in enumerate(enum)}
+        w.blob(bytes(codici[v] for v in valori))
+    elif tipo == "b":
+        w.blob(bytes(bool(v) for v in valori))
+    else:
+        raise ValueError(f"Tipo colonna sconosciuto: {tipo}")
+
+
+def _leggi_colonna(r: _Lettore, tipo: str, enum: Optional[Type[Enum]], n: int) -> List[Any]:
+    if tipo == "s":
+        return _leggi_stringhe(r, n)
+    if tipo == "s?":
+        presenti = bytes(r.blob())
+        return [v if p else None for v, p in zip(_leggi_stringhe(r, n), presenti)]
+    if tipo == "l":
+        return [v.split(",") for v in _leggi_stringhe(r, n)]
+    if tipo in ("i", "f", "t"):
+        valori = array("d" if tipo == "f" else "q")
+        valori.frombytes(r.blob())
+        if tipo == "t":
+            return [_da_micro(v) for v in valori]
+        return valori.tolist()
+    if tipo == "e" and enum is not None:
+        membri = list(enum)
+        return [membri[c] for c in bytes(r.blob())]
+    if tipo == "b":
+        return [bool(c) for c in bytes(r.blob())]
+    raise ValueError(f"Tipo colonna sconosciuto: {tipo}")
+
+
+def _codifica_tabella(oggetti: List[Any], schema: Sequence[_Colonna]) -> bytes:
+    w = _Scrittore()
+    w.u64(len(oggetti))
+    for nome, tipo, enum in schema:
+        _scrivi_colonna(w, tipo, enum, [getattr(o, nome) for o in oggetti])
+    return b"".join(w.parti)
+
+
+def _decodifica_tabella(dati: memoryview, cls: Callable[..., Any], schema: Sequence[_Colonna]) -> List[Any]:
+    r = _Lettore(dati)
+    n = r.u64()
+    colonne = []
+    for nome, tipo, enum in schema:
+        valori = _leggi_colonna(r, tipo, enum, n)
+        # id ripetuti tra righe e tabelle: una sola stringa condivisa (come in persistence)
+        if nome in ("id", "provider") or nome.endswith("_id"):
+            valori = [intern(v) if v is not None else None for v in valori]
+        elif nome.endswith("_ids"):
+            valori = [[intern(v) for v in lista] for lista in valori]
+        colonne.append(valori)
+    return [cls(*valori) for valori in zip(*colonne)]
+
+
+def _codifica_disponibilita(mappe: List[MappaPosti]) -> bytes:
+    w = _Scrittore()
+    w.u64(len(mappe))
+    for m in mappe:
+        w.stringa(m.spettacolo_id)
+        w.u16(m.righe)
+        w.u16(m.colonne)
+        w.blob(bytes(m.stati))
+        w.blob(m.scadenze_bytes())
+    return b"".join(w.parti)
+
+
+def _decodifica_disponibilita(dati: memoryview) -> List[MappaPosti]:
+    r = _Lettore(dati)
+    mappe = []
+    for _ in range(r.u64()):
+        spettacolo_id = intern(r.stringa())
+        righe = r.u16()
+        colonne = r.u16()
+        mappe.append(MappaPosti.da_bytes(spettacolo_id, righe, colonne, r.blob(), r.blob()))
+    return mappe
+
+
+# Sezione del file binario non ancora decodificata: caricatore lazy per InMemoryDB.
+class _SezioneBinaria:
+    def __init__(self, tabella: str, dati: memoryview) -> None:
+        self.tabella = tabella
+        self.dati = dati
+
+    def __call__(self, db: InMemoryDB) -> None:
+        if self.tabella == "disponibilita":
+            for m in _decodifica_disponibilita(self.dati):
+                db.add_mappa(m)
+            return
+        cls, schema = _SCHEMI[self.tabella]
+        oggetti = _decodifica_tabella(self.dati, cls, schema)
+        if self.tabella == "posti":
+            for p in oggetti:
+                db.add_posto(p)
+        else:
+            getattr(db, self.tabella).update((o.id, o) for o in oggetti)
+
+
+def _sezione(db: InMemoryDB, tabella: str) -> bytes:
+    pendente = db.caricatore_pendente(tabella)
+    if isinstance(pendente, _SezioneBinaria):
+        return bytes(pendente.dati)
+    if tabella == "disponibilita":
+        return _codifica_disponibilita(list(db.iter_mappe()))
+    _, schema = _SCHEMI[tabella]
+    return _codifica_tabella(list(getattr(db, tabella).values()), schema)
+
+
+def codifica(db: InMemoryDB) -> bytes:
+    w = _Scrittore()
+    w.parti.append(MAGIC)
+    w.u16(VERSIONE)
+    for tabella in TABELLE:
+        w.stringa(tabella)
+        w.blob(_sezione(db, tabella))
+    return b"".join(w.parti)
+
+
+def sezioni(contenuto: bytes) -> Dict[str, _SezioneBinaria]:
+    r = _Lettore(memoryview(contenuto))
+    r.pos = len(MAGIC)
+    versione = r.u16()
+    if versione != VERSIONE:
+        raise ValueError(f"Versione snapshot non supportata: {versione}")
+    out = {}
+    while r.pos < len(contenuto):
+        tabella = r.stringa()
+        out[tabella] = _SezioneBinaria(tabella, r.blob())
+    return out
@@ -0,0 +1,734 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .domain import (
+    Biglietto,
+    Cliente,
+    DisponibilitaPosti,
+    EsitoPagamento,
+    EventoWebhook,
+    Film,
+    IscrizioneListaAttesa,
+    OrdineAcquisto,
+    Pagamento,
+    Posto,
+    SalaCinema,
+    Spettacolo,
+    StatoOrdine,
+    StatoPosto,
+)
+from .events import BusEventiOrdini, BusEventiPosti, EventoOrdine, EventoPosto
+from .repositories import RITENZIONE_WEBHOOK, Cursore, InMemoryDB, NotFoundError, SeedData
+from .seatmap import MappaPosti
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS clienti (id TEXT PRIMARY KEY, nome TEXT NOT NULL, email TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS films (id TEXT PRIMARY KEY, titolo TEXT NOT NULL, durata_min INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS sale (
+    id TEXT PRIMARY KEY, nome TEXT NOT NULL, righe INTEGER NOT NULL, colonne INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS posti (
+    id TEXT PRIMARY KEY, riga INTEGER NOT NULL, colonna INTEGER NOT NULL, sala_id TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_posti_griglia ON posti (sala_id, riga, colonna);
+CREATE TABLE IF NOT EXISTS spettacoli (
+    id TEXT PRIMARY KEY, film_id TEXT NOT NULL, sala_id TEXT NOT NULL, inizio TEXT NOT NULL, prezzo_eur REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS disponibilita (
+    spettacolo_id TEXT NOT NULL,
+    posto_id TEXT NOT NULL,
+    stato TEXT NOT NULL,
+    hold_scadenza TEXT,
+    PRIMARY KEY (spettacolo_id, posto_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_disponibilita_stato ON disponibilita (spettacolo_id, stato);
+CREATE INDEX IF NOT EXISTS ix_disponibilita_hold ON disponibilita (stato, hold_scadenza);
+CREATE TABLE IF NOT EXISTS ordini (
+    id TEXT PRIMARY KEY,
+    cliente_id TEXT NOT NULL,
+    spettacolo_id TEXT NOT NULL,
+    posto_id TEXT NOT NULL, -- id dei posti dell'ordine separati da virgola
+    totale_eur REAL NOT NULL,
+    stato TEXT NOT NULL,
+    creato_il TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_ordini_creato ON ordini (creato_il);
+CREATE INDEX IF NOT EXISTS ix_ordini_cliente ON ordini (cliente_id, creato_il);
+CREATE INDEX IF NOT EXISTS ix_ordini_spettacolo ON ordini (spettacolo_id, creato_il);
+CREATE TABLE IF NOT EXISTS pagamenti (
+    id TEXT PRIMARY KEY,
+    ordine_id TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    importo_eur REAL NOT NULL,
+    esito TEXT NOT NULL,
+    transaction_ref TEXT,
+    ricevuto_il TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_pagamenti_ordine ON pagamenti (ordine_id);
+CREATE TABLE IF NOT EXISTS biglietti (
+    id TEXT PRIMARY KEY, ordine_id TEXT NOT NULL, qr_code TEXT NOT NULL, emesso_il TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_biglietti_ordine ON biglietti (ordine_id);
+CREATE TABLE IF NOT EXISTS waitlist (
+    id TEXT PRIMARY KEY,
+    cliente_id TEXT NOT NULL,
+    spettacolo_id TEXT NOT NULL,
+    creata_il TEXT NOT NULL,
+    notificato INTEGER NOT NULL
+);
+DROP INDEX IF EXISTS ix_waitlist_pending;
+CREATE INDEX IF NOT EXISTS ix_waitlist_fifo ON waitlist (notificato, spettacolo_id, creata_il);
+CREATE INDEX IF NOT EXISTS ix_waitlist_creata ON waitlist (creata_il);
+CREATE INDEX IF NOT EXISTS ix_waitlist_cliente ON waitlist (cliente_id, creata_il);
+CREATE INDEX IF NOT EXISTS ix_waitlist_spettacolo ON waitlist (spettacolo_id, creata_il);
+CREATE TABLE IF NOT EXISTS webhook (
+    seq INTEGER PRIMARY KEY, -- ordine di arrivo, per la ritenzione
+    id TEXT NOT NULL UNIQUE,
+    pagamento_id TEXT NOT NULL,
+    transaction_ref TEXT,
+    esito TEXT NOT NULL,
+    biglietto_id TEXT,
+    ricevuto_il TEXT NOT NULL
+);
+-- aggregati del report (AnalisiVendite.esporta), scritti nella stessa transazione dei dati
+CREATE TABLE IF NOT EXISTS aggregati (id INTEGER PRIMARY KEY CHECK (id = 1), dati TEXT NOT NULL);
+"""
+
+
+def _dt(s: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(s) if s else None
+
+
+def _data(s: str) -> datetime:
+    # colonne NOT NULL
+    return datetime.fromisoformat(s)
+
+
+def _iso(dt: Optional[datetime]) -> Optional[str]:
+    return dt.isoformat() if dt else None
+
+
+def _disponibilita(r: sqlite3.Row) -> DisponibilitaPosti:
+    return DisponibilitaPosti(
+        spettacolo_id=r["spettacolo_id"],
+        posto_id=r["posto_id"],
+        stato=StatoPosto(r["stato"]),
+        hold_scadenza=_dt(r["hold_scadenza"]),
+    )
+
+
+def _ordine(r: sqlite3.Row) -> OrdineAcquisto:
+    return OrdineAcquisto(
+        id=r["id"],
+        cliente_id=r["cliente_id"],
+        spettacolo_id=r["spettacolo_id"],
+        posti_ids=r["posto_id"].split(","),
+        totale_eur=r["totale_eur"],
+        stato=StatoOrdine(r["stato"]),
+        creato_il=_data(r["creato_il"]),
+    )
+
+
+def _pagamento(r: sqlite3.Row) -> Pagamento:
+    return Pagamento(
+        id=r["id"],
+        ordine_id=r["ordine_id"],
+        provider=r["provider"],
+        importo_eur=r["importo_eur"],
+        esito=EsitoPagamento(r["esito"]),
+        transaction_ref=r["transaction_ref"],
+        ricevuto_il=_dt(r["ricevuto_il"]),
+    )
+
+
+def _biglietto(r: sqlite3.Row) -> Biglietto:
+    return Biglietto(id=r["id"], ordine_id=r["ordine_id"], qr_code=r["qr_code"], emesso_il=_data(r["emesso_il"]))
+
+
+def _webhook(r: sqlite3.Row) -> EventoWebhook:
+    return EventoWebhook(
+        id=r["id"],
+        pagamento_id=r["pagamento_id"],
+        transaction_ref=r["transaction_ref"],
+        esito=EsitoPagamento(r["esito"]),
+        biglietto_id=r["biglietto_id"],
+        ricevuto_il=_data(r["ricevuto_il"]),
+    )
+
+
+def _waitlist(r: sqlite3.Row) -> IscrizioneListaAttesa:
+    return IscrizioneListaAttesa(
+        id=r["id"],
+        cliente_id=r["cliente_id"],
+        spettacolo_id=r["spettacolo_id"],
+        creata_il=_data(r["creata_il"]),
+        notificato=bool(r["notificato"]),
+    )
+
+
+# Righe lette a blocchi con keyset pagination su (data, id): memoria costante anche su
+# tabelle grandi e nessun cursore SQLite tenuto aperto tra un blocco e l'altro.
+RIGHE_PER_BLOCCO = 500
+
+
+class SqliteDB:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        # connessione condivisa tra thread: ogni statement passa da _lock
+        self._conn = sqlite3.connect(path, cached_statements=256, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(_SCHEMA)
+        self._osservatori: List[Callable[[str, Any], None]] = []
+        self.eventi_posti = BusEventiPosti()
+        self.eventi_ordini = BusEventiOrdini()
+        self.ritenzione_webhook = RITENZIONE_WEBHOOK
+
+    def lock_spettacolo(self, spettacolo_id: str) -> threading.RLock:
+        return self._lock
+
+    def _esegui(self, sql: str, params: Tuple[Any, ...]) -> int:
+        with self._lock:
+            return self._conn.execute(sql, params).rowcount
+
+    def _uno(self, sql: str, params: Tuple[Any, ...]) -> Optional[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()
+
+    def _tutti(self, sql: str, params: Tuple[Any, ...] = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def commit(self) -> None:
+        with self._lock:
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+    def get_aggregati(self) -> Optional[str]:
+        r = self._uno("SELECT dati FROM aggregati WHERE id = 1", ())
+        return r["dati"] if r else None
+
+    def save_aggregati(self, dati: str) -> None:
+        self._esegui("INSERT OR REPLACE INTO aggregati VALUES (1, ?)", (dati,))
+
+    def vuoto(self) -> bool:
+        return self._uno("SELECT 1 FROM sale LIMIT 1", ()) is None
+
+    def osserva(self, callback: Callable[[str, Any], None]) -> None:
+        self._osservatori.append(callback)
+
+    def rimuovi_osservatore(self, callback: Callable[[str, Any], None]) -> None:
+        if callback in self._osservatori:
+            self._osservatori.remove(callback)
+
+    def _notifica(self, tabella: str, record: Any) -> None:
+        for callback in self._osservatori:
+            callback(tabella, record)
+
+    def load_seed(self, seed: SeedData) -> None:
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO clienti VALUES (?, ?, ?)", [(c.id, c.nome, c.email) for c in seed.clienti]
+        )
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO films VALUES (?, ?, ?)", [(f.id, f.titolo, f.durata_min) for f in seed.films]
+        )
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO sale VALUES (?, ?, ?, ?)", [(s.id, s.nome, s.righe, s.colonne) for s in seed.sale]
+        )
+        for p in seed.posti:
+            self.add_posto(p)
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO spettacoli VALUES (?, ?, ?, ?, ?)",
+            [(sp.id, sp.film_id, sp.sala_id, _iso(sp.inizio), sp.prezzo_eur) for sp in seed.spettacoli],
+        )
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO disponibilita VALUES (?, ?, ?, ?)",
+            [(d.spettacolo_id, d.posto_id, d.stato.value, _iso(d.hold_scadenza)) for d in seed.disponibilita],
+        )
+        self._conn.commit()
+
+    def add_spettacoli(self, spettacoli: Iterable[Spettacolo]) -> None:
+        # le righe di disponibilità nascono dai posti della sala direttamente in SQL; come in
+        # InMemoryDB._posti_sala, i posti legacy (sala_id NULL) coprono le posizioni che la sala non ha
+        righe = [(sp.id, sp.film_id, sp.sala_id, _iso(sp.inizio), sp.prezzo_eur) for sp in spettacoli]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO spettacoli VALUES (?, ?, ?, ?, ?)", righe)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO disponibilita "
+                "SELECT ?, p.id, ?, NULL FROM sale s JOIN posti p ON p.sala_id = s.id OR ("
+                "p.sala_id IS NULL AND NOT EXISTS ("
+                "SELECT 1 FROM posti q WHERE q.sala_id = s.id AND q.riga = p.riga AND q.colonna = p.colonna)) "
+                "WHERE s.id = ? AND p.riga <= s.righe AND p.colonna <= s.colonne",
+                [(r[0], StatoPosto.LIBERO.value, r[2]) for r in righe],
+            )
+
+    def importa(self, db: InMemoryDB) -> None:
+        self.load_seed(
+            SeedData(
+                clienti=list(db.clienti.values()),
+                films=list(db.films.values()),
+                sale=list(db.sale.values()),
+                posti=list(db.posti.values()),
+                spettacoli=db.list_spettacoli(),
+                disponibilita=list(db.iter_disponibilita()),
+            )
+        )
+        for o in db.list_ordini():
+            self.save_ordine(o)
+        for p in db.pagamenti.values():
+            self.save_pagamento(p)
+        for b in db.biglietti.values():
+            self.save_biglietto(b)
+        for w in db.list_waitlist():
+            self.add_waitlist(w)
+        for e in db.webhook.values():
+            self.save_evento_webhook(e)
+        self._conn.commit()
+
+    def add_posto(self, posto: Posto) -> None:
+        self._esegui(
+            "INSERT OR REPLACE INTO posti VALUES (?, ?, ?, ?)", (posto.id, posto.riga, posto.colonna, posto.sala_id)
+        )
+
+    def find_cliente(self, cliente_id: str) -> Optional[Cliente]:
+        r = self._uno("SELECT id, nome, email FROM clienti WHERE id = ?", (cliente_id,))
+        return Cliente(id=r["id"], nome=r["nome"], email=r["email"]) if r else None
+
+    def list_spettacoli(self) -> List[Spettacolo]:
+        return [self._spettacolo(r) for r in self._tutti("SELECT * FROM spettacoli ORDER BY rowid")]
+
+    def _spettacolo(self, r: sqlite3.Row) -> Spettacolo:
+        return Spettacolo(
+            id=r["id"], film_id=r["film_id"], sala_id=r["sala_id"], inizio=_data(r["inizio"]), prezzo_eur=r["prezzo_eur"]
+        )
+
+    def get_spettacolo(self, spettacolo_id: str) -> Spettacolo:
+        r = self._uno("SELECT * FROM spettacoli WHERE id = ?", (spettacolo_id,))
+        if not r:
+            raise NotFoundError(f"Spettacolo non trovato: {spettacolo_id}")
+        return self._spettacolo(r)
+
+    def get_film(self, film_id: str) -> Film:
+        r = self._uno("SELECT * FROM films WHERE id = ?", (film_id,))
+        if not r:
+            raise NotFoundError(f"Film non trovato: {film_id}")
+        return Film(id=r["id"], titolo=r["titolo"], durata_min=r["durata_min"])
+
+    def get_sala(self, sala_id: str) -> SalaCinema:
+        r = self._uno("SELECT * FROM sale WHERE id = ?", (sala_id,))
+        if not r:
+            raise NotFoundError(f"Sala non trovata: {sala_id}")
+        return SalaCinema(id=r["id"], nome=r["nome"], righe=r["righe"], colonne=r["colonne"])
+
+    def get_posto(self, posto_id: str) -> Posto:
+        r = self._uno("SELECT * FROM posti WHERE id = ?", (posto_id,))
+        if not r:
+            raise NotFoundError(f"Posto non trovato: {posto_id}")
+        return Posto(id=r["id"], riga=r["riga"], colonna=r["colonna"], sala_id=r["sala_id"])
+
+    def find_posto_by_etichetta(self, sala_id: str, etichetta: str) -> Posto:
+        sala = self.get_sala(sala_id)
+        et = etichetta.strip().upper()
+        if len(et) < 2:
+            raise NotFoundError(f"Etichetta posto non valida: {etichetta}")
+
+        row_char = et[0]
+        try:
+            col = int(et[1:])
+        except ValueError as e:
+            raise NotFoundError(f"Etichetta posto non valida: {etichetta}") from e
+
+        riga = (ord(row_char) - ord("A")) + 1
+        if riga < 1 or riga > sala.righe or col < 1 or col > sala.colonne:
+            raise NotFoundError(f"Posto fuori sala: {etichetta}")
+
+        r = self._uno(
+            "SELECT * FROM posti WHERE (sala_id = ? OR sala_id IS NULL) AND riga = ? AND colonna = ? "
+            "ORDER BY sala_id IS NULL LIMIT 1",
+            (sala.id, riga, col),
+        )
+        if not r:
+            raise NotFoundError(f"Posto non trovato: {etichetta}")
+        return Posto(id=r["id"], riga=r["riga"], colonna=r["colonna"], sala_id=r["sala_id"])
+
+    def get_disponibilita(self, spettacolo_id: str, posto_id: str) -> DisponibilitaPosti:
+        r = self._uno("SELECT * FROM disponibilita WHERE spettacolo_id = ? AND posto_id = ?", (spettacolo_id, posto_id))
+        if not r:
+            raise NotFoundError(f"Disponibilità non trovata: spettacolo={spettacolo_id}, posto={posto_id}")
+        return _disponibilita(r)
+
+    def add_disponibilita(self, d: DisponibilitaPosti) -> None:
+        self._esegui(
+            "INSERT OR REPLACE INTO disponibilita VALUES (?, ?, ?, ?)",
+            (d.spettacolo_id, d.posto_id, d.stato.value, _iso(d.hold_scadenza)),
+        )
+
+    def mappa_posti(self, spettacolo_id: str) -> MappaPosti:
+        sala = self.get_sala(self.get_spettacolo(spettacolo_id).sala_id)
+        mappa = MappaPosti(spettacolo_id, sala.righe, sala.colonne)
+        righe = self._tutti(
+            "SELECT d.stato, d.hold_scadenza, p.riga, p.colonna FROM disponibilita d "
+            "JOIN posti p ON p.id = d.posto_id WHERE d.spettacolo_id = ?",
+            (spettacolo_id,),
+        )
+        if not righe:
+            raise NotFoundError(f"Disponibilità non trovata: spettacolo={spettacolo_id}")
+        for r in righe:
+            if r["riga"] <= sala.righe and r["colonna"] <= sala.colonne:
+                mappa.imposta(mappa.indice(r["riga"], r["colonna"]), StatoPosto(r["stato"]), _dt(r["hold_scadenza"]))
+        return mappa
+
+    def iter_disponibilita(self) -> Iterator[DisponibilitaPosti]:
+        for r in self._tutti("SELECT * FROM disponibilita"):
+            yield _disponibilita(r)
+
+    def list_disponibilita_spettacolo(self, spettacolo_id: str) -> List[DisponibilitaPosti]:
+        righe = self._tutti("SELECT * FROM disponibilita WHERE spettacolo_id = ?", (spettacolo_id,))
+        return [_disponibilita(r) for r in righe]
+
+    def list_disponibilita_by_stato(self, spettacolo_id: str, stato: StatoPosto) -> List[DisponibilitaPosti]:
+        righe = self._tutti(
+            "SELECT * FROM disponibilita WHERE spettacolo_id = ? AND stato = ?", (spettacolo_id, stato.value)
+        )
+        return [_disponibilita(r) for r in righe]
+
+    def list_disponibilita_bloccate(self) -> List[DisponibilitaPosti]:
+        righe = self._tutti("SELECT * FROM disponibilita WHERE stato = ?", (StatoPosto.BLOCCATO.value,))
+        return [_disponibilita(r) for r in righe]
+
+    def conta_posti(self, spettacolo_id: str, stato: StatoPosto) -> int:
+        righe = self._tutti(
+            "SELECT COUNT(*) FROM disponibilita WHERE spettacolo_id = ? AND stato = ?", (spettacolo_id, stato.value)
+        )
+        return righe[0][0]
+
+    def set_stato_posto(
+        self,
+        spettacolo_id: str,
+        posto_id: str,
+        stato: StatoPosto,
+        hold_scadenza: Optional[datetime] = None,
+    ) -> None:
+        with self._lock:
+            precedente = self._stato_corrente(spettacolo_id, posto_id) if self.eventi_posti.attivo() else None
+            righe = self._esegui(
+                "UPDATE disponibilita SET stato = ?, hold_scadenza = ? WHERE spettacolo_id = ? AND posto_id = ?",
+                (stato.value, _iso(hold_scadenza), spettacolo_id, posto_id),
+            )
+        if righe == 0:
+            raise NotFoundError(f"Disponibilità non trovata: spettacolo={spettacolo_id}, posto={posto_id}")
+        if self._osservatori:
+            self._notifica("disponibilita", DisponibilitaPosti(spettacolo_id, posto_id, stato, hold_scadenza))
+        if self.eventi_posti.attivo():
+            self.eventi_posti.pubblica(EventoPosto(spettacolo_id, posto_id, precedente, stato))
+
+    def _stato_corrente(self, spettacolo_id: str, posto_id: str) -> Optional[StatoPosto]:
+        r = self._uno(
+            "SELECT stato FROM disponibilita WHERE spettacolo_id = ? AND posto_id = ?", (spettacolo_id, posto_id)
+        )
+        return StatoPosto(r["stato"]) if r else None
+
+    def cas_stato_posto(
+        self,
+        spettacolo_id: str,
+        posto_id: str,
+        attesi: Tuple[StatoPosto, ...],
+        stato: StatoPosto,
+        hold_scadenza: Optional[datetime] = None,
+        scadenza_attesa: Optional[datetime] = None,
+    ) -> bool:
+        # UPDATE condizionato: SQLite valuta WHERE e scrive in modo atomico
+        sql = "UPDATE disponibilita SET stato = ?, hold_scadenza = ? WHERE spettacolo_id = ? AND posto_id = ?"
+        sql += f" AND stato IN ({', '.join('?' * len(attesi))})"
+        params: Tuple[Any, ...] = (stato.value, _iso(hold_scadenza), spettacolo_id, posto_id, *(s.value for s in attesi))
+        if scadenza_attesa is not None:
+            sql += " AND hold_scadenza = ?"
+            params += (_iso(scadenza_attesa),)
+        with self._lock:
+            # con un solo stato atteso il precedente è noto senza rileggerlo
+            precedente: Optional[StatoPosto] = attesi[0]
+            if len(attesi) > 1 and self.eventi_posti.attivo():
+                precedente = self._stato_corrente(spettacolo_id, posto_id)
+            aggiornati = self._esegui(sql, params)
+        if aggiornati == 0:
+            self.get_disponibilita(spettacolo_id, posto_id)
+            return False
+        if self._osservatori:
+            self._notifica("disponibilita", DisponibilitaPosti(spettacolo_id, posto_id, stato, hold_scadenza))
+        if self.eventi_posti.attivo():
+            self.eventi_posti.pubblica(EventoPosto(spettacolo_id, posto_id, precedente, stato))
+        return True
+
+    def try_hold(self, spettacolo_id: str, posto_id: str, scadenza: datetime) -> bool:
+        return self.cas_stato_posto(
+            spettacolo_id, posto_id, (StatoPosto.LIBERO,), StatoPosto.BLOCCATO, hold_scadenza=scadenza
+        )
+
+    def cas_stato_posti(
+        self,
+        spettacolo_id: str,
+        posti_ids: List[str],
+        attesi: Tuple[StatoPosto, ...],
+        stato: StatoPosto,
+        hold_scadenza: Optional[datetime] = None,
+        scadenza_attesa: Optional[datetime] = None,
+    ) -> bool:
+        # un solo UPDATE su tutti i posti dentro un savepoint: se non li aggiorna tutti si annulla
+        sql = (
+            "UPDATE disponibilita SET stato = ?, hold_scadenza = ? WHERE spettacolo_id = ?"
+            f" AND posto_id IN ({', '.join('?' * len(posti_ids))}) AND stato IN ({', '.join('?' * len(attesi))})"
+        )
+        params: Tuple[Any, ...] = (stato.value, _iso(hold_scadenza), spettacolo_id, *posti_ids)
+        params += tuple(s.value for s in attesi)
+        if scadenza_attesa is not None:
+            sql += " AND hold_scadenza = ?"
+            params += (_iso(scadenza_attesa),)
+        with self._lock:
+            precedenti: List[Optional[StatoPosto]] = [attesi[0]] * len(posti_ids)
+            if len(attesi) > 1 and self.eventi_posti.attivo():
+                precedenti = [self._stato_corrente(spettacolo_id, posto_id) for posto_id in posti_ids]
+            self._conn.execute("SAVEPOINT cas_posti")
+            try:
+                aggiornati = self._conn.execute(sql, params).rowcount
+                if aggiornati != len(set(posti_ids)):
+                    self._conn.execute("ROLLBACK TO cas_posti")
+            finally:
+                self._conn.execute("RELEASE cas_posti")
+        if aggiornati != len(set(posti_ids)):
+            for posto_id in posti_ids:
+                self.get_disponibilita(spettacolo_id, posto_id)
+            return False
+        if self._osservatori:
+            for posto_id in posti_ids:
+                self._notifica("disponibilita", DisponibilitaPosti(spettacolo_id, posto_id, stato, hold_scadenza))
+        if self.eventi_posti.attivo():
+            for posto_id, precedente in zip(posti_ids, precedenti):
+                self.eventi_posti.pubblica(EventoPosto(spettacolo_id, posto_id, precedente, stato))
+        return True
+
+    def try_hold_many(self, spettacolo_id: str, posti_ids: List[str], scadenza: datetime) -> bool:
+        return self.cas_stato_posti(
+            spettacolo_id, posti_ids, (StatoPosto.LIBERO,), StatoPosto.BLOCCATO, hold_scadenza=scadenza
+        )
+
+    def save_ordine(self, ordine: OrdineAcquisto) -> None:
+        with self._lock:
+            precedente = None
+            if self.eventi_ordini.attivo():
+                r = self._uno("SELECT stato FROM ordini WHERE id = ?", (ordine.id,))
+                precedente = StatoOrdine(r["stato"]) if r else None
+            self._esegui(
+                "INSERT OR REPLACE INTO ordini VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    ordine.id,
+                    ordine.cliente_id,
+                    ordine.spettacolo_id,
+                    ",".join(ordine.posti_ids),
+                    ordine.totale_eur,
+                    ordine.stato.value,
+                    _iso(ordine.creato_il),
+                ),
+            )
+        self._notifica("ordini", ordine)
+        if self.eventi_ordini.attivo():
+            self.eventi_ordini.pubblica(EventoOrdine(ordine, precedente))
+
+    def get_ordine(self, ordine_id: str) -> OrdineAcquisto:
+        r = self._uno("SELECT * FROM ordini WHERE id = ?", (ordine_id,))
+        if not r:
+            raise NotFoundError(f"Ordine non trovato: {ordine_id}")
+        return _ordine(r)
+
+    def list_ordini(self) -> List[OrdineAcquisto]:
+        return [_ordine(r) for r in self._tutti("SELECT * FROM ordini")]
+
+    def _ordini(
+        self, filtro: str, params: Tuple[Any, ...], limite: Optional[int], recenti_prima: bool
+    ) -> List[OrdineAcquisto]:
+        verso = "DESC" if recenti_prima else "ASC"
+        righe = self._tutti(
+            f"SELECT * FROM ordini {filtro} ORDER BY creato_il {verso}, id {verso} LIMIT ?",
+            (*params, -1 if limite is None else limite),
+        )
+        return [_ordine(r) for r in righe]
+
+    def list_ordini_ordinati(self, limite: Optional[int] = None, recenti_prima: bool = False) -> List[OrdineAcquisto]:
+        return self._ordini("", (), limite, recenti_prima)
+
+    def list_ordini_by_cliente(
+        self, cliente_id: str, limite: Optional[int] = None, recenti_prima: bool = False
+    ) -> List[OrdineAcquisto]:
+        return self._ordini("WHERE cliente_id = ?", (cliente_id,), limite, recenti_prima)
+
+    def list_ordini_by_spettacolo(
+        self, spettacolo_id: str, limite: Optional[int] = None, recenti_prima: bool = False
+    ) -> List[OrdineAcquisto]:
+        return self._ordini("WHERE spettacolo_id = ?", (spettacolo_id,), limite, recenti_prima)
+
+    def save_pagamento(self, pagamento: Pagamento) -> None:
+        self._esegui(
+            "INSERT OR REPLACE INTO pagamenti VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                pagamento.id,
+                pagamento.ordine_id,
+                pagamento.provider,
+                pagamento.importo_eur,
+                pagamento.esito.value,
+                pagamento.transaction_ref,
+                _iso(pagamento.ricevuto_il),
+            ),
+        )
+        self._notifica("pagamenti", pagamento)
+
+    def get_pagamento(self, pagamento_id: str) -> Pagamento:
+        r = self._uno("SELECT * FROM pagamenti WHERE id = ?", (pagamento_id,))
+        if not r:
+            raise NotFoundError(f"Pagamento non trovato: {pagamento_id}")
+        return _pagamento(r)
+
+    def _scorri(
+        self,
+        tabella: str,
+        colonna_data: str,
+        filtri: Dict[str, Any],
+        dal: Optional[datetime],
+        al: Optional[datetime],
+        dopo: Optional[Cursore],
+    ) -> Iterator[sqlite3.Row]:
+        condizioni = [f"{col} = ?" for col in filtri]
+        params: List[Any] = list(filtri.values())
+        if dal is not None:
+            condizioni.append(f"{colonna_data} >= ?")
+            params.append(_iso(dal))
+        if al is not None:
+            condizioni.append(f"{colonna_data} < ?")
+            params.append(_iso(al))
+        posizione = (_iso(dopo[0]), dopo[1]) if dopo is not None else None
+        while True:
+            where = list(condizioni)
+            valori = list(params)
+            if posizione is not None:
+                where.append(f"({colonna_data}, id) > (?, ?)")
+                valori.extend(posizione)
+            sql = f"SELECT * FROM {tabella}"
+            if where:
+                sql += " WHERE " + " AND ".join(where)
+            sql += f" ORDER BY {colonna_data}, id LIMIT {RIGHE_PER_BLOCCO}"
+            righe = self._tutti(sql, tuple(valori))
+            yield from righe
+            if len(righe) < RIGHE_PER_BLOCCO:
+                return
+            posizione = (righe[-1][colonna_data], righe[-1]["id"])
+
+    def iter_ordini(
+        self,
+        cliente_id: Optional[str] = None,
+        spettacolo_id: Optional[str] = None,
+        stato: Optional[StatoOrdine] = None,
+        dal: Optional[datetime] = None,
+        al: Optional[datetime] = None,
+        dopo: Optional[Cursore] = None,
+    ) -> Iterator[OrdineAcquisto]:
+        filtri = {"cliente_id": cliente_id, "spettacolo_id": spettacolo_id, "stato": stato.value if stato else None}
+        filtri = {col: v for col, v in filtri.items() if v is not None}
+        for r in self._scorri("ordini", "creato_il", filtri, dal, al, dopo):
+            yield _ordine(r)
+
+    def list_pagamenti_by_ordine(self, ordine_id: str) -> List[Pagamento]:
+        return [_pagamento(r) for r in self._tutti("SELECT * FROM pagamenti WHERE ordine_id = ?", (ordine_id,))]
+
+    def save_biglietto(self, biglietto: Biglietto) -> None:
+        self._esegui(
+            "INSERT OR REPLACE INTO biglietti VALUES (?, ?, ?, ?)",
+            (biglietto.id, biglietto.ordine_id, biglietto.qr_code, _iso(biglietto.emesso_il)),
+        )
+        self._notifica("biglietti", biglietto)
+
+    def get_biglietto(self, biglietto_id: str) -> Biglietto:
+        r = self._uno("SELECT * FROM biglietti WHERE id = ?", (biglietto_id,))
+        if not r:
+            raise NotFoundError(f"Biglietto non trovato: {biglietto_id}")
+        return _biglietto(r)
+
+    def get_biglietto_by_ordine(self, ordine_id: str) -> Optional[Biglietto]:
+        r = self._uno("SELECT * FROM biglietti WHERE ordine_id = ? LIMIT 1", (ordine_id,))
+        return _biglietto(r) if r else None
+
+    def get_evento_webhook(self, chiave: str) -> Optional[EventoWebhook]:
+        r = self._uno("SELECT * FROM webhook WHERE id = ?", (chiave,))
+        return _webhook(r) if r else None
+
+    def save_evento_webhook(self, evento: EventoWebhook) -> None:
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR REPLACE INTO webhook (id, pagamento_id, transaction_ref, esito, biglietto_id, ricevuto_il) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    evento.id,
+                    evento.pagamento_id,
+                    evento.transaction_ref,
+                    evento.esito.value,
+                    evento.biglietto_id,
+                    _iso(evento.ricevuto_il),
+                ),
+            )
+            # ritenzione limitata: range sulla chiave primaria, senza scansioni
+            self._conn.execute("DELETE FROM webhook WHERE seq <= ?", ((cur.lastrowid or 0) - self.ritenzione_webhook,))
+        self._notifica("webhook", evento)
+
+    def add_waitlist(self, iscr: IscrizioneListaAttesa) -> None:
+        self.save_waitlist(iscr)
+
+    def save_waitlist(self, iscr: IscrizioneListaAttesa) -> None:
+        self._esegui(
+            "INSERT OR REPLACE INTO waitlist VALUES (?, ?, ?, ?, ?)",
+            (iscr.id, iscr.cliente_id, iscr.spettacolo_id, _iso(iscr.creata_il), int(iscr.notificato)),
+        )
+        self._notifica("waitlist", iscr)
+
+    def list_waitlist_by_spettacolo(self, spettacolo_id: str) -> List[IscrizioneListaAttesa]:
+        return [_waitlist(r) for r in self._tutti("SELECT * FROM waitlist WHERE spettacolo_id = ?", (spettacolo_id,))]
+
+    def list_waitlist(self) -> List[IscrizioneListaAttesa]:
+        return [_waitlist(r) for r in self._tutti("SELECT * FROM waitlist")]
+
+    def iter_waitlist(
+        self,
+        cliente_id: Optional[str] = None,
+        spettacolo_id: Optional[str] = None,
+        notificato: Optional[bool] = None,
+        dal: Optional[datetime] = None,
+        al: Optional[datetime] = None,
+        dopo: Optional[Cursore] = None,
+    ) -> Iterator[IscrizioneListaAttesa]:
+        filtri = {
+            "cliente_id": cliente_id,
+            "spettacolo_id": spettacolo_id,
+            "notificato": None if notificato is None else int(notificato),
+        }
+        filtri = {col: v for col, v in filtri.items() if v is not None}
+        for r in self._scorri("waitlist", "creata_il", filtri, dal, al, dopo):
+            yield _waitlist(r)
+
+    def spettacoli_con_attesa(self) -> List[str]:
+        return [r[0] for r in self._tutti("SELECT DISTINCT spettacolo_id FROM waitlist WHERE notificato = 0")]
+
+    def list_waitlist_pending_by_spettacolo(
+        self, spettacolo_id: str, limite: Optional[int] = None
+    ) -> List[IscrizioneListaAttesa]:
+        righe = self._tutti(
+            "SELECT * FROM waitlist WHERE notificato = 0 AND spettacolo_id = ? ORDER BY creata_il, id LIMIT ?",
+            (spettacolo_id, -1 if limite is None else limite),
+        )
+        return [_waitlist(r) for r in righe]
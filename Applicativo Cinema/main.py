@@ -1,10 +1,47 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
+import cProfile
+import itertools
+import json
+import pstats
+import sys
+from datetime import datetime
+from typing import Any, Callable, Iterable, Optional
 
 from cinema_ticketing.app import build_app_context
-from cinema_ticketing.domain import EsitoPagamento
-from cinema_ticketing.repositories import ConflictError, NotFoundError
+from cinema_ticketing.domain import EsitoPagamento, StatoOrdine
+from cinema_ticketing.metrics import Metriche
+from cinema_ticketing.persistence import FORMATI, converti_stato, to_row
+from cinema_ticketing.repositories import (
+    ConflictError,
+    Cursore,
+    NotFoundError,
+    codifica_cursore,
+    decodifica_cursore,
+)
+from cinema_ticketing.scheduling import ServizioProgrammazione, regole_da_json
+from cinema_ticketing.server import ServizioHttp
+
+
+# Tabelle caricate all'avvio da ogni comando; le altre vengono materializzate solo se toccate.
+TABELLE_COMANDI = {
+    "list-shows": ("spettacoli", "films", "sale"),
+    "show-seats": ("spettacoli", "sale", "posti", "disponibilita"),
+    "buy": ("spettacoli", "sale", "posti", "disponibilita", "ordini", "pagamenti"),
+    "webhook": (
+        "spettacoli", "sale", "posti", "disponibilita", "ordini", "pagamenti", "biglietti", "clienti", "waitlist",
+        "webhook",
+    ),
+    "waitlist-join": ("waitlist",),
+    "waitlist-process": ("spettacoli", "sale", "posti", "disponibilita", "waitlist", "clienti"),
+    "waitlist-list": ("waitlist", "clienti"),
+    "orders-list": ("ordini",),
+    "report": ("spettacoli", "films", "sale", "posti", "disponibilita"),
+    "admin-free-seat": ("spettacoli", "sale", "posti", "disponibilita", "waitlist", "clienti"),
+    "schedule": ("spettacoli", "films", "sale", "posti"),
+}
 
 
 def cmd_list_shows(ctx) -> int:
@@ -24,9 +61,15 @@ def cmd_show_seats(ctx, spettacolo_id: str) -> int:
     return 0
 
 
-def cmd_buy(ctx, cliente_id: str, spettacolo_id: str, posto: str) -> int:
+def cmd_buy(ctx, cliente_id: str, spettacolo_id: str, posti: list[str] | None, quantita: int | None) -> int:
+    # "--posto A1 A2" e "--posto A1,A2" sono equivalenti
+    etichette = [et for valore in posti or [] for et in valore.split(",") if et]
     try:
-        ordine, pagamento = ctx.gestore.avvia_acquisto(cliente_id, spettacolo_id, posto)
+        if quantita is not None:
+            ordine, pagamento = ctx.gestore.avvia_acquisto_migliori(cliente_id, spettacolo_id, quantita)
+            etichette = [ctx.db.get_posto(pid).etichetta() for pid in ordine.posti_ids]
+        else:
+            ordine, pagamento = ctx.gestore.avvia_acquisto(cliente_id, spettacolo_id, etichette)
     except (NotFoundError, ConflictError) as e:
         print(f"ERRORE: {e}")
         try:
@@ -38,7 +81,12 @@ def cmd_buy(ctx, cliente_id: str, spettacolo_id: str, posto: str) -> int:
             pass
         return 1
 
-    print("\nOrdine creato e posto bloccato:")
+    if len(etichette) == 1:
+        print("\nOrdine creato e posto bloccato:")
+    else:
+        print(f"\nOrdine creato e {len(etichette)} posti bloccati:")
+    if len(etichette) > 1 or quantita is not None:
+        print(f" - posti:       {', '.join(etichette)}")
     print(f" - ordine_id:   {ordine.id}")
     print(f" - totale:      €{ordine.totale_eur:.2f}")
 
@@ -56,7 +104,7 @@ def cmd_buy(ctx, cliente_id: str, spettacolo_id: str, posto: str) -> int:
     return 0
 
 
-def cmd_webhook(ctx, pagamento_id: str, esito: str) -> int:
+def cmd_webhook(ctx, pagamento_id: str, esito: str, transaction_ref: str | None) -> int:
     try:
         esito_enum = EsitoPagamento[esito.upper()]
     except KeyError:
@@ -64,7 +112,7 @@ def cmd_webhook(ctx, pagamento_id: str, esito: str) -> int:
         return 1
 
     try:
-        ticket = ctx.gestore.webhook_esito_pagamento(pagamento_id, esito_enum)
+        ticket = ctx.gestore.webhook_esito_pagamento(pagamento_id, esito_enum, transaction_ref)
     except (NotFoundError, ConflictError) as e:
         print(f"ERRORE: {e}")
         return 1
@@ -101,29 +149,128 @@ def cmd_waitlist_process(ctx) -> int:
     return 0
 
 
-def cmd_waitlist_list(ctx, spettacolo_id: str | None) -> int:
-    if spettacolo_id:
-        items = ctx.db.list_waitlist_by_spettacolo(spettacolo_id)
-    else:
-        items = list(ctx.db.waitlist.values())
+def _stampa_pagina(
+    righe: Iterable[Any],
+    tabella: str,
+    limite: int | None,
+    formato: str,
+    cursore_di: Callable[[Any], Cursore],
+    testo: Callable[[Any], str],
+    vuoto: str,
+) -> None:
+    # le righe arrivano da un generatore: se ne tiene in memoria una alla volta
+    stampate = 0
+    ultima = None
+    for r in itertools.islice(righe, None if limite is None else limite + 1):
+        if limite is not None and stampate == limite:
+            # c'è almeno un'altra riga: si indica il cursore della pagina successiva
+            cursore = codifica_cursore(cursore_di(ultima))
+            if formato == "ndjson":
+                print(f"cursore: {cursore}", file=sys.stderr)
+            else:
+                print(f"-- altri risultati: --dopo {cursore}")
+            return
+        if formato == "ndjson":
+            print(json.dumps(to_row(tabella, r), ensure_ascii=False, separators=(",", ":")))
+        else:
+            print(testo(r))
+        stampate += 1
+        ultima = r
+    if not stampate and formato != "ndjson":
+        print(vuoto)
+
+
+def cmd_waitlist_list(
+    ctx,
+    spettacolo_id: str | None,
+    cliente_id: str | None,
+    notificato: bool | None,
+    dal: datetime | None,
+    al: datetime | None,
+    limite: int | None,
+    dopo: Cursore | None,
+    formato: str,
+) -> int:
+    items = ctx.db.iter_waitlist(
+        cliente_id=cliente_id, spettacolo_id=spettacolo_id, notificato=notificato, dal=dal, al=al, dopo=dopo
+    )
+    email_clienti: dict[str, str] = {}
 
-    if not items:
-        print("(nessuna iscrizione)")
-        return 0
+    def testo(w) -> str:
+        if w.cliente_id not in email_clienti:
+            c = ctx.db.find_cliente(w.cliente_id)
+            email_clienti[w.cliente_id] = c.email if c else "?"
+        email = email_clienti[w.cliente_id]
+        return f"- {w.id} | spettacolo={w.spettacolo_id} | cliente={w.cliente_id}({email}) | notificato={w.notificato}"
+
+    _stampa_pagina(items, "waitlist", limite, formato, lambda w: (w.creata_il, w.id), testo, "(nessuna iscrizione)")
+    return 0
+
+
+def cmd_orders_list(
+    ctx,
+    cliente_id: str | None,
+    spettacolo_id: str | None,
+    stato: StatoOrdine | None,
+    dal: datetime | None,
+    al: datetime | None,
+    limite: int | None,
+    dopo: Cursore | None,
+    formato: str,
+) -> int:
+    ordini = ctx.db.iter_ordini(
+        cliente_id=cliente_id, spettacolo_id=spettacolo_id, stato=stato, dal=dal, al=al, dopo=dopo
+    )
 
-    for w in sorted(items, key=lambda x: x.creata_il):
-        c = ctx.db.clienti.get(w.cliente_id)
-        email = c.email if c else "?"
-        print(f"- {w.id} | spettacolo={w.spettacolo_id} | cliente={w.cliente_id}({email}) | notificato={w.notificato}")
+    def testo(o) -> str:
+        return (
+            f"- {o.id} | cliente={o.cliente_id} | spettacolo={o.spettacolo_id} | posto={','.join(o.posti_ids)} "
+            f"| stato={o.stato} | €{o.totale_eur:.2f}"
+        )
+
+    _stampa_pagina(ordini, "ordini", limite, formato, lambda o: (o.creato_il, o.id), testo, "(nessun ordine)")
     return 0
 
 
-def cmd_orders_list(ctx) -> int:
-    if not ctx.db.ordini:
-        print("(nessun ordine)")
+def _percentuale(tasso: float | None) -> str:
+    return "n/d" if tasso is None else f"{tasso:.1%}"
+
+
+def cmd_report(ctx, formato: str, ricalcola: bool) -> int:
+    # gli aggregati salvati con lo stato bastano; se mancano o non sono più validi si ricostruiscono
+    # dagli ordini e si salvano, così dal comando successivo li aggiornano solo le modifiche
+    ricostruiti = ricalcola or ctx.analisi is None
+    dati = ctx.analisi_vendite(ricalcola=ricalcola).riepilogo()
+    if ricostruiti:
+        ctx.save()
+    if formato == "json":
+        print(json.dumps(dati, ensure_ascii=False, indent=2))
         return 0
-    for o in sorted(ctx.db.ordini.values(), key=lambda x: x.creato_il):
-        print(f"- {o.id} | cliente={o.cliente_id} | spettacolo={o.spettacolo_id} | posto={o.posto_id} | stato={o.stato} | €{o.totale_eur:.2f}")
+
+    print("Ricavi per film:")
+    for r in dati["ricavi_per_film"]:
+        print(f" - {r['titolo']}: €{r['ricavi_eur']:.2f} ({r['ordini']} ordini)")
+    if not dati["ricavi_per_film"]:
+        print(" - (nessuna vendita)")
+    print("Ricavi per spettacolo:")
+    for r in dati["ricavi_per_spettacolo"]:
+        print(f" - {r['spettacolo_id']}: €{r['ricavi_eur']:.2f} ({r['ordini']} ordini)")
+    print("Ricavi per giorno:")
+    for r in dati["ricavi_per_giorno"]:
+        print(f" - {r['giorno']}: €{r['ricavi_eur']:.2f}")
+    print("Occupazione per spettacolo:")
+    for r in dati["occupazione_per_spettacolo"]:
+        print(f" - {r['spettacolo_id']}: {r['venduti']}/{r['capienza']} ({_percentuale(r['occupazione'])})")
+    print("Occupazione per sala:")
+    for r in dati["occupazione_per_sala"]:
+        print(f" - Sala {r['nome']}: {r['venduti']}/{r['capienza']} ({_percentuale(r['occupazione'])})")
+    o = dati["ordini"]
+    print(
+        f"Ordini: {o['pagati']} pagati, {o['annullati']} annullati, {o['scaduti']} con hold scaduto, "
+        f"{o['in_corso']} in corso"
+    )
+    print(f"Tasso di conversione (pagati su pagati+annullati): {_percentuale(dati['tasso_conversione'])}")
+    print(f"Tasso di abbandono hold (annullati+scaduti su hold terminati): {_percentuale(dati['tasso_abbandono_hold'])}")
     return 0
 
 
@@ -142,6 +289,81 @@ def cmd_admin_free_seat(ctx, spettacolo_id: str, posto: str) -> int:
     return 0
 
 
+def cmd_schedule(ctx, file_regole: str, dal: datetime, al: datetime, pausa_min: int) -> int:
+    try:
+        with open(file_regole, encoding="utf-8") as f:
+            regole = regole_da_json(json.load(f))
+        esito = ServizioProgrammazione(ctx.db, pausa_min=pausa_min).genera(regole, dal.date(), al.date())
+    except (OSError, ValueError, NotFoundError) as e:
+        print(f"ERRORE: {e}")
+        return 1
+    print(f"OK: {len(esito.spettacoli)} spettacoli programmati dal {dal:%Y-%m-%d} al {al:%Y-%m-%d} (escluso).")
+    for sp, altro in esito.conflitti:
+        print(f" - scartato {sp.id} ({sp.film_id}, {sp.inizio:%Y-%m-%d %H:%M}): si sovrappone a {altro}")
+
+    ctx.save()
+    return 0
+
+
+def cmd_serve(ctx, host: str, port: int, intervallo_salvataggio_s: float, file_metriche: str | None) -> int:
+    servizio = ServizioHttp(ctx, intervallo_salvataggio_s=intervallo_salvataggio_s, file_metriche=file_metriche)
+    print(f"In ascolto su http://{host}:{port} (Ctrl+C per fermare)")
+    try:
+        asyncio.run(servizio.esegui(host, port))
+    except KeyboardInterrupt:
+        pass
+    print("Servizio fermato, stato salvato.")
+    return 0
+
+
+def cmd_convert_state(state_file: str, formato: str, output: str | None) -> int:
+    destinazione = output or state_file
+    try:
+        converti_stato(state_file, destinazione, formato)
+    except (OSError, ValueError) as e:
+        print(f"ERRORE: {e}")
+        return 1
+    print(f"OK: stato {state_file} convertito in formato {formato}: {destinazione}")
+    return 0
+
+
+def _data(testo: str) -> datetime:
+    try:
+        return datetime.fromisoformat(testo)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"data non valida (usa AAAA-MM-GG o AAAA-MM-GGTHH:MM): {testo}") from None
+
+
+def _positivo(testo: str) -> int:
+    try:
+        n = int(testo)
+    except ValueError:
+        n = 0
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"atteso un intero positivo: {testo}")
+    return n
+
+
+def _cursore(testo: str) -> Cursore:
+    try:
+        return decodifica_cursore(testo)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from None
+
+
+def _argomenti_elenco(p: argparse.ArgumentParser) -> None:
+    p.add_argument("--dal", type=_data, required=False, help="Dalla data inclusa (AAAA-MM-GG[THH:MM])")
+    p.add_argument("--al", type=_data, required=False, help="Fino alla data esclusa (AAAA-MM-GG[THH:MM])")
+    p.add_argument("--limite", type=_positivo, required=False, help="Righe per pagina (default: tutte)")
+    p.add_argument("--dopo", type=_cursore, required=False, help="Cursore della pagina precedente")
+    p.add_argument(
+        "--formato",
+        choices=("testo", "ndjson"),
+        default="testo",
+        help="ndjson: una riga JSON per record, il cursore della pagina successiva va su stderr",
+    )
+
+
 def build_parser() -> argparse.ArgumentParser:
     p = argparse.ArgumentParser(
         prog="cinema-ticketing-cli",
@@ -154,6 +376,45 @@ def build_parser() -> argparse.ArgumentParser:
         help="Percorso file stato (JSON) per mantenere ordini/pagamenti tra comandi (default: .cinema_state.json)",
     )
 
+    p.add_argument(
+        "--storage",
+        choices=("json", "journal", "sqlite", "partizioni"),
+        default="json",
+        help=(
+            "json: riscrive lo stato a ogni comando; journal: snapshot + log append-only delle modifiche; "
+            "sqlite: database SQLite accanto al file di stato (importato dal JSON al primo avvio); "
+            "partizioni: un file per spettacolo/secchio in <state-file>.d, riscritti solo se modificati"
+        ),
+    )
+
+    p.add_argument(
+        "--notifiche",
+        choices=("sincrone", "async"),
+        default="sincrone",
+        help=(
+            "sincrone: invio diretto durante il comando; async: outbox durevole (<state-file>.outbox) "
+            "consegnata da worker in background, con ritentativi"
+        ),
+    )
+
+    p.add_argument(
+        "--profile",
+        action="store_true",
+        help="Al termine stampa su stderr il tempo per stadio (servizi, repository, gateway, load/save)",
+    )
+
+    p.add_argument(
+        "--cprofile",
+        action="store_true",
+        help="Come --profile, in più esegue il comando sotto cProfile e ne stampa le funzioni più costose",
+    )
+
+    p.add_argument(
+        "--metriche-prometheus",
+        metavar="FILE",
+        help="Scrive chiamate, errori e istogrammi di latenza in formato testo Prometheus (con serve: a ogni salvataggio)",
+    )
+
     sub = p.add_subparsers(dest="cmd", required=True)
 
     sub.add_parser("list-shows", help="Elenca gli spettacoli")
@@ -161,14 +422,30 @@ def build_parser() -> argparse.ArgumentParser:
     sp = sub.add_parser("show-seats", help="Mostra posti liberi per uno spettacolo")
     sp.add_argument("--spettacolo", required=True)
 
-    b = sub.add_parser("buy", help="Avvia acquisto (blocca posto + ordine + avvio pagamento)")
+    b = sub.add_parser("buy", help="Avvia acquisto (blocca posti + ordine + avvio pagamento)")
     b.add_argument("--cliente", required=True, help="ID cliente (es: c1, c2)")
     b.add_argument("--spettacolo", required=True, help="ID spettacolo (es: sp1, sp2)")
-    b.add_argument("--posto", required=True, help="Etichetta posto (es: A1, B3)")
+    scelta = b.add_mutually_exclusive_group(required=True)
+    scelta.add_argument(
+        "--posto",
+        nargs="+",
+        help="Una o più etichette posto, bloccate tutte o nessuna in un unico ordine (es: A1 oppure A1 A2 A3)",
+    )
+    scelta.add_argument(
+        "--quantita",
+        type=int,
+        help="Numero di posti contigui: sceglie il miglior blocco libero (centrale, righe centrali-posteriori)",
+    )
 
     wh = sub.add_parser("webhook", help="Simula webhook esito pagamento")
     wh.add_argument("--pagamento", required=True, help="ID pagamento (pay_...)")
     wh.add_argument("--esito", required=True, help="AUTORIZZATO | RIFIUTATO | ANNULLATO")
+    wh.add_argument(
+        "--transaction-ref",
+        required=False,
+        help="Riferimento transazione del provider (default: quello del checkout); con pagamento ed esito "
+        "identifica la consegna, i duplicati restituiscono il risultato originale",
+    )
 
     wj = sub.add_parser("waitlist-join", help="Iscrivi cliente alla lista d'attesa per uno spettacolo")
     wj.add_argument("--cliente", required=True)
@@ -176,15 +453,50 @@ def build_parser() -> argparse.ArgumentParser:
 
     sub.add_parser("waitlist-process", help="Processa lista d'attesa (simula timer)")
 
-    wl = sub.add_parser("waitlist-list", help="Elenca iscrizioni lista d'attesa")
+    wl = sub.add_parser("waitlist-list", help="Elenca iscrizioni lista d'attesa in ordine di iscrizione")
     wl.add_argument("--spettacolo", required=False)
+    wl.add_argument("--cliente", required=False)
+    wl.add_argument("--notificato", choices=("si", "no"), required=False)
+    _argomenti_elenco(wl)
+
+    ol = sub.add_parser("orders-list", help="Elenca ordini in ordine di creazione")
+    ol.add_argument("--cliente", required=False, help="Solo gli ordini di un cliente")
+    ol.add_argument("--spettacolo", required=False, help="Solo gli ordini di uno spettacolo")
+    ol.add_argument("--stato", choices=[s.value for s in StatoOrdine], required=False)
+    _argomenti_elenco(ol)
 
-    sub.add_parser("orders-list", help="Elenca ordini")
+    rp = sub.add_parser("report", help="Ricavi, occupazione, conversione e abbandono degli hold")
+    rp.add_argument("--formato", choices=("testo", "json"), default="testo")
+    rp.add_argument("--ricalcola", action="store_true", help="Ricostruisce gli aggregati scorrendo tutti gli ordini")
 
     af = sub.add_parser("admin-free-seat", help="Libera un posto per simulare cancellazioni e far scattare la waitlist")
     af.add_argument("--spettacolo", required=True)
     af.add_argument("--posto", required=True)
 
+    sc = sub.add_parser("schedule", help="Genera gli spettacoli di un periodo da regole film × sala × orari")
+    sc.add_argument(
+        "--regole",
+        required=True,
+        help='File JSON: [{"film_id", "sala_id", "orari": ["18:00"], "prezzo_eur", "giorni": ["sab", "dom"]}]',
+    )
+    sc.add_argument("--dal", type=_data, required=True, help="Primo giorno (AAAA-MM-GG)")
+    sc.add_argument("--al", type=_data, required=True, help="Giorno finale escluso (AAAA-MM-GG)")
+    sc.add_argument("--pausa", type=int, default=0, help="Minuti tra la fine di un film e lo spettacolo successivo")
+
+    sv = sub.add_parser("serve", help="Avvia il servizio HTTP (JSON) con lo stato residente in memoria")
+    sv.add_argument("--host", default="127.0.0.1")
+    sv.add_argument("--port", type=int, default=8080)
+    sv.add_argument(
+        "--intervallo-salvataggio",
+        type=float,
+        default=1.0,
+        help="Secondi tra un salvataggio e l'altro, solo se lo stato è cambiato (default: 1)",
+    )
+
+    cs = sub.add_parser("convert-state", help="Converte il file di stato tra formato JSON e snapshot binario")
+    cs.add_argument("--formato", required=True, choices=FORMATI)
+    cs.add_argument("--output", required=False, help="File di destinazione (default: sovrascrive --state-file)")
+
     return p
 
 
@@ -192,26 +504,91 @@ def main() -> int:
     parser = build_parser()
     args = parser.parse_args()
 
-    ctx = build_app_context(state_file=args.state_file)
+    if args.cmd == "convert-state":
+        return cmd_convert_state(args.state_file, args.formato, args.output)
 
+    metriche = Metriche() if args.profile or args.cprofile or args.metriche_prometheus else None
+    profiler = cProfile.Profile() if args.cprofile else None
+    if profiler:
+        profiler.enable()
+    try:
+        ctx = build_app_context(
+            state_file=args.state_file,
+            storage=args.storage,
+            tabelle=TABELLE_COMANDI.get(args.cmd),
+            notifiche_async=args.notifiche == "async",
+            metriche=metriche,
+        )
+        try:
+            if metriche:
+                with metriche.misura(f"comando.{args.cmd}"):
+                    return esegui_comando(ctx, args, parser)
+            return esegui_comando(ctx, args, parser)
+        finally:
+            ctx.chiudi()
+    finally:
+        if profiler:
+            profiler.disable()
+        _rapporto_profilo(metriche, profiler, args.profile or args.cprofile, args.metriche_prometheus)
+
+
+def _rapporto_profilo(
+    metriche: Optional[Metriche], profiler: Optional[cProfile.Profile], stampa: bool, file_prometheus: str | None
+) -> None:
+    if metriche and stampa:
+        metriche.stampa_profilo(sys.stderr)
+    if profiler:
+        print("-- cProfile (prime 25 per tempo cumulativo) --", file=sys.stderr)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(25)
+    if metriche and file_prometheus:
+        metriche.esporta_prometheus(file_prometheus)
+
+
+def esegui_comando(ctx, args: argparse.Namespace, parser: argparse.ArgumentParser) -> int:
     if args.cmd == "list-shows":
         return cmd_list_shows(ctx)
     if args.cmd == "show-seats":
         return cmd_show_seats(ctx, args.spettacolo)
     if args.cmd == "buy":
-        return cmd_buy(ctx, args.cliente, args.spettacolo, args.posto)
+        return cmd_buy(ctx, args.cliente, args.spettacolo, args.posto, args.quantita)
     if args.cmd == "webhook":
-        return cmd_webhook(ctx, args.pagamento, args.esito)
+        return cmd_webhook(ctx, args.pagamento, args.esito, args.transaction_ref)
     if args.cmd == "waitlist-join":
         return cmd_waitlist_join(ctx, args.cliente, args.spettacolo)
     if args.cmd == "waitlist-process":
         return cmd_waitlist_process(ctx)
     if args.cmd == "waitlist-list":
-        return cmd_waitlist_list(ctx, args.spettacolo)
+        return cmd_waitlist_list(
+            ctx,
+            args.spettacolo,
+            args.cliente,
+            None if args.notificato is None else args.notificato == "si",
+            args.dal,
+            args.al,
+            args.limite,
+            args.dopo,
+            args.formato,
+        )
     if args.cmd == "orders-list":
-        return cmd_orders_list(ctx)
+        return cmd_orders_list(
+            ctx,
+            args.cliente,
+            args.spettacolo,
+            StatoOrdine(args.stato) if args.stato else None,
+            args.dal,
+            args.al,
+            args.limite,
+            args.dopo,
+            args.formato,
+        )
+    if args.cmd == "report":
+        return cmd_report(ctx, args.formato, args.ricalcola)
     if args.cmd == "admin-free-seat":
         return cmd_admin_free_seat(ctx, args.spettacolo, args.posto)
+    if args.cmd == "schedule":
+        return cmd_schedule(ctx, args.regole, args.dal, args.al, args.pausa)
+    if args.cmd == "serve":
+        return cmd_serve(ctx, args.host, args.port, args.intervallo_salvataggio, args.metriche_prometheus)
 
     parser.print_help()
     return 1